@@ -0,0 +1,111 @@
+import json
+import math
+import os
+import uuid
+from TileCache import TileCache
+
+
+class CropCache:
+    """A class that persists where each input image was cropped to fit a tile, so that repeat runs, including runs at
+    other tile sizes with the same aspect ratio, don't search for the crop again. Crop positions are stored in the tile
+    cache directory in a JSON file per crop mode, along with the modification time and size of each image, keyed by
+    the tile's aspect ratio.
+
+    :method load: returns the crop positions known for the given images
+    :method save: records crop positions found for images
+    """
+
+    VERSION = 1
+
+    def __init__(self, input_directory_path, crop_mode, tile_height, tile_width):
+        """Initialise the location of the cache file.
+
+        :param input_directory_path: the path to the directory of the input images
+        :param crop_mode: the crop mode the positions were found with
+        :param tile_height: the height of each tile in pixels
+        :param tile_width: the width of each tile in pixels
+        """
+
+        divisor = math.gcd(tile_height, tile_width)
+        self.__input_directory_path = input_directory_path
+        self.__cache_path = os.path.join(input_directory_path, TileCache.CACHE_DIRECTORY_NAME,
+                                         f'crops_{crop_mode}.json')
+        self.__aspect_ratio = f'{tile_width // divisor}:{tile_height // divisor}'
+        self.__entries = None
+
+    def load(self, file_paths):
+        """Returns the crop positions recorded for the given images at the tile's aspect ratio, for images that haven't
+        changed since.
+
+        :param file_paths: the paths of the images
+        :return: dictionary of file paths to crop positions
+        """
+
+        self.__entries = self.__read_entries()
+        crop_positions = {}
+        for file_path in file_paths:
+            entry = self.__entries.get(os.path.relpath(file_path, self.__input_directory_path))
+            if entry is None or self.__aspect_ratio not in entry['positions']:
+                continue
+            try:
+                if (entry['mtime_ns'], entry['size']) == self.__get_signature(file_path):
+                    crop_positions[file_path] = entry['positions'][self.__aspect_ratio]
+            except OSError:
+                pass
+        return crop_positions
+
+    def save(self, crop_positions):
+        """Records crop positions found for images at the tile's aspect ratio, keeping those recorded for other aspect
+        ratios of images that haven't changed. Failures to write the cache are ignored.
+
+        :param crop_positions: dictionary of file paths to crop positions
+        """
+
+        entries = self.__entries if self.__entries is not None else self.__read_entries()
+        changed = False
+        for file_path, crop_position in crop_positions.items():
+            path = os.path.relpath(file_path, self.__input_directory_path)
+            try:
+                mtime_ns, size = self.__get_signature(file_path)
+            except OSError:
+                continue
+            entry = entries.get(path)
+            if entry is None or (entry['mtime_ns'], entry['size']) != (mtime_ns, size):
+                entry = entries[path] = {'mtime_ns': mtime_ns, 'size': size, 'positions': {}}
+            if entry['positions'].get(self.__aspect_ratio) != crop_position:
+                entry['positions'][self.__aspect_ratio] = crop_position
+                changed = True
+        self.__entries = entries
+        if not changed:
+            return
+
+        temp_path = f'{self.__cache_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.__cache_path), exist_ok=True)
+            with open(temp_path, 'w') as cache_file:
+                json.dump({'version': self.VERSION, 'entries': entries}, cache_file)
+            os.replace(temp_path, self.__cache_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def __read_entries(self):
+        """Reads the cached entries, returning an empty dictionary if the cache is missing, unreadable or from a
+        different version.
+        """
+
+        try:
+            with open(self.__cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        return cache.get('entries', {}) if cache.get('version') == self.VERSION else {}
+
+    @staticmethod
+    def __get_signature(file_path):
+        """Returns the modification time and size of a file."""
+
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,64 @@
+import collections
+import threading
+
+
+class FairQueue:
+    """A class for a thread-safe queue of jobs from several clients, which are taken in turn from each client with jobs
+    waiting, so that a client that submits many jobs can't hold up the others. Each client's jobs are taken in the
+    order they were put.
+
+    :method put: adds a job for a client
+    :method get: removes and returns the next job, waiting for one if there are none
+    :method get_lengths: returns the number of jobs waiting for each client
+    """
+
+    def __init__(self, max_length=None):
+        """Initialise the empty queue.
+
+        :param max_length: the maximum number of jobs waiting at once, or None for no limit (default None)
+        """
+
+        self.__max_length = max_length
+        self.__jobs = collections.OrderedDict()  # client to deque of their jobs, in the order clients take turns
+        self.__length = 0
+        self.__condition = threading.Condition()
+
+    def put(self, client, job):
+        """Adds a job for a client. Raises QueueFullError if max_length jobs are already waiting.
+
+        :param client: a hashable identifying the client
+        :param job: the job
+        """
+
+        with self.__condition:
+            if self.__max_length is not None and self.__length >= self.__max_length:
+                raise QueueFullError(f'{self.__length} jobs are already waiting.')
+            self.__jobs.setdefault(client, collections.deque()).append(job)
+            self.__length += 1
+            self.__condition.notify()
+
+    def get(self):
+        """Removes and returns the next job, from the client whose turn it is, waiting until there is one."""
+
+        with self.__condition:
+            while not self.__jobs:
+                self.__condition.wait()
+            client, client_jobs = next(iter(self.__jobs.items()))
+            job = client_jobs.popleft()
+            del self.__jobs[client]
+            if client_jobs:
+                self.__jobs[client] = client_jobs  # moves the client to the back of the turn order
+            self.__length -= 1
+            return job
+
+    def get_lengths(self):
+        """Returns a dictionary of the number of jobs waiting for each client with any."""
+
+        with self.__condition:
+            return {client: len(client_jobs) for client, client_jobs in self.__jobs.items()}
+
+
+class QueueFullError(Exception):
+    """A class for exceptions raised when a job is put in a FairQueue that is full."""
+
+    pass
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+from PIL import Image, ImageSequence
+from TileLoader import convert_to_rgb
+
+FRAME_EXTENSIONS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+
+
+class FrameSequence:
+    """A class that reads the frames of a sequence one at a time, so that the whole sequence is never held in memory.
+    A sequence is a directory of images, read in name order, an animated image (e.g. a GIF, animated PNG or WebP), or
+    a video, which is decoded with imageio if it is installed. Frames needn't all be the same size, but a photomosaic
+    generator only reuses the tiles matched to the last frame when the next needs tiles of the same size.
+
+    :method get_frame_count: returns the number of frames, if it is known before they are read
+    :method read_frames: yields each frame in turn
+    """
+
+    def __init__(self, path):
+        """Initialise the sequence, finding the frames of a directory or checking that a file can be read.
+
+        :param path: the path to the directory, animated image or video
+        """
+
+        self.__path = path
+        self.__file_paths = None  # the frames of a directory, else None
+        self.__frame_count = None
+        self.__is_video = False
+
+        if os.path.isdir(path):
+            self.__file_paths = sorted(os.path.join(path, file_name) for file_name in os.listdir(path)
+                                       if os.path.splitext(file_name)[1].lower() in FRAME_EXTENSIONS)
+            if not self.__file_paths:
+                raise ValueError(f'Directory {path!r} has no frames. Expected images with one of the extensions '
+                                 f'{", ".join(FRAME_EXTENSIONS)}.')
+            self.__frame_count = len(self.__file_paths)
+            return
+
+        try:
+            with Image.open(path) as image:
+                self.__frame_count = getattr(image, 'n_frames', 1)
+        except FileNotFoundError:
+            raise
+        except OSError:  # not an image, so read as a video
+            self.__is_video = True
+
+    def get_frame_count(self):
+        """Returns the number of frames, or None for videos, whose frames are only counted as they are read."""
+
+        return self.__frame_count
+
+    def read_frames(self):
+        """Yields each frame of the sequence in turn.
+
+        :return: generator of uint8 arrays with shape (height, width, 3)
+        """
+
+        if self.__file_paths is not None:
+            for file_path in self.__file_paths:
+                with Image.open(file_path) as image:
+                    yield np.asarray(convert_to_rgb(image))
+        elif self.__is_video:
+            yield from self.__read_video_frames()
+        else:
+            with Image.open(self.__path) as image:
+                for frame in ImageSequence.Iterator(image):
+                    yield np.asarray(convert_to_rgb(frame))
+
+    def __read_video_frames(self):
+        """Yields each frame of a video, decoded by imageio."""
+
+        try:
+            import imageio.v3 as iio
+        except ImportError:
+            raise ValueError(f"Can't read {self.__path!r}. It isn't an image or a directory of images, and videos can "
+                             f'only be read with imageio installed.')
+
+        for frame in iio.imiter(self.__path):
+            if frame.ndim == 2:
+                frame = np.stack((frame,) * 3, axis=-1)
+            yield np.ascontiguousarray(frame[:, :, :3], dtype=np.uint8)
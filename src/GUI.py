@@ -10,12 +10,15 @@ class Window(QtWidgets.QMainWindow):
     """A class that contains the methods and attributes for a photomosaic GUI.
 
     :method closeEvent: closes the window
+    :method generate_photomosaic: generates a photomosaic as the generate photomosaic button does
     """
 
     preprocessing_images_started = pyqtSignal()
     tile_matching_started = pyqtSignal()
     generating_photomosaic_finished = pyqtSignal()
     exception_raised = pyqtSignal()
+    progress_reported = pyqtSignal(object)
+    preview_updated = pyqtSignal(object)
 
     def __init__(self, photomosaic_generator):
         """Initialises the Window object's attributes."""
@@ -81,14 +84,27 @@ class Window(QtWidgets.QMainWindow):
         self.tile_matching_started.connect(self.__on_tile_matching_started)
         self.generating_photomosaic_finished.connect(self.__on_generating_photomosaic_finished)
         self.exception_raised.connect(self.__on_exception_raised)
+        self.progress_reported.connect(self.__on_progress_reported)
+        self.photomosaic_generator.add_progress_callback(self.progress_reported.emit)  # progress is reported on the
+        # generating thread, so it is passed to the GUI thread through a signal
+        self.preview_updated.connect(self.__on_preview_updated)
+        self.photomosaic_generator.add_preview_callback(self.preview_updated.emit)  # likewise for previews
 
         self.show()
 
     def closeEvent(self, event):
         """Event of closing the window."""
 
+        self.photomosaic_generator.close()
         sys.exit()
 
+    def generate_photomosaic(self):
+        """Generates a photomosaic from the target image and input image directory already set, as the generate
+        photomosaic button does. generating_photomosaic_finished is emitted when it is done.
+        """
+
+        self.__generate_photomosaic()
+
     def __set_input_dir(self):
         """Setting the input directory."""
 
@@ -147,6 +163,25 @@ class Window(QtWidgets.QMainWindow):
 
         self.progress_window.hide()
 
+    @pyqtSlot(object)
+    def __on_progress_reported(self, event):
+        """Function to connect progress being reported to updating the progress bar."""
+
+        self.progress_window.show_progress(event)
+
+    @pyqtSlot(object)
+    def __on_preview_updated(self, preview):
+        """Function to connect a preview of the photomosaic being made to displaying it, so that the photomosaic is
+        painted progressively as bands of rows are combined.
+        """
+
+        height, width, channel = preview.shape
+        bytesPerLine = 3 * width
+        qImg = QtGui.QImage(preview.data, width, height, bytesPerLine, QtGui.QImage.Format_RGB888)
+        pixmap = QtGui.QPixmap.fromImage(qImg).scaled(800, 800, Qt.KeepAspectRatio)
+        self.image.setPixmap(pixmap)
+        self.resize(pixmap.width(), pixmap.height())
+
     @pyqtSlot()
     def __on_exception_raised(self):
         """Function to connect exceptions being raised to error message windows being created."""
@@ -166,20 +201,10 @@ class Window(QtWidgets.QMainWindow):
                                                               self.y_tiles_spin_box.value())
 
                 self.tile_matching_started.emit()
-                self.photomosaic_generator.generate_photomosaic()
-
-                img = self.photomosaic_generator.get_output_image()
-
-                # displaying photomosaic
-                height, width, channel = img.shape
-                bytesPerLine = 3 * width
-                qImg = QtGui.QImage(img, width, height, bytesPerLine, QtGui.QImage.Format_RGB888)
-                pixmap = QtGui.QPixmap.fromImage(qImg).scaled(800, 800, Qt.KeepAspectRatio)
-                self.image.setPixmap(pixmap)
-                self.resize(pixmap.width(), pixmap.height())
+                self.photomosaic_generator.generate_photomosaic()  # the photomosaic is displayed through
+                # preview_updated as it is combined
 
                 self.generating_photomosaic_finished.emit()
-                self.show()
             except MemoryError:
                 self.error_msg = 'Too much memory used. Try increasing the row/column count, removing some images' \
                                  ' from the input directory, or reducing the size of the target image.'
@@ -220,8 +245,8 @@ class Window(QtWidgets.QMainWindow):
         else:
             options = QtWidgets.QFileDialog.Options()
             options |= QtWidgets.QFileDialog.DontUseNativeDialog
-            file_name, file_type = QtWidgets.QFileDialog.getSaveFileName(self, 'Save photomosaic', '..',
-                                                                         'jpg (*.jpg);;png (*.png)', options=options)
+            file_name, file_type = QtWidgets.QFileDialog.getSaveFileName(
+                self, 'Save photomosaic', '..', 'jpg (*.jpg);;png (*.png);;tif (*.tif);;dzi (*.dzi)', options=options)
             file_type = file_type[-5:-1]
             if file_name != '':
                 self.photomosaic_generator.save_image(file_name + file_type if file_name[-4:] != file_type else
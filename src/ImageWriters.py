@@ -0,0 +1,426 @@
+import math
+import os
+import struct
+import zlib
+import numpy as np
+from PIL import Image
+
+
+class PngBandWriter:
+    """A class that writes an RGB PNG one horizontal band of rows at a time, so that the whole image never has to be
+    held in memory.
+
+    :method write_band: compresses and writes the next band of rows
+    :method close: finishes the PNG and closes the file
+    """
+
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    def __init__(self, file_path, height, width, compression_level=6):
+        """Opens the file and writes the PNG header.
+
+        :param file_path: the path to write the PNG to
+        :param height: the height of the image in pixels
+        :param width: the width of the image in pixels
+        :param compression_level: the zlib compression level from 0 to 9 (default 6)
+        """
+
+        self.__height = height
+        self.__width = width
+        self.__rows_written = 0
+        self.__compressor = zlib.compressobj(compression_level)
+        self.__file = open(file_path, 'wb')
+        self.__file.write(self.SIGNATURE)
+        self.__write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def write_band(self, band):
+        """Compresses and writes the next band of rows.
+
+        :param band: uint8 array with shape (row_count, width, 3)
+        """
+
+        if band.shape[1:] != (self.__width, 3):
+            raise ValueError(f'Band has shape {band.shape} but the image is {self.__width} pixels wide.')
+        if self.__rows_written + len(band) > self.__height:
+            raise ValueError(f'Image is only {self.__height} pixels high.')
+
+        # the first byte of each scanline is its filter type, which is left as 0 (none)
+        scanlines = np.zeros((len(band), 1 + self.__width * 3), dtype=np.uint8)
+        scanlines[:, 1:] = np.reshape(band, (len(band), -1))
+        self.__write_chunk(b'IDAT', self.__compressor.compress(scanlines.tobytes()))
+        self.__rows_written += len(band)
+
+    def close(self):
+        """Finishes the PNG and closes the file. Raises ValueError if fewer rows were written than the image height."""
+
+        if self.__file.closed:
+            return
+        try:
+            if self.__rows_written != self.__height:
+                raise ValueError(f'Only {self.__rows_written} of {self.__height} rows were written.')
+            self.__write_chunk(b'IDAT', self.__compressor.flush())
+            self.__write_chunk(b'IEND', b'')
+        finally:
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.__file.close()
+
+    def __write_chunk(self, chunk_type, data):
+        """Writes a PNG chunk, skipping empty IDAT chunks."""
+
+        if chunk_type == b'IDAT' and not data:
+            return
+        self.__file.write(struct.pack('>I', len(data)))
+        self.__file.write(chunk_type)
+        self.__file.write(data)
+        self.__file.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+class TiffBandWriter:
+    """A class that writes an RGB tiled TIFF one horizontal band of rows at a time, buffering only one row of tiles.
+    Images too large for the 4 GB offsets of classic TIFF are written as BigTIFF. Tiles are deflate compressed by
+    default, and their offsets are written in the image file directory at the end of the file.
+
+    :method write_band: writes the next band of rows, compressing each row of tiles as it is completed
+    :method close: writes the image file directory and closes the file
+    """
+
+    TILE_SIZE = 256
+    BIGTIFF_BYTES = 2 ** 32 - 2 ** 25  # images with more pixel bytes than this are written as BigTIFF, leaving room
+    # for the image file directory
+    SHORT, LONG, LONG8 = 3, 4, 16
+    FIELD_FORMATS = {SHORT: 'H', LONG: 'I', LONG8: 'Q'}
+
+    def __init__(self, file_path, height, width, tile_size=TILE_SIZE, compression_level=6):
+        """Opens the file and writes the TIFF header.
+
+        :param file_path: the path to write the TIFF to
+        :param height: the height of the image in pixels
+        :param width: the width of the image in pixels
+        :param tile_size: the height and width of each tile, a multiple of 16 (default TILE_SIZE)
+        :param compression_level: the zlib compression level from 0 to 9, where 0 leaves the tiles uncompressed
+         (default 6)
+        """
+
+        if tile_size <= 0 or tile_size % 16:
+            raise ValueError(f'Invalid TIFF tile size {tile_size!r}. Expected a positive multiple of 16.')
+
+        self.__height = height
+        self.__width = width
+        self.__tile_size = tile_size
+        self.__compression_level = compression_level
+        self.__is_bigtiff = height * width * 3 > self.BIGTIFF_BYTES
+        self.__tile_row = np.zeros((tile_size, math.ceil(width / tile_size) * tile_size, 3), dtype=np.uint8)
+        self.__tile_row_rows = 0  # the number of rows of the image in __tile_row
+        self.__rows_written = 0
+        self.__tile_offsets = []
+        self.__tile_byte_counts = []
+        self.__file = open(file_path, 'wb')
+        if self.__is_bigtiff:
+            self.__file.write(b'II' + struct.pack('<HHHQ', 43, 8, 0, 0))
+        else:
+            self.__file.write(b'II' + struct.pack('<HI', 42, 0))
+
+    def write_band(self, band):
+        """Writes the next band of rows, compressing and writing each row of tiles as it is completed.
+
+        :param band: uint8 array with shape (row_count, width, 3)
+        """
+
+        if band.shape[1:] != (self.__width, 3):
+            raise ValueError(f'Band has shape {band.shape} but the image is {self.__width} pixels wide.')
+        if self.__rows_written + len(band) > self.__height:
+            raise ValueError(f'Image is only {self.__height} pixels high.')
+
+        start = 0
+        while start < len(band):
+            row_count = min(len(band) - start, self.__tile_size - self.__tile_row_rows)
+            self.__tile_row[self.__tile_row_rows:self.__tile_row_rows + row_count, :self.__width] = \
+                band[start:start + row_count]
+            self.__tile_row_rows += row_count
+            self.__rows_written += row_count
+            start += row_count
+            if self.__tile_row_rows == self.__tile_size or self.__rows_written == self.__height:
+                self.__write_tile_row()
+
+    def close(self):
+        """Writes the image file directory and closes the file. Raises ValueError if fewer rows were written than the
+        image height.
+        """
+
+        if self.__file.closed:
+            return
+        try:
+            if self.__rows_written != self.__height:
+                raise ValueError(f'Only {self.__rows_written} of {self.__height} rows were written.')
+            self.__write_image_file_directory()
+        finally:
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.__file.close()
+
+    def __write_tile_row(self):
+        """Writes the buffered row of tiles left to right, padding the tiles at the bottom and right edges."""
+
+        self.__tile_row[self.__tile_row_rows:] = 0
+        for x in range(0, self.__tile_row.shape[1], self.__tile_size):
+            data = np.ascontiguousarray(self.__tile_row[:, x:x + self.__tile_size]).tobytes()
+            if self.__compression_level:
+                data = zlib.compress(data, self.__compression_level)
+            self.__tile_offsets.append(self.__file.tell())
+            self.__tile_byte_counts.append(len(data))
+            self.__file.write(data)
+        self.__tile_row_rows = 0
+
+    def __write_image_file_directory(self):
+        """Writes the image file directory, with any field values too large to fit in it written just before it, and
+        points the header at it.
+        """
+
+        offset_type = self.LONG8 if self.__is_bigtiff else self.LONG
+        fields = [(256, self.LONG, [self.__width]),
+                  (257, self.LONG, [self.__height]),
+                  (258, self.SHORT, [8, 8, 8]),  # bits per sample
+                  (259, self.SHORT, [8 if self.__compression_level else 1]),  # deflate or no compression
+                  (262, self.SHORT, [2]),  # RGB
+                  (277, self.SHORT, [3]),  # samples per pixel
+                  (284, self.SHORT, [1]),  # chunky planar configuration
+                  (322, self.LONG, [self.__tile_size]),
+                  (323, self.LONG, [self.__tile_size]),
+                  (324, offset_type, self.__tile_offsets),
+                  (325, offset_type, self.__tile_byte_counts)]
+
+        value_size, count_format = (8, 'Q') if self.__is_bigtiff else (4, 'I')
+        entries = []
+        for tag, field_type, values in fields:
+            data = struct.pack(f'<{len(values)}{self.FIELD_FORMATS[field_type]}', *values)
+            if len(data) > value_size:
+                self.__align()
+                value_offset = self.__file.tell()
+                self.__file.write(data)
+                data = struct.pack(f'<{count_format}', value_offset)
+            entries.append(struct.pack(f'<HH{count_format}', tag, field_type, len(values)) +
+                           data.ljust(value_size, b'\0'))
+
+        self.__align()
+        image_file_directory_offset = self.__file.tell()
+        self.__file.write(struct.pack(f'<{"Q" if self.__is_bigtiff else "H"}', len(entries)))
+        self.__file.write(b''.join(entries))
+        self.__file.write(struct.pack(f'<{count_format}', 0))  # no next image file directory
+        self.__file.seek(8 if self.__is_bigtiff else 4)
+        self.__file.write(struct.pack(f'<{count_format}', image_file_directory_offset))
+
+    def __align(self):
+        """Pads the file to an even offset, as TIFF offsets must be word aligned."""
+
+        if self.__file.tell() % 2:
+            self.__file.write(b'\0')
+
+
+class DeepZoomBandWriter:
+    """A class that writes an RGB image as a Deep Zoom pyramid one horizontal band of rows at a time, so that huge
+    images can be viewed with a Deep Zoom viewer (e.g. OpenSeadragon) without ever being held in memory. The .dzi file
+    describes the pyramid, whose tiles are written to the <name>_files directory next to it, one directory per level.
+    Each level buffers only the rows of its current row of tiles and passes rows averaged in pairs to the level below.
+
+    :method write_band: writes the tiles completed by the next band of rows at every level
+    :method close: writes the remaining tiles and the .dzi file
+    """
+
+    TILE_SIZE = 254
+    OVERLAP = 1
+
+    def __init__(self, file_path, height, width, tile_size=TILE_SIZE, overlap=OVERLAP, tile_format='jpg', quality=90):
+        """Creates the tile directories.
+
+        :param file_path: the path of the .dzi file
+        :param height: the height of the image in pixels
+        :param width: the width of the image in pixels
+        :param tile_size: the height and width of each tile without its overlap (default TILE_SIZE)
+        :param overlap: the number of pixels each tile overlaps its neighbours by (default OVERLAP)
+        :param tile_format: 'jpg' or 'png' (default 'jpg')
+        :param quality: the JPEG quality of the tiles (default 90)
+        """
+
+        if tile_format not in ('jpg', 'png'):
+            raise ValueError(f'Unknown Deep Zoom tile format {tile_format!r}. Expected one of jpg, png.')
+
+        self.__file_path = file_path
+        self.__height = height
+        self.__width = width
+        self.__tile_size = tile_size
+        self.__overlap = overlap
+        self.__tile_format = tile_format
+        self.__rows_written = 0
+        self.__closed = False
+
+        tiles_directory_path = f'{os.path.splitext(file_path)[0]}_files'
+        max_level = math.ceil(math.log2(max(height, width, 1)))
+        self.__top_level = None
+        for level in range(max_level + 1):  # from the 1x1 level up, so each level can pass rows to the one below
+            scale = 2 ** (max_level - level)
+            self.__top_level = _DeepZoomLevel(os.path.join(tiles_directory_path, str(level)), math.ceil(height / scale),
+                                              math.ceil(width / scale), tile_size, overlap, tile_format, quality,
+                                              self.__top_level)
+
+    def write_band(self, band):
+        """Writes the tiles completed by the next band of rows at every level.
+
+        :param band: uint8 array with shape (row_count, width, 3)
+        """
+
+        if band.shape[1:] != (self.__width, 3):
+            raise ValueError(f'Band has shape {band.shape} but the image is {self.__width} pixels wide.')
+        if self.__rows_written + len(band) > self.__height:
+            raise ValueError(f'Image is only {self.__height} pixels high.')
+
+        self.__top_level.write_band(band)
+        self.__rows_written += len(band)
+
+    def close(self):
+        """Writes the remaining tiles of every level and then the .dzi file. Raises ValueError if fewer rows were
+        written than the image height.
+        """
+
+        if self.__closed:
+            return
+        self.__closed = True
+        if self.__rows_written != self.__height:
+            raise ValueError(f'Only {self.__rows_written} of {self.__height} rows were written.')
+
+        self.__top_level.close()
+        with open(self.__file_path, 'w') as dzi_file:
+            dzi_file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                           f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{self.__tile_format}" '
+                           f'Overlap="{self.__overlap}" TileSize="{self.__tile_size}">\n'
+                           f'  <Size Width="{self.__width}" Height="{self.__height}"/>\n'
+                           f'</Image>\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.__closed = True
+
+
+class _DeepZoomLevel:
+    """One level of a Deep Zoom pyramid, which writes its tiles as soon as the rows they cover have been written and
+    passes its rows, halved in size, on to the level below.
+    """
+
+    def __init__(self, directory_path, height, width, tile_size, overlap, tile_format, quality, next_level):
+        """Creates the level's tile directory.
+
+        :param directory_path: the directory the level's tiles are written to
+        :param height: the height of the level in pixels
+        :param width: the width of the level in pixels
+        :param tile_size: the height and width of each tile without its overlap
+        :param overlap: the number of pixels each tile overlaps its neighbours by
+        :param tile_format: 'jpg' or 'png'
+        :param quality: the JPEG quality of the tiles
+        :param next_level: the _DeepZoomLevel below, or None for the 1x1 level
+        """
+
+        os.makedirs(directory_path, exist_ok=True)
+        self.__directory_path = directory_path
+        self.__height = height
+        self.__width = width
+        self.__tile_size = tile_size
+        self.__overlap = overlap
+        self.__tile_format = tile_format
+        self.__quality = quality
+        self.__next_level = next_level
+        self.__rows = np.empty((0, width, 3), dtype=np.uint8)
+        self.__first_row = 0  # the row of the level that __rows starts at
+        self.__tile_row = 0  # the next row of tiles to write
+        self.__unpaired_row = None  # a row waiting for the row after it to be halved with
+
+    def write_band(self, band):
+        """Adds a band of rows, writing the rows of tiles it completes and passing the rows on to the level below."""
+
+        self.__rows = np.concatenate((self.__rows, band))
+        while self.__tile_row * self.__tile_size < self.__height and \
+                self.__first_row + len(self.__rows) >= min((self.__tile_row + 1) * self.__tile_size + self.__overlap,
+                                                           self.__height):
+            self.__write_tile_row()
+
+        if self.__next_level is not None:
+            if self.__unpaired_row is not None:
+                band = np.concatenate((self.__unpaired_row, band))
+            self.__unpaired_row = band[len(band) - len(band) % 2:]
+            if len(band) >= 2:
+                self.__next_level.write_band(self.__halve(band[:len(band) - len(band) % 2]))
+
+    def close(self):
+        """Passes any row left unpaired on to the level below, as the last row of an odd height, and closes it."""
+
+        if self.__next_level is not None:
+            if self.__unpaired_row is not None and len(self.__unpaired_row):
+                self.__next_level.write_band(self.__halve(np.concatenate((self.__unpaired_row, self.__unpaired_row))))
+            self.__next_level.close()
+
+    def __write_tile_row(self):
+        """Writes the next row of tiles and drops the rows that no later tile overlaps."""
+
+        top = max(0, self.__tile_row * self.__tile_size - self.__overlap)
+        bottom = min((self.__tile_row + 1) * self.__tile_size + self.__overlap, self.__height)
+        rows = self.__rows[top - self.__first_row:bottom - self.__first_row]
+        for column in range(math.ceil(self.__width / self.__tile_size)):
+            left = max(0, column * self.__tile_size - self.__overlap)
+            right = min((column + 1) * self.__tile_size + self.__overlap, self.__width)
+            tile_path = os.path.join(self.__directory_path, f'{column}_{self.__tile_row}.{self.__tile_format}')
+            Image.fromarray(np.ascontiguousarray(rows[:, left:right])).save(tile_path, quality=self.__quality)
+
+        self.__tile_row += 1
+        next_top = max(0, self.__tile_row * self.__tile_size - self.__overlap)
+        self.__rows = self.__rows[next_top - self.__first_row:]
+        self.__first_row = next_top
+
+    @staticmethod
+    def __halve(rows):
+        """Averages an even number of rows in 2x2 blocks, repeating the last column of an odd width.
+
+        :param rows: uint8 array with shape (row_count, width, 3)
+        :return: uint8 array with shape (row_count // 2, ceil(width / 2), 3)
+        """
+
+        if rows.shape[1] % 2:
+            rows = np.concatenate((rows, rows[:, -1:]), axis=1)
+        blocks = np.reshape(rows, (len(rows) // 2, 2, rows.shape[1] // 2, 2, 3)).astype(np.uint16)
+        return ((blocks.sum(axis=(1, 3)) + 2) // 4).astype(np.uint8)
+
+
+BAND_WRITERS = {'.png': PngBandWriter, '.tif': TiffBandWriter, '.tiff': TiffBandWriter, '.dzi': DeepZoomBandWriter}
+
+
+def open_band_writer(file_path, height, width):
+    """Opens a writer that streams an image to a file one band of rows at a time, chosen by the file extension.
+
+    :param file_path: the path to write the image to
+    :param height: the height of the image in pixels
+    :param width: the width of the image in pixels
+    :return: the band writer
+    """
+
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in BAND_WRITERS:
+        raise ValueError(f'Cannot stream images with extension {extension!r}. Supported extensions are '
+                         f'{", ".join(BAND_WRITERS)}.')
+    return BAND_WRITERS[extension](file_path, height, width)
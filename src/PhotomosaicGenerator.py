@@ -1,19 +1,42 @@
+import collections
 import contextlib
 import gc
-import itertools
-import sys
-import warnings
+import importlib
+import os
+import tempfile
 from glob import glob
-from multiprocessing import pool
 import numpy as np
-from sklearn import cluster
-from skimage import color, io, transform, util
+from PIL import Image
+from ImageWriters import BAND_WRITERS, open_band_writer
+from ProgressReporter import ProgressReporter
+from TileAssigner import TileAssigner
+from TargetReader import TargetReader
+from CropCache import CropCache
+from TileCache import TileCache
+from TileIndex import create_tile_index
+from TileLoader import CROP_MODES, TileLoader
+from TileMatchingPool import TileMatchingPool
+from TileRenderer import TileRenderer
+
+WARM_UP_MODULES = ('skimage.color', 'skimage.io', 'skimage.transform', 'skimage.util', 'sklearn.cluster',
+                   'sklearn.decomposition', 'sklearn.neighbors', 'scipy.ndimage', 'tifffile')  # imported when first
+# used, so that starting the GUI or CLI doesn't wait for them
+
+
+def warm_up():
+    """Imports the libraries that are otherwise imported when a photomosaic is first pre-processed or saved, so that
+    they can be loaded on a background thread while the user is still choosing the images.
+    """
+
+    for module_name in WARM_UP_MODULES:
+        importlib.import_module(module_name)
 
 
 class PhotomosaicGenerator:
     """A class to generate photomosaics
 
     :method set_target_image: sets the image that the photomosaic generator is recreating
+    :method set_target_frame: sets an image already in memory, such as a frame of a video, as the target
     :method set_input_directory_path: sets the directory from which the photomosaic tiles are retrieved
     :method pre_process_images: pre-processes the target image and images used as tiles for the photomosaic
     :method generate_photomosaic: creates a photomosaic from the pre-processed tiles and target image
@@ -23,59 +46,269 @@ class PhotomosaicGenerator:
     :method save_image: saves output image in given location
     :method get_output_image: returns a copy of the output image
     :method get_target_image: returns a copy of the target image
+    :method combine_tile_row: copies a row of tiles side by side into a band of an image
+    :method add_progress_callback: registers a function to be called with the progress of each stage
+    :method remove_progress_callback: unregisters a progress callback
+    :method add_preview_callback: registers a function to be called with a downsampled preview as rows are combined
+    :method remove_preview_callback: unregisters a preview callback
+    :method get_stage_durations: returns the time taken by each stage when it last ran
+    :method get_memory_usage: returns the number of bytes of images held by the generator
+    :method get_matched_cell_count: returns the number of cells matched by the last photomosaic
+    :method close: stops the processes that tiles are matched in and closes a streamed target
     """
 
-    def __init__(self):
-        """Initialise the attributes of the photomosaic generator."""
+    TILE_DTYPES = (np.uint8, np.float16, np.float32)
+    TARGET_BYTES_PER_PIXEL = 3 * (1 + 3 * 8)  # uint8 RGB plus roughly three float64 copies made while resizing with
+    # anti-aliasing
+    PROGRESS_BAND_CELLS = 4096  # targets held in memory are matched in bands of about this many cells so that
+    # progress is reported as they are matched
+    PARALLEL_MATCHING_CELLS = 16384  # grids with fewer cells than this are matched in a single process, as starting
+    # worker processes would take longer than matching them
+    RENDER_CACHE_BYTES = 256 * 1024 * 1024  # rendered tiles kept for reuse when tiles are rendered at a larger size
+    RENDER_BAND_BYTES = 256 * 1024 * 1024  # rows are combined in parts with at most this many bytes of rendered tiles
+    PREVIEW_SIZE = 800  # the longer side in pixels of previews of photomosaics with enough cells to fit in it
+    PREVIEW_SHRINK_BATCH = 4096  # the number of tiles shrunk to the preview's cell size at a time
+    SAVE_BAND_ROWS = 256  # the number of rows of the output image passed to a band writer at a time when saving
+
+    def __init__(self, use_tile_cache=True, tile_loader_backend='auto', tile_loader_workers=None, tile_dtype=np.uint8,
+                 tile_index='kdtree', memory_budget=None, tile_matcher_workers=None, max_tile_uses=None,
+                 no_repeat_radius=0, render_scale=1, crop_mode='center', change_threshold=0):
+        """Initialise the attributes of the photomosaic generator.
+
+        :param use_tile_cache: whether pre-processed tiles are cached on disk next to the input images (default True)
+        :param tile_loader_backend: 'threads', 'processes' or 'auto' to choose by CPU count (default 'auto')
+        :param tile_loader_workers: the number of threads or processes used to load tiles (default the number of CPUs)
+        :param tile_dtype: the data type tiles are stored as, one of uint8, float16 or float32; pixel values are always
+         in the range 0-255 (default uint8)
+        :param tile_index: the TileIndex used to search for tiles, or the name of one of TileIndex.TILE_INDEXES
+         ('cluster', 'kdtree', 'brute', 'pca', or 'lab' to match by perceptual CIELAB colour) (default 'kdtree')
+        :param memory_budget: if given, targets too large to pre-process within this many bytes are streamed: they are
+         read, resized and matched in horizontal bands sized to fit the budget instead of being loaded whole. Only
+         TIFFs and non-interlaced 8 bit PNGs can be decoded in bands; other targets are decoded whole, reduced to fit in
+         a quarter of the budget (JPEGs by decoding them at a smaller scale, other formats after decoding them, which
+         briefly needs memory for the whole image). Larger photomosaics are combined into a memory-mapped temporary
+         file instead of memory (default None)
+        :param tile_matcher_workers: the number of processes that bands of rows of large grids are matched in, which
+         gives the same result as matching in a single process (default the number of CPUs)
+        :param max_tile_uses: the maximum number of times each tile can be used, or None for no limit (default None)
+        :param no_repeat_radius: the number of cells around each cell that can't use the same tile (default 0)
+        :param render_scale: how many times larger tiles are in the photomosaic than the cells they are matched to.
+         Above 1, tiles are matched at the size of the target's cells and only the chosen tiles are loaded again from
+         their images at the larger size as rows are combined (default 1)
+        :param crop_mode: how images are fitted to the tiles' aspect ratio: 'stretch' to resize whole images, or
+         'center', 'entropy' or 'saliency' to crop them from the center, the most detailed position or the most salient
+         position. Crop positions found by searching are cached next to the input images with the tiles (default
+         'center')
+        :param change_threshold: when the tiles matched for the last photomosaic can be reused, only the cells whose
+         mean absolute difference (in 0-255 levels) from the target they were last matched to is more than this are
+         matched again. Above 0, small changes, such as noise between the frames of a video, keep their tiles until
+         they add up. Cells are compared with the cell at the same grid position, so only edits made in place benefit;
+         panning, cropping or reframing the target moves every cell, so every cell is matched again (default 0, to
+         match every cell that changed at all)
+        """
+
+        if np.dtype(tile_dtype) not in (np.dtype(dtype) for dtype in self.TILE_DTYPES):
+            raise ValueError(f'Unsupported tile data type {np.dtype(tile_dtype).name}. Expected one of '
+                             f'{", ".join(np.dtype(dtype).name for dtype in self.TILE_DTYPES)}.')
+        if crop_mode not in CROP_MODES:
+            raise ValueError(f'Unknown crop mode {crop_mode!r}. Expected one of {", ".join(CROP_MODES)}.')
+        if render_scale < 1:
+            raise ValueError(f'Invalid render scale {render_scale!r}. Expected at least 1.')
+        if change_threshold < 0:
+            raise ValueError(f'Invalid change threshold {change_threshold!r}. Expected at least 0.')
 
         self.__target_image = None
         self.__target_image_file_path = None
+        self.__target_image_signature = None  # path, modification time and size of the target image when it was read
+        self.__resized_target_image = None  # the target resized so that it can be split into tiles
+        self.__matched_target_image = None  # the resized target that __tile_cluster_indexes were last matched to
+        self.__matched_tile_set_generation = None  # the __tile_set_generation that __tile_cluster_indexes were last
+        # matched with
+        self.__change_threshold = change_threshold
+        self.__matched_cell_count = 0  # the number of cells matched by the last photomosaic
+        self.__memory_budget = memory_budget
+        self.__stream_target = False  # true if the target is too large for the memory budget and is read in bands
+        self.__target_size = None
+        self.__target_reader = None
 
         self.__input_images = None
-        self.__redo_pre_processing = True  # true if target image location or input image directory has changed else
-        # false
+        self.__input_image_file_paths = None  # the path of the image each of __input_images was made from
+        self.__input_images_tile_size = None  # the tile height and width that __input_images were resized to
+        self.__redo_target_pre_processing = True  # true if the target image or grid has changed else false
+        self.__redo_tile_pre_processing = True  # true if the input image directory has changed else false
         self.__input_directory_path = None
-
-        self.__clusters = None
+        self.__use_tile_cache = use_tile_cache
+        self.__tile_loader_backend = tile_loader_backend
+        self.__tile_loader_workers = tile_loader_workers
+        self.__tile_dtype = np.dtype(tile_dtype)
+        self.__crop_mode = crop_mode
+        self.__crop_positions = {}  # file paths of input images to the positions they were cropped at
+
+        self.__tile_index_setting = tile_index
+        self.__tile_index = None
+        self.__tile_cache = None
+        self.__tile_set_id = None  # identifies the cached tiles that __tile_index was fitted to
+        self.__tile_set_generation = 0  # incremented whenever the tiles are loaded or the tile index is fitted, so that
+        # matches made with earlier ones aren't reused, even when a TileIndex instance passed in is fitted again
         self.__tile_cluster_indexes = None
+        self.__tile_matcher_workers = tile_matcher_workers if tile_matcher_workers is not None else \
+            os.cpu_count() or 1
+        self.__tile_matching_pool = None
+        self.__tile_matching_pool_generation = None  # the __tile_set_generation of the tiles and tile index that
+        # __tile_matching_pool's workers match with
+        self.__tile_assigner = TileAssigner(max_tile_uses, no_repeat_radius) \
+            if max_tile_uses is not None or no_repeat_radius else None  # None if tiles are matched independently
 
         self.__column_count = None
         self.__row_count = None
         self.__tile_height = None
         self.__tile_width = None
+        self.__render_scale = render_scale
+        self.__render_tile_size = None  # the tile height and width in the photomosaic
+        self.__tile_renderer = None  # renders the chosen tiles at __render_tile_size, None if it is the matched size
 
         self.__output_image = None
 
+        self.__progress = ProgressReporter()
+        self.__preview_callbacks = []
+        self.__preview_tiles = None  # __input_images shrunk to the size of the preview's cells
+        self.__preview_image = None
+
+    def add_progress_callback(self, callback):
+        """Registers a function to be called with a ProgressReporter.ProgressEvent as each stage of pre-processing and
+        generation starts, progresses and finishes. Stages are 'pre_process_target', 'pre_process_tiles',
+        'fit_tile_index', 'match_tiles' and 'combine_tiles'. Callbacks are called on the thread doing the work.
+
+        :param callback: function taking a ProgressEvent
+        """
+
+        self.__progress.add_callback(callback)
+
+    def remove_progress_callback(self, callback):
+        """Unregisters a function added with add_progress_callback."""
+
+        self.__progress.remove_callback(callback)
+
+    def add_preview_callback(self, callback):
+        """Registers a function to be called with a preview of the photomosaic each time a band of rows is combined.
+        The preview is a uint8 array about PREVIEW_SIZE pixels on its longer side (more if there are more cells than
+        that), with rows not yet combined left black, made from tiles shrunk to its cells rather than by scaling the
+        output. The last preview is of the whole photomosaic. Callbacks are called on the thread doing the work.
+
+        :param callback: function taking the preview array
+        """
+
+        self.__preview_callbacks.append(callback)
+
+    def remove_preview_callback(self, callback):
+        """Unregisters a function added with add_preview_callback."""
+
+        self.__preview_callbacks.remove(callback)
+
+    def get_stage_durations(self):
+        """Returns a dictionary of the time in seconds taken by each stage when it last ran."""
+
+        return self.__progress.get_durations()
+
     def set_target_image(self, target_image_file_path):
-        """Sets the target image of the photomosaic generator.
+        """Sets the target image of the photomosaic generator. The image is read again if it is the same file but has
+        been modified since it was last set. Tiles are kept as long as the new target needs tiles of the same size.
 
         :param target_image_file_path: the path to the target image
         """
 
-        if self.__target_image_file_path != target_image_file_path:
+        from skimage import color, io, util
+
+        stat = os.stat(target_image_file_path)
+        target_image_signature = (target_image_file_path, stat.st_mtime_ns, stat.st_size)
+        if self.__target_image_signature != target_image_signature:
             self.__target_image_file_path = target_image_file_path
-            self.__redo_pre_processing = True
-            self.__target_image = io.imread(target_image_file_path)
-            if self.__target_image.shape[2] == 4:
-                self.__target_image = color.rgba2rgb(self.__target_image)
-        self.__target_image = util.img_as_ubyte(self.__target_image)
+            self.__target_image_signature = target_image_signature
+            self.__redo_target_pre_processing = True
+            self.__close_target_reader()
+
+            self.__stream_target = False
+            if self.__memory_budget is not None:
+                with Image.open(target_image_file_path) as image:
+                    self.__target_size = (image.size[1], image.size[0])
+                self.__stream_target = \
+                    self.__target_size[0] * self.__target_size[1] * self.TARGET_BYTES_PER_PIXEL > self.__memory_budget
+
+            if self.__stream_target:
+                self.__target_image = None
+            else:
+                self.__target_image = io.imread(target_image_file_path)
+                if self.__target_image.shape[2] == 4:
+                    self.__target_image = color.rgba2rgb(self.__target_image)
+        if not self.__stream_target:
+            self.__target_image = util.img_as_ubyte(self.__target_image)
         self.__output_image = self.__target_image
 
+    def set_target_frame(self, frame):
+        """Sets an image already in memory, such as a frame of a video, as the target image of the photomosaic
+        generator. Tiles are kept as long as the new target needs tiles of the same size, and if the grid is also
+        unchanged, the next photomosaic matches only the cells that have changed since the last one. Cells are compared
+        by grid position, so a frame that pans or is cropped differently has every cell matched again. A frame whose
+        size gives a different tile size (e.g. when a video's resolution or crop changes part way through) has its tiles
+        pre-processed again at the new size, so every cell is matched again.
+
+        :param frame: uint8 array with shape (height, width, 3)
+        """
+
+        self.__target_image_file_path = None
+        self.__target_image_signature = None
+        self.__redo_target_pre_processing = True
+        self.__close_target_reader()
+        self.__stream_target = False
+        self.__target_image = frame
+        self.__output_image = frame
+
     def get_num_images(self):
         return len(self.__input_images)
 
     def __pre_process_target(self):
-        """Resizes the target image so that it can have tiles of equal size."""
+        """Resizes the target image so that it can have tiles of equal size. Streamed targets are instead opened for
+        reading in bands, which are resized as they are matched.
+        """
+
+        from skimage import transform, util
+
+        target_height, target_width = self.__target_size if self.__stream_target else self.__target_image.shape[:2]
+
+        self.__tile_height = target_height // self.__row_count if self.__row_count < target_height else 1
+
+        self.__tile_width = target_width // self.__column_count if self.__column_count < target_width else 1
+
+        self.__render_tile_size = (max(1, round(self.__tile_height * self.__render_scale)),
+                                   max(1, round(self.__tile_width * self.__render_scale)))
+
+        if self.__stream_target:
+            self.__resized_target_image = None
+            self.__close_target_reader()
+            self.__get_target_reader()
+            return
+
+        self.__resized_target_image = util.img_as_ubyte(transform.resize(self.__target_image,
+                                                                         (self.__tile_height * self.__row_count,
+                                                                          self.__tile_width * self.__column_count),
+                                                                         anti_aliasing=True))
+
+    def __get_target_reader(self):
+        """Returns the reader of the streamed target image, opening it if it isn't open."""
 
-        self.__tile_height = self.__target_image.shape[0] // self.__row_count if \
-            self.__row_count < self.__target_image.shape[0] else 1
+        if self.__target_reader is None:
+            self.__target_reader = TargetReader(self.__target_image_file_path,
+                                                (self.__tile_height * self.__row_count,
+                                                 self.__tile_width * self.__column_count),
+                                                max(1, self.__memory_budget // 4))
+        return self.__target_reader
 
-        self.__tile_width = self.__target_image.shape[1] // self.__column_count if \
-            self.__column_count < self.__target_image.shape[1] else 1
+    def __close_target_reader(self):
+        """Closes the reader of a streamed target image, if one is open."""
 
-        self.__target_image = transform.resize(self.__target_image, (self.__tile_height * self.__row_count,
-                                                                     self.__tile_width * self.__column_count),
-                                               anti_aliasing=True)
+        if self.__target_reader is not None:
+            self.__target_reader.close()
+            self.__target_reader = None
 
     def set_input_directory_path(self, input_directory_path):
         """Stores the directory of the input images that will be used as tiles.
@@ -86,51 +319,129 @@ class PhotomosaicGenerator:
 
         if self.__input_directory_path != input_directory_path:
             self.__input_directory_path = input_directory_path
-            self.__redo_pre_processing = True
+            self.__redo_tile_pre_processing = True
 
-    def __pre_process_tiles(self, threads=7):
-        """Resizes and stores each image in the input image directory so that they can be used as tiles.
-
-        :param threads: the number of threads used to do this task (default 7)
+    def __pre_process_tiles(self):
+        """Resizes and stores each image in the input image directory so that they can be used as tiles. Tiles are
+        read from the on-disk tile cache where possible so that only new or changed images are decoded.
         """
 
-        del self.__input_images
+        self.__input_images = None
+        self.__tile_renderer = None
+        self.__preview_tiles = None
+        if not self.__use_tile_cache:
+            self.__tile_index = None
         gc.collect()  # garbage collects previous tiles so that multiple sets of tiles aren't held in memory
         # simultaneously
         types = ("jpeg", "jpg", "png")
         file_paths = []
         for type in types:
             file_paths.extend(glob(f"{self.__input_directory_path}/**/*.{type}", recursive=True))
-        with contextlib.closing(pool.ThreadPool(threads)) as p:
-            self.__input_images = \
-                np.array(list(filter(lambda image: image is not None, p.map(self.__pre_process_tile, file_paths))))
 
-    def __pre_process_tile(self, file_path):
-        """Opens an image and resizes it to be the correct height and width for a tile.
+        self.__progress.start_stage('pre_process_tiles', len(file_paths))
+        with self.__progress.timed('pre_process_tiles'):
+            # crop positions are only cached for crop modes that search for them
+            crop_cache = None
+            self.__crop_positions = {}
+            if self.__use_tile_cache and self.__crop_mode not in ('stretch', 'center'):
+                crop_cache = CropCache(self.__input_directory_path, self.__crop_mode, self.__tile_height,
+                                       self.__tile_width)
+                self.__crop_positions = crop_cache.load(file_paths)
+
+            if self.__use_tile_cache:
+                def pre_process_stale_tile_files(stale_file_paths):
+                    self.__progress.advance('pre_process_tiles', len(file_paths) - len(stale_file_paths))  # cached
+                    return self.__pre_process_tile_files(stale_file_paths)
+
+                tile_cache = TileCache(self.__input_directory_path, self.__tile_height, self.__tile_width,
+                                       self.__tile_dtype, self.__crop_mode)
+                self.__input_images = tile_cache.load(file_paths, pre_process_stale_tile_files)
+                self.__input_image_file_paths = tile_cache.get_tile_file_paths()
+                self.__tile_cache = tile_cache
+            else:
+                tiles, loaded = self.__load_tiles(file_paths)
+                tiles = self.__compact_tiles(tiles, loaded)
+                self.__input_images = tiles if tiles.dtype == self.__tile_dtype else tiles.astype(self.__tile_dtype)
+                self.__input_image_file_paths = [file_path for file_path, is_loaded in zip(file_paths, loaded)
+                                                 if is_loaded]
+                self.__tile_cache = None
+            if crop_cache is not None:
+                crop_cache.save(self.__crop_positions)
+        self.__progress.finish_stage('pre_process_tiles', len(file_paths) - len(self.__input_images))  # includes images
+        # that failed to load when they were cached
+
+        # keeps the fitted tile index if the tiles are unchanged, pointing it at the newly loaded copy of them
+        tile_set_id = self.__tile_cache.get_tiles_file_name() if self.__tile_cache is not None else None
+        if self.__tile_index is not None and tile_set_id is not None and tile_set_id == self.__tile_set_id:
+            self.__tile_index.attach(self.__input_images)
+        else:
+            self.__tile_index = None
+        self.__tile_set_id = tile_set_id
+        self.__tile_set_generation += 1
+
+    def __pre_process_tile_files(self, file_paths):
+        """Opens and resizes each of the given images so that they can be used as tiles.
+
+        :param file_paths: the file paths of the images
+        :return: list of the resized uint8 tiles, with None for images that could not be opened
+        """
+
+        tiles, loaded = self.__load_tiles(file_paths)
+        return [tile if is_loaded else None for tile, is_loaded in zip(tiles, loaded)]
+
+    def __load_tiles(self, file_paths):
+        """Opens and resizes each of the given images into a single preallocated uint8 array.
+
+        :param file_paths: the file paths of the images
+        :return: tuple of the tile array and a boolean array of whether each image was loaded
+        """
+
+        tile_loader = TileLoader(self.__tile_height, self.__tile_width, self.__tile_loader_backend,
+                                 self.__tile_loader_workers, self.__crop_mode)
+        return tile_loader.load(file_paths, lambda loaded_count, failed_count:
+                                self.__progress.advance('pre_process_tiles', loaded_count, failed_count),
+                                self.__crop_positions)
+
+    @staticmethod
+    def __compact_tiles(tiles, loaded):
+        """Moves the loaded tiles to the front of the array in place, dropping the rows of images that failed to load.
+
+        :param tiles: the tile array
+        :param loaded: boolean array of whether each row holds a loaded tile
+        :return: view of the array containing only the loaded tiles
+        """
+
+        loaded_indexes = np.flatnonzero(loaded)
+        for index, loaded_index in enumerate(loaded_indexes):
+            if index != loaded_index:
+                tiles[index] = tiles[loaded_index]
+        return tiles[:len(loaded_indexes)]
 
-        :param file_path: the file path of the image
-        :return: the resized tile
+    def __fit_tile_index(self):
+        """Builds the tile search index from the tiles, unless it has already been built for them. Fitted indexes are
+        loaded from and saved to the tile cache so that they are only fitted once per set of tiles.
         """
-        with warnings.catch_warnings():
-            try:
-                raw_img = io.imread(file_path)
-                if raw_img.shape[2] == 4:
-                    raw_img = color.rgba2rgb(raw_img)
-                return transform.resize(raw_img, (self.__tile_height, self.__tile_width), anti_aliasing=False)
-            except Exception:
-                return None
 
-    def __fit_clusters(self):
-        """Fits the tiles into __clusters."""
+        if self.__tile_index is not None:
+            return
+
+        self.__tile_set_generation += 1
+        tile_index = create_tile_index(self.__tile_index_setting)
+        index_key = tile_index.get_cache_key()
+        if self.__tile_cache is not None and index_key is not None:
+            cached_tile_index = self.__tile_cache.load_index(index_key, tile_index)
+            if cached_tile_index is not None:
+                self.__tile_index = cached_tile_index.attach(self.__input_images)
+                return
 
-        reduced_data = np.reshape(self.__input_images, (self.__input_images.shape[0],
-                                                        self.__input_images.shape[1] * self.__input_images.shape[2] *
-                                                        self.__input_images.shape[3]))
-        self.__clusters = cluster.MiniBatchKMeans(n_clusters=min(8, len(self.__input_images))).fit(reduced_data)
+        self.__tile_index = tile_index.fit(self.__input_images)
+        if self.__tile_cache is not None and index_key is not None:
+            self.__tile_cache.save_index(index_key, self.__tile_index)
 
     def pre_process_images(self, column_count, row_count):
         """Pre-processes the target image and images in the input image directory so that they are ready to be made into
-        a photomosaic.
+        a photomosaic. The target is pre-processed again only if it or the grid has changed, and the tiles (and their
+        index) only if the input image directory or the tile size has changed.
 
         :param column_count: the number of tiles in each row
         :param row_count: the number of tiles in each column
@@ -139,80 +450,432 @@ class PhotomosaicGenerator:
         if self.__column_count != column_count or self.__row_count != row_count:
             self.__column_count = column_count
             self.__row_count = row_count
-            self.__redo_pre_processing = True
+            self.__redo_target_pre_processing = True
+
+        if self.__redo_target_pre_processing:
+            with self.__progress.stage('pre_process_target'):
+                self.__pre_process_target()
+            self.__redo_target_pre_processing = False
 
-        if self.__redo_pre_processing:
-            self.__pre_process_target()
+        if self.__redo_tile_pre_processing or self.__input_images_tile_size != (self.__tile_height, self.__tile_width):
             self.__pre_process_tiles()
-            self.__redo_pre_processing = False
+            self.__input_images_tile_size = (self.__tile_height, self.__tile_width)
+            self.__redo_tile_pre_processing = False
+
+        if self.__tile_index is None:
+            with self.__progress.stage('fit_tile_index', len(self.__input_images)):
+                self.__fit_tile_index()
+
+    def __match_tiles(self, first_row, last_row, previous_target_image=None, tile_matching_pool=None,
+                      candidates=None):
+        """Matches appropriate tiles to each position in a band of rows of the photomosaic. The band of the target image
+        is split into one cell per position so that it is queried against the tile index in a single batch.
+
+        :param first_row: the first row of the band
+        :param last_row: the row after the last row of the band
+        :param previous_target_image: if given, the resized target image that the current tiles were matched to, so
+         that only the cells that differ from it by more than the change threshold are matched again. Above a threshold
+         of 0, the cells matched again are copied into it, so that it keeps following what each tile was matched to
+         (default None)
+        :param tile_matching_pool: if given, the TileMatchingPool the band is matched in, in the background (default
+         None)
+        :param candidates: if given, a tuple of (row_count, column_count, k) arrays that the indexes and distances of
+         the k closest tiles to each cell are stored in, instead of storing the closest tile (default None)
+        :return: function that waits for the band to be matched and stores the matches
+        """
+
+        cells = self.__get_target_cells(first_row, last_row)
+        positions = slice(None)
+        if previous_target_image is not None:
+            previous_band = previous_target_image[first_row * self.__tile_height:last_row * self.__tile_height]
+            previous_cells = self.__split_cells(previous_band)
+            if self.__change_threshold:
+                changes = np.mean(np.abs(cells.astype(np.int16) - previous_cells), axis=(1, 2, 3))
+                positions = np.flatnonzero(changes > self.__change_threshold)
+                cells = cells[positions]
+                self.__merge_cells(previous_band, cells, positions)
+            else:
+                positions = np.flatnonzero(np.any(np.reshape(cells != previous_cells, (len(cells), -1)), axis=1))
+                cells = cells[positions]
+        self.__matched_cell_count += len(cells)
+
+        if len(cells) == 0:
+            return lambda: None
+        k = candidates[0].shape[2] if candidates is not None else None
+        if tile_matching_pool is not None:
+            get_matches = tile_matching_pool.submit(cells, k).get
+        else:
+            matches = self.__tile_index.query(cells) if k is None else self.__tile_index.query_k(cells, k)
+            get_matches = lambda: matches
+
+        def store_matches():
+            if candidates is not None:
+                for band_candidates, matches in zip(candidates, get_matches()):
+                    band_candidates[first_row:last_row] = np.reshape(matches, (last_row - first_row,
+                                                                               self.__column_count, k))
+                return
+            tile_indexes = np.reshape(self.__tile_cluster_indexes[first_row:last_row], -1)  # view of the band's indexes
+            tile_indexes[positions] = get_matches()
+
+        return store_matches
+
+    def __get_target_cells(self, first_row, last_row):
+        """Splits a band of rows of the pre-processed target image into one cell per position in the photomosaic.
+
+        :param first_row: the first row of the band
+        :param last_row: the row after the last row of the band
+        :return: array with shape ((last_row - first_row) * column_count, tile_height, tile_width, 3)
+        """
+
+        from skimage import transform, util
+
+        row_count = last_row - first_row
+        if self.__stream_target:
+            target_reader = self.__get_target_reader()
+            target_height = target_reader.get_size()[0]
+            band = target_reader.read_rows(round(first_row * target_height / self.__row_count),
+                                           round(last_row * target_height / self.__row_count))
+            band = util.img_as_ubyte(transform.resize(band, (row_count * self.__tile_height,
+                                                             self.__column_count * self.__tile_width),
+                                                      anti_aliasing=True))
+        else:
+            band = self.__resized_target_image[first_row * self.__tile_height:last_row * self.__tile_height]
+        return self.__split_cells(band)
+
+    def __get_cells(self, cell_numbers):
+        """Returns the cells of the pre-processed target image with the given numbers, reading only the bands of rows
+        that contain them.
+
+        :param cell_numbers: array of cell numbers (row * column_count + column)
+        :return: array with shape (len(cell_numbers), tile_height, tile_width, 3)
+        """
+
+        cells = np.empty((len(cell_numbers), self.__tile_height, self.__tile_width, 3), dtype=np.uint8)
+        rows = cell_numbers // self.__column_count
+        for first_row, last_row in self.__get_row_bands():
+            in_band = np.flatnonzero((rows >= first_row) & (rows < last_row))
+            if len(in_band):
+                band_cells = self.__get_target_cells(first_row, last_row)
+                cells[in_band] = band_cells[cell_numbers[in_band] - first_row * self.__column_count]
+        return cells
+
+    def __split_cells(self, band):
+        """Splits a band of rows of a resized target image into one cell per position in the photomosaic.
+
+        :param band: array with shape (row_count * tile_height, column_count * tile_width, 3)
+        :return: array with shape (row_count * column_count, tile_height, tile_width, 3)
+        """
+
+        row_count = len(band) // self.__tile_height
+        cells = np.reshape(band, (row_count, self.__tile_height, self.__column_count, self.__tile_width, 3))
+        return np.reshape(np.transpose(cells, (0, 2, 1, 3, 4)),
+                          (row_count * self.__column_count, self.__tile_height, self.__tile_width, 3))
+
+    def __merge_cells(self, band, cells, positions):
+        """Copies cells into their positions in a band of rows of a resized target image.
+
+        :param band: array with shape (row_count * tile_height, column_count * tile_width, 3)
+        :param cells: array with shape (len(positions), tile_height, tile_width, 3)
+        :param positions: the position in the band of each cell, counted along the rows
+        """
+
+        row_count = len(band) // self.__tile_height
+        band_cells = np.transpose(np.reshape(band, (row_count, self.__tile_height, self.__column_count,
+                                                    self.__tile_width, 3)), (0, 2, 1, 3, 4))
+        band_cells[positions // self.__column_count, positions % self.__column_count] = cells
+
+    def __get_row_bands(self, workers=1):
+        """Splits the rows of the photomosaic into the bands that are matched together: bands of about
+        PROGRESS_BAND_CELLS cells, or for streamed targets, bands small enough to read and resize within what is left of
+        the memory budget once any part of the target that the TargetReader holds is counted. Bands are made small
+        enough for each worker to have several when they are matched in parallel.
+
+        :param workers: the number of processes the bands are matched in (default 1)
+        :return: list of (first_row, last_row) tuples
+        """
+
+        band_row_count = max(1, self.PROGRESS_BAND_CELLS // self.__column_count)
+        if workers > 1:
+            band_row_count = min(band_row_count, -(-self.__row_count // (workers * 4)))
+        if self.__stream_target:
+            target_reader = self.__get_target_reader()
+            target_height, target_width = target_reader.get_size()
+            cell_bytes_per_row = self.__tile_height * self.__column_count * self.__tile_width * 3
+            bytes_per_row = -(-target_height // self.__row_count) * target_width * self.TARGET_BYTES_PER_PIXEL + \
+                cell_bytes_per_row * (2 + 8) + (cell_bytes_per_row * workers if workers > 1 else 0)  # the resized
+            # float64 band and its uint8 cells, and the bands being matched
+            band_budget = self.__memory_budget - target_reader.get_memory_usage()
+            band_row_count = max(1, band_budget // bytes_per_row)
+        return [(first_row, min(first_row + band_row_count, self.__row_count))
+                for first_row in range(0, self.__row_count, band_row_count)]
+
+    @contextlib.contextmanager
+    def __open_output(self, stream_file_path=None):
+        """Opens the output that selected tiles are combined into to create the photomosaic. Each row of tiles is
+        written straight into a preallocated output image, or into a reused band buffer that is streamed to a file.
+        Output images larger than the memory budget are memory mapped to a temporary file, which the operating system
+        can page out as rows are written.
+
+        :param stream_file_path: if given, the photomosaic is streamed to this file row band by row band instead of
+         being kept in memory (default None)
+        :return: context manager giving a function that writes the rows of tiles from the first row given to the row
+         before the last row given to the output
+        """
+
+        tile_height, tile_width = self.__render_tile_size
+        height = self.__row_count * tile_height
+        width = self.__column_count * tile_width
 
-        self.__fit_clusters()
+        if stream_file_path is None:
+            if self.__memory_budget is not None and height * width * 3 > self.__memory_budget:
+                self.__output_image = None  # frees the previous output before the next is allocated
+                with tempfile.TemporaryFile() as output_file:
+                    output_image = np.memmap(output_file, dtype=np.uint8, mode='w+', shape=(height, width, 3))
+            else:
+                output_image = np.empty((height, width, 3), dtype=np.uint8)
+            bands = np.reshape(output_image, (self.__row_count, tile_height, width, 3))
+
+            def write_row(y, tiles, tile_indexes):
+                self.combine_tile_row(tiles, tile_indexes, bands[y])
+
+            yield lambda first_row, last_row: self.__combine_rows(first_row, last_row, write_row)
+            self.__output_image = output_image
+        else:
+            self.__output_image = None
+            band = np.empty((tile_height, width, 3), dtype=np.uint8)
+            with open_band_writer(stream_file_path, height, width) as writer:
+                def write_row(y, tiles, tile_indexes):
+                    self.combine_tile_row(tiles, tile_indexes, band)
+                    writer.write_band(band)
+
+                yield lambda first_row, last_row: self.__combine_rows(first_row, last_row, write_row)
+
+    def __combine_rows(self, first_row, last_row, write_row):
+        """Copies the selected tiles for a band of rows of the photomosaic into the output. If tiles are rendered at a
+        larger size than they were matched at, the distinct tiles chosen for each part of the band are rendered
+        together, in parts of rows with at most RENDER_BAND_BYTES of rendered tiles.
+
+        :param first_row: the first row of the band
+        :param last_row: the row after the last row of the band
+        :param write_row: function taking the index of a row, an array of tiles and the index in it of the tile at
+         each position in the row, that writes the row to the output
+        """
 
-    def __match_tiles(self):
-        """Matches appropriate tiles to each position in the photomosaic."""
+        if self.__tile_renderer is None:
+            for y in range(first_row, last_row):
+                write_row(y, self.__input_images, self.__tile_cluster_indexes[y])
+            return
+
+        tile_height, tile_width = self.__render_tile_size
+        part_row_count = max(1, self.RENDER_BAND_BYTES // (self.__column_count * tile_height * tile_width * 3))
+        for part_first_row in range(first_row, last_row, part_row_count):
+            part_last_row = min(part_first_row + part_row_count, last_row)
+            rendered_indexes, tile_indexes = np.unique(self.__tile_cluster_indexes[part_first_row:part_last_row],
+                                                       return_inverse=True)
+            tiles = self.__tile_renderer.get_tiles(rendered_indexes)
+            tile_indexes = np.reshape(tile_indexes, (part_last_row - part_first_row, self.__column_count))
+            for y, row_tile_indexes in enumerate(tile_indexes, part_first_row):
+                write_row(y, tiles, row_tile_indexes)
+
+    @staticmethod
+    def combine_tile_row(tiles, tile_indexes, band):
+        """Copies a row of tiles side by side into a band of an image, converting them to uint8.
+
+        :param tiles: array of tiles with shape (tile_count, tile_height, tile_width, 3)
+        :param tile_indexes: the index of the tile at each position in the row
+        :param band: uint8 array with shape (tile_height, len(tile_indexes) * tile_width, 3) to write the row into
+        """
 
-        self.__tile_cluster_indexes = np.zeros((self.__row_count, self.__column_count))
+        row_tiles = tiles[tile_indexes]
+        np.copyto(np.reshape(band, (row_tiles.shape[1], len(tile_indexes), row_tiles.shape[2], 3)),
+                  np.transpose(row_tiles, (1, 0, 2, 3)), casting='unsafe')
 
-        for y, x in ((y, x) for y in range(self.__row_count) for x in range(self.__column_count)):
-            self.__match_tile((y, x))
+    def generate_photomosaic(self, stream_file_path=None):
+        """Creates a photomosaic from the pre-processed tiles and target image. Streamed targets are matched and
+        combined one band of rows at a time. If the grid, tile size and tiles are unchanged since the last photomosaic,
+        only the cells of the target that have changed by more than the change threshold since then are matched again.
+        If tile reuse is constrained, the closest few tiles to every cell are found first and then assigned together
+        before any row is combined.
 
-    def __match_tile(self, position):
-        """Matches an appropriate tile to a position in the photomosaic."""
+        :param stream_file_path: if given, the photomosaic is streamed to this file (.png, .tif/.tiff or .dzi, as
+         supported by ImageWriters.BAND_WRITERS) row band by row band instead of being kept in memory, so it cannot be
+         retrieved or saved afterwards (default None)
+        """
 
-        y, x = position
-        target_tile = self.__target_image[y * self.__tile_height:(y + 1) * self.__tile_height,
-                      x * self.__tile_width:(x + 1) * self.__tile_width]
+        candidates = None
+        if self.__tile_assigner is not None:
+            self.__tile_assigner.check_feasible(self.__row_count * self.__column_count, len(self.__input_images))
+            k = min(self.__tile_assigner.get_candidate_count(), len(self.__input_images))
+            candidates = (np.zeros((self.__row_count, self.__column_count, k), dtype=np.intp),
+                          np.zeros((self.__row_count, self.__column_count, k)))
+
+        self.__update_tile_renderer()
+        previous_target_image = self.__get_previous_target_image() if candidates is None else None
+        if previous_target_image is None:
+            self.__tile_cluster_indexes = np.zeros((self.__row_count, self.__column_count), dtype=np.intp)
+        self.__matched_target_image = None  # cleared until matching finishes, so a failure leaves no partial matches
+        self.__matched_cell_count = 0
+        tile_matching_pool = self.__get_tile_matching_pool()
+        workers = self.__tile_matcher_workers if tile_matching_pool is not None else 1
+
+        self.__progress.start_stage('match_tiles', self.__row_count * self.__column_count)
+        self.__progress.start_stage('combine_tiles', self.__row_count)
+        if self.__preview_callbacks:
+            self.__start_preview()
+        with self.__open_output(stream_file_path) as write_rows, self.__start_rendering():
+            def combine_rows(first_row, last_row):
+                with self.__progress.timed('combine_tiles'):
+                    write_rows(first_row, last_row)
+                    if self.__preview_callbacks:
+                        self.__update_preview(first_row, last_row)
+                self.__progress.advance('combine_tiles', last_row - first_row)
+
+            def finish_band(first_row, last_row, store_matches):
+                with self.__progress.timed('match_tiles'):
+                    store_matches()
+                self.__progress.advance('match_tiles', (last_row - first_row) * self.__column_count)
+                if candidates is None:
+                    combine_rows(first_row, last_row)
+
+            # bands are matched up to one per worker ahead of the band being combined, and combined in order
+            pending_bands = collections.deque()
+            for first_row, last_row in self.__get_row_bands(workers):
+                with self.__progress.timed('match_tiles'):
+                    pending_bands.append((first_row, last_row, self.__match_tiles(first_row, last_row,
+                                                                                  previous_target_image,
+                                                                                  tile_matching_pool, candidates)))
+                if len(pending_bands) > workers - 1:
+                    finish_band(*pending_bands.popleft())
+            while pending_bands:
+                finish_band(*pending_bands.popleft())
+
+            if candidates is not None:
+                with self.__progress.timed('match_tiles'):
+                    self.__tile_cluster_indexes = self.__tile_assigner.assign(*candidates, self.__tile_index,
+                                                                              len(self.__input_images),
+                                                                              self.__get_cells)
+                for first_row, last_row in self.__get_row_bands():
+                    combine_rows(first_row, last_row)
+        self.__progress.finish_stage('match_tiles')
+        self.__progress.finish_stage('combine_tiles')
+        self.__matched_target_image = previous_target_image if previous_target_image is not None and \
+            self.__change_threshold else self.__resized_target_image
+        self.__matched_tile_set_generation = self.__tile_set_generation
+
+    def __start_preview(self):
+        """Creates a black preview image, shrinking the tiles to the size of its cells unless they already have been."""
+
+        scale = min(1, self.PREVIEW_SIZE / max(self.__row_count * self.__tile_height,
+                                               self.__column_count * self.__tile_width))
+        cell_height, cell_width = max(1, round(self.__tile_height * scale)), max(1, round(self.__tile_width * scale))
+        if self.__preview_tiles is None or self.__preview_tiles.shape[1:3] != (cell_height, cell_width):
+            self.__preview_tiles = self.__shrink_tiles(self.__input_images, cell_height, cell_width)
+        self.__preview_image = np.zeros((self.__row_count * cell_height, self.__column_count * cell_width, 3),
+                                        dtype=np.uint8)
+
+    def __update_preview(self, first_row, last_row):
+        """Copies the shrunk tiles selected for a band of rows into the preview and sends a copy of it to every
+        preview callback.
+
+        :param first_row: the first row of the band
+        :param last_row: the row after the last row of the band
+        """
 
-        img = np.array((target_tile.flatten(),))
-        cluster_num = self.__clusters.predict(img)
-        img_indexes = (i for i, x in enumerate(self.__clusters.labels_) if x == cluster_num)
+        bands = np.reshape(self.__preview_image, (self.__row_count, -1) + self.__preview_image.shape[1:])
+        for y in range(first_row, last_row):
+            self.combine_tile_row(self.__preview_tiles, self.__tile_cluster_indexes[y], bands[y])
+        preview = self.__preview_image.copy()
+        for callback in list(self.__preview_callbacks):
+            callback(preview)
 
-        best_score = sys.float_info.max
-        best_index = 0
-        for i in img_indexes:
-            score = abs(np.linalg.norm(target_tile - self.__input_images[i]))
-            if score < best_score:
-                best_index = i
-                if score < 0.3:
-                    break
-                best_score = score
-        self.__tile_cluster_indexes[y, x] = best_index
+    def __shrink_tiles(self, tiles, height, width):
+        """Shrinks tiles by averaging blocks of their pixels, in batches of PREVIEW_SHRINK_BATCH tiles.
 
-    def __combine_tiles(self):
-        """Combines selected tiles to create the photomosaic."""
+        :param tiles: array of tiles with shape (tile_count, tile_height, tile_width, 3)
+        :param height: the height of the shrunk tiles, at most tile_height
+        :param width: the width of the shrunk tiles, at most tile_width
+        :return: uint8 array with shape (tile_count, height, width, 3)
+        """
 
-        self.__tile_cluster_indexes = itertools.chain(*self.__tile_cluster_indexes)
-        self.__output_image = self.__input_images[int(next(self.__tile_cluster_indexes))]
+        row_edges = np.linspace(0, tiles.shape[1], height + 1).astype(int)
+        column_edges = np.linspace(0, tiles.shape[2], width + 1).astype(int)
+        block_sizes = np.outer(np.diff(row_edges), np.diff(column_edges))[:, :, np.newaxis]
+        shrunk_tiles = np.empty((len(tiles), height, width, 3), dtype=np.uint8)
+        for start in range(0, len(tiles), self.PREVIEW_SHRINK_BATCH):
+            sums = np.add.reduceat(np.add.reduceat(tiles[start:start + self.PREVIEW_SHRINK_BATCH], row_edges[:-1],
+                                                   axis=1, dtype=np.float32), column_edges[:-1], axis=2)
+            np.copyto(shrunk_tiles[start:start + self.PREVIEW_SHRINK_BATCH], np.rint(sums / block_sizes),
+                      casting='unsafe')
+        return shrunk_tiles
+
+    def __update_tile_renderer(self):
+        """Creates the renderer for tiles rendered at a larger size than they were matched at, keeping the one made
+        for the current tiles at the current size so that the tiles it has cached are reused.
+        """
 
-        for x in range(1, self.__column_count):
-            self.__output_image = np.concatenate(
-                (self.__output_image, self.__input_images[int(next(self.__tile_cluster_indexes))]), axis=1)
+        if self.__render_tile_size == (self.__tile_height, self.__tile_width):
+            self.__tile_renderer = None
+        elif self.__tile_renderer is None or self.__tile_renderer.get_tile_size() != self.__render_tile_size:
+            cache_bytes = self.RENDER_CACHE_BYTES if self.__memory_budget is None else \
+                min(self.RENDER_CACHE_BYTES, self.__memory_budget // 4)
+            self.__tile_renderer = TileRenderer(self.__input_image_file_paths, self.__input_images,
+                                                *self.__render_tile_size, cache_bytes, self.__tile_loader_backend,
+                                                self.__tile_loader_workers, self.__crop_mode, self.__crop_positions)
+
+    def __start_rendering(self):
+        """Returns a context manager that keeps the tile renderer's loading workers running for the photomosaic's rows,
+        or does nothing if tiles aren't rendered at a larger size.
+        """
 
-        for y in range(1, self.__row_count):
-            columns = self.__input_images[int(next(self.__tile_cluster_indexes))]
-            for x in range(1, self.__column_count):
-                columns = np.concatenate((columns, self.__input_images[int(next(self.__tile_cluster_indexes))]), axis=1)
-            self.__output_image = np.concatenate((self.__output_image, columns), axis=0)
+        if self.__tile_renderer is None:
+            return contextlib.nullcontext()
+        return self.__tile_renderer.rendering(min(self.__row_count * self.__column_count, len(self.__input_images)))
 
-        self.__output_image = util.img_as_ubyte(self.__output_image)
+    def __get_tile_matching_pool(self):
+        """Returns the pool of worker processes to match the grid in, or None if it is too small to be worth matching
+        in parallel. The pool is kept between photomosaics until the tiles or the tile index change, as its workers
+        hold their own copies of them.
+        """
 
-    def generate_photomosaic(self):
-        """Creates a photomosaic from the pre-processed tiles and target image"""
+        if self.__tile_matcher_workers <= 1 or self.__row_count * self.__column_count < self.PARALLEL_MATCHING_CELLS:
+            return None
+
+        if self.__tile_matching_pool is not None and \
+                self.__tile_matching_pool_generation != self.__tile_set_generation:
+            self.__tile_matching_pool.close()
+            self.__tile_matching_pool = None
+        if self.__tile_matching_pool is None:
+            self.__tile_matching_pool = TileMatchingPool(self.__tile_index, self.__input_images,
+                                                         self.__tile_matcher_workers)
+            self.__tile_matching_pool_generation = self.__tile_set_generation
+        return self.__tile_matching_pool
+
+    def __get_previous_target_image(self):
+        """Returns the resized target image that the current tile matches were made for, if they can be reused because
+        the grid, tile size, tiles and tile index are unchanged since, else None. Streamed targets aren't kept in
+        memory, so are always matched in full.
+        """
 
-        self.__match_tiles()
-        self.__combine_tiles()
+        if self.__stream_target or self.__matched_target_image is None or \
+                self.__matched_tile_set_generation != self.__tile_set_generation:
+            return None
+        if self.__matched_target_image.shape != self.__resized_target_image.shape or \
+                self.__tile_cluster_indexes.shape != (self.__row_count, self.__column_count):
+            return None
+        return self.__matched_target_image
 
     def can_generate_photomosaic(self):
         """Checks whether a photomosaic can be created. Raises a MissingComponentError exception with appropriate error
         message if not.
         """
 
+        target_missing = self.__target_image_file_path is None and self.__target_image is None
         if self.__input_directory_path is None:
-            if self.__target_image is None:
+            if target_missing:
                 raise MissingComponentError('Cannot generate image. Input directory and target image are missing.')
             else:
                 raise MissingComponentError('Cannot generate image. Input directory is missing.')
-        elif self.__target_image is None:
+        elif target_missing:
             raise MissingComponentError('Cannot generate image. Target image is missing.')
 
     def can_save_image(self):
@@ -224,11 +887,22 @@ class PhotomosaicGenerator:
             raise MissingComponentError('Cannot save image. You must generate an image first before it can be saved.')
 
     def save_image(self, output_directory_path):
-        """Saves output image in given location.
+        """Saves output image in given location. Formats that ImageWriters.BAND_WRITERS can stream (.png, tiled
+        .tif/.tiff, or a .dzi Deep Zoom pyramid) are encoded SAVE_BAND_ROWS rows at a time, so that the image is never
+        copied or converted whole; other formats are saved by skimage.
 
         :param output_directory_path: the location to save the output image in
         """
 
+        if os.path.splitext(output_directory_path)[1].lower() in BAND_WRITERS:
+            height, width = self.__output_image.shape[:2]
+            with open_band_writer(output_directory_path, height, width) as writer:
+                for y in range(0, height, self.SAVE_BAND_ROWS):
+                    writer.write_band(np.asarray(self.__output_image[y:y + self.SAVE_BAND_ROWS], dtype=np.uint8))
+            return
+
+        from skimage import io
+
         io.imsave(output_directory_path, self.__output_image.astype(np.uint8), quality=100, plugin='pil')
 
     def get_output_image(self):
@@ -236,8 +910,44 @@ class PhotomosaicGenerator:
 
         return self.__output_image.copy()
 
-    def get_target_image(self):
-        """Returns a copy of the target image"""
+    def get_memory_usage(self):
+        """Returns the number of bytes of the tiles, target and output images held by the generator, including those
+        memory mapped from files, which the operating system keeps in memory while they are used.
+        """
+
+        images = (self.__input_images, self.__target_image, self.__resized_target_image, self.__output_image,
+                  self.__preview_tiles)
+        return sum(image.nbytes for image in {id(image): image for image in images if image is not None}.values())
+
+    def get_matched_cell_count(self):
+        """Returns the number of cells matched by the last photomosaic, which is fewer than the number in the grid when
+        the tiles of unchanged cells were reused.
+        """
+
+        return self.__matched_cell_count
+
+    def close(self):
+        """Stops the worker processes that tiles are matched in, if any were started, and closes the file of a streamed
+        target. They are started and opened again if another photomosaic is generated.
+        """
+
+        if self.__tile_matching_pool is not None:
+            self.__tile_matching_pool.close()
+            self.__tile_matching_pool = None
+        self.__close_target_reader()
+
+    def get_target_image(self, preview_size=1024):
+        """Returns a copy of the target image. Streamed targets aren't held in memory, so a downsampled preview is
+        returned instead.
+
+        :param preview_size: the maximum height and width of the preview of a streamed target (default 1024)
+        """
+
+        if self.__stream_target:
+            with Image.open(self.__target_image_file_path) as image:
+                image.draft('RGB', (preview_size, preview_size))
+                image.thumbnail((preview_size, preview_size))
+                return np.array(image.convert('RGB'))
 
         return self.__target_image.copy()
 
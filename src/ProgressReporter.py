@@ -0,0 +1,240 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows, where the peak working set is read through the Windows API instead
+    resource = None
+
+
+def get_peak_memory():
+    """Returns the peak resident set size (peak working set on Windows) of the current process in bytes since it
+    started, or None if it can't be measured.
+    """
+
+    if resource is not None:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_memory if sys.platform == 'darwin' else peak_memory * 1024  # Linux reports kilobytes, macOS bytes
+
+    counters = _get_windows_memory_counters()
+    return counters.PeakWorkingSetSize if counters is not None else None
+
+
+def get_current_memory():
+    """Returns the current resident set size (working set on Windows) of the current process in bytes, or None if it
+    can't be measured (e.g. on macOS).
+    """
+
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    counters = _get_windows_memory_counters()
+    return counters.WorkingSetSize if counters is not None else None
+
+
+def _get_windows_memory_counters():
+    """Returns the memory counters of the current process on Windows, or None elsewhere or if they can't be read."""
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                        ctypes.byref(counters), counters.cb):
+                return counters
+        except OSError:
+            pass
+    return None
+
+
+class ProgressEvent:
+    """A class for a report of the progress of one stage of photomosaic generation.
+
+    :method get_eta: estimates the seconds until the stage finishes
+    """
+
+    STARTED = 'started'
+    PROGRESS = 'progress'
+    FINISHED = 'finished'
+
+    def __init__(self, stage, kind, completed, total, skipped, elapsed, duration=None, memory_change=None,
+                 process_peak_memory=None):
+        """Initialise the event's attributes.
+
+        :param stage: the name of the stage, e.g. 'pre_process_tiles' or 'match_tiles'
+        :param kind: STARTED, PROGRESS or FINISHED
+        :param completed: the number of items (tiles, cells or rows) completed so far
+        :param total: the total number of items in the stage, or None if unknown
+        :param skipped: the number of items skipped because of errors (e.g. images that couldn't be decoded)
+        :param elapsed: the seconds since the stage started
+        :param duration: for FINISHED events, the seconds spent working on the stage (default None)
+        :param memory_change: for FINISHED events, the change in bytes of the process's resident memory from the start
+         of the stage to its end, negative if memory was freed, or None if it can't be measured (default None)
+        :param process_peak_memory: for FINISHED events, the process's resident memory high-water mark in bytes since
+         the process started, which includes every earlier stage, not the peak of this stage alone (default None)
+        """
+
+        self.stage = stage
+        self.kind = kind
+        self.completed = completed
+        self.total = total
+        self.skipped = skipped
+        self.elapsed = elapsed
+        self.duration = duration
+        self.memory_change = memory_change
+        self.process_peak_memory = process_peak_memory
+
+    def get_eta(self):
+        """Estimates the seconds until the stage finishes from its progress so far, or None if it can't be estimated."""
+
+        done = self.completed + self.skipped
+        if self.total is None or done <= 0:
+            return None
+        return self.elapsed * max(0, self.total - done) / done
+
+    def __repr__(self):
+        return f'ProgressEvent({self.stage!r}, {self.kind!r}, {self.completed}/{self.total}, skipped={self.skipped})'
+
+
+class ProgressReporter:
+    """A class that tracks the progress and duration of the stages of photomosaic generation and reports them to
+    callbacks as ProgressEvents. Callbacks are called on the thread doing the work.
+
+    :method add_callback: registers a function to be called with every event
+    :method remove_callback: unregisters a function
+    :method start_stage: starts tracking a stage
+    :method advance: records progress in a stage
+    :method timed: times a block of work in a stage
+    :method finish_stage: finishes a stage
+    :method stage: tracks, times and finishes a stage around a block of work
+    :method get_durations: returns the duration of each finished stage
+    """
+
+    def __init__(self):
+        """Initialise the callbacks and stage state."""
+
+        self.__callbacks = []
+        self.__stages = {}
+        self.__durations = {}
+        self.__lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """Registers a function to be called with every ProgressEvent.
+
+        :param callback: function taking a ProgressEvent
+        """
+
+        self.__callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """Unregisters a function added with add_callback."""
+
+        self.__callbacks.remove(callback)
+
+    def start_stage(self, stage, total=None):
+        """Starts tracking a stage.
+
+        :param stage: the name of the stage
+        :param total: the total number of items in the stage, or None if unknown (default None)
+        """
+
+        with self.__lock:
+            self.__stages[stage] = {'total': total, 'completed': 0, 'skipped': 0, 'duration': 0.0,
+                                    'start_time': time.perf_counter(), 'start_memory': get_current_memory()}
+        self.__emit(stage, ProgressEvent.STARTED)
+
+    def advance(self, stage, completed=0, skipped=0):
+        """Records progress in a stage.
+
+        :param stage: the name of the stage
+        :param completed: the number of items just completed (default 0)
+        :param skipped: the number of items just skipped because of errors (default 0)
+        """
+
+        with self.__lock:
+            self.__stages[stage]['completed'] += completed
+            self.__stages[stage]['skipped'] += skipped
+        self.__emit(stage, ProgressEvent.PROGRESS)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """Adds the time spent in a block of work to a stage's duration, so that stages whose work is interleaved are
+        timed separately.
+
+        :param stage: the name of the stage
+        """
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__stages[stage]['duration'] += time.perf_counter() - start_time
+
+    def finish_stage(self, stage, skipped=None):
+        """Finishes a stage, counting all of its items that weren't skipped as completed.
+
+        :param stage: the name of the stage
+        :param skipped: the total number of items skipped, if it is known better than the count reported through
+         advance (default None)
+        """
+
+        with self.__lock:
+            state = self.__stages[stage]
+            if skipped is not None:
+                state['skipped'] = skipped
+            if state['total'] is not None:
+                state['completed'] = max(state['completed'], state['total'] - state['skipped'])
+            self.__durations[stage] = state['duration']
+        memory = get_current_memory()
+        memory_change = memory - state['start_memory'] if memory is not None and state['start_memory'] is not None \
+            else None
+        self.__emit(stage, ProgressEvent.FINISHED, duration=state['duration'], memory_change=memory_change,
+                    process_peak_memory=get_peak_memory())
+
+    @contextlib.contextmanager
+    def stage(self, stage, total=None):
+        """Starts a stage, times the block of work and finishes the stage afterwards.
+
+        :param stage: the name of the stage
+        :param total: the total number of items in the stage, or None if unknown (default None)
+        """
+
+        self.start_stage(stage, total)
+        with self.timed(stage):
+            yield
+        self.finish_stage(stage)
+
+    def get_durations(self):
+        """Returns a dictionary of the duration in seconds of the last run of each finished stage."""
+
+        with self.__lock:
+            return dict(self.__durations)
+
+    def __emit(self, stage, kind, duration=None, memory_change=None, process_peak_memory=None):
+        """Sends an event with the stage's current progress to every callback."""
+
+        with self.__lock:
+            state = self.__stages[stage]
+            event = ProgressEvent(stage, kind, state['completed'], state['total'], state['skipped'],
+                                  time.perf_counter() - state['start_time'], duration, memory_change,
+                                  process_peak_memory)
+        for callback in list(self.__callbacks):
+            callback(event)
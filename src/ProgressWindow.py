@@ -7,8 +7,17 @@ class ProgressWindow(QtWidgets.QWidget):
 
     :method show_pre_process_images_animation: shows the pre-processing images animation on the progress window
     :method show_tile_matching_animation: shows the tile matching animation on the progress window
+    :method show_progress: shows the progress of a stage on the progress bar
     """
 
+    STAGE_MESSAGES = {
+        'pre_process_target': 'pre-processing target image',
+        'pre_process_tiles': 'pre-processing images',
+        'fit_tile_index': 'indexing tiles',
+        'match_tiles': 'matching tiles',
+        'combine_tiles': 'combining tiles',
+    }
+
     def __init__(self):
         """Initialises the ProgressWindow attributes"""
 
@@ -21,10 +30,8 @@ class ProgressWindow(QtWidgets.QWidget):
         self.setLayout(QtWidgets.QVBoxLayout())
         self._layout = self.layout()
 
-        self._gif = QtWidgets.QLabel()
-        movie = QtGui.QMovie(r'..\img_assets\pre_process_images_animation.gif')
-        self._gif.setMovie(movie)
-        movie.start()
+        self._gif = QtWidgets.QLabel()  # the animations are loaded when the window is first shown, not at startup
+        self._movies = {}
         self._layout.addWidget(self._gif)
 
         self._message = QtWidgets.QLabel()
@@ -32,22 +39,60 @@ class ProgressWindow(QtWidgets.QWidget):
         self._message.setAlignment(Qt.AlignCenter)
         self._layout.addWidget(self._message)
 
+        self._progress_bar = QtWidgets.QProgressBar()
+        self._progress_bar.setRange(0, 0)
+        self._layout.addWidget(self._progress_bar)
+
+        self._details = QtWidgets.QLabel()
+        self._details.setAlignment(Qt.AlignCenter)
+        self._layout.addWidget(self._details)
+
         self.setWindowFlag(Qt.WindowCloseButtonHint, False)
 
     def show_pre_process_images_animation(self):
         """Shows the pre-processing images animation on the progress window."""
 
-        movie = QtGui.QMovie(r'..\img_assets\pre_process_images_animation.gif')
-        self._gif.setMovie(movie)
-        movie.start()
-
+        self._show_animation(r'..\img_assets\pre_process_images_animation.gif')
         self._message.setText('pre-processing images')
 
     def show_tile_matching_animation(self):
         """Shows the tile matching animation on the progress window."""
 
-        movie = QtGui.QMovie(r'..\img_assets\matching_tiles_animation.gif')
+        self._show_animation(r'..\img_assets\matching_tiles_animation.gif')
+        self._message.setText('matching tiles')
+
+    def _show_animation(self, file_path):
+        """Shows an animation on the progress window, loading it the first time it is shown."""
+
+        movie = self._movies.get(file_path)
+        if movie is None:
+            movie = self._movies[file_path] = QtGui.QMovie(file_path)
+        if self._gif.movie() is not None:
+            self._gif.movie().stop()
         self._gif.setMovie(movie)
         movie.start()
 
-        self._message.setText('matching tiles')
+    def show_progress(self, event):
+        """Shows the progress of a stage on the progress bar, along with an estimate of the time remaining and the
+        number of images skipped.
+
+        :param event: the ProgressReporter.ProgressEvent of the stage
+        """
+
+        if event.stage == 'combine_tiles':
+            return  # tiles are combined as they are matched, so only the matching progress is shown
+
+        self._message.setText(self.STAGE_MESSAGES.get(event.stage, event.stage.replace('_', ' ')))
+        if event.total:
+            self._progress_bar.setRange(0, event.total)
+            self._progress_bar.setValue(event.completed + event.skipped)
+        else:
+            self._progress_bar.setRange(0, 0)  # busy indicator for stages of unknown length
+
+        details = []
+        eta = event.get_eta()
+        if eta is not None and event.kind == event.PROGRESS:
+            details.append(f'about {round(eta)}s remaining')
+        if event.skipped:
+            details.append(f'{event.skipped} images skipped')
+        self._details.setText(', '.join(details))
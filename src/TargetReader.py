@@ -0,0 +1,373 @@
+import io
+import math
+import struct
+import zlib
+import numpy as np
+from PIL import Image
+from TileLoader import convert_to_rgb
+
+
+class TargetReader:
+    """A class that reads a target image in horizontal bands of rows, so that very large targets never have to be held
+    in memory whole. Only some formats can be decoded a band at a time:
+
+    - TIFFs with chunky (interleaved) gray or RGB pixels, which are read straight from the file when uncompressed and
+      otherwise decoded one strip or tile at a time
+    - non-interlaced 8 bit PNGs, which are inflated and unfiltered one band at a time
+
+    Other images are decoded whole and kept in memory, reduced in size to fit in max_bytes if needed. JPEGs are decoded
+    at a reduced scale, so only the reduced image is ever held, but other formats (such as interlaced or 16 bit PNGs,
+    compressed single strip TIFFs, WebPs and BMPs) are reduced after they are decoded, so the whole image is held
+    briefly while it is read.
+
+    :method get_size: returns the height and width of the image
+    :method get_memory_usage: returns the number of bytes of the image held between reads
+    :method read_rows: returns a band of rows as a uint8 RGB array
+    :method close: releases the image
+    """
+
+    def __init__(self, file_path, required_size=None, max_bytes=None):
+        """Opens the image and reads its size, decoding it if it can't be read in bands.
+
+        :param file_path: the path to the image
+        :param required_size: the (height, width) the image will be downsampled to, which allows JPEGs to be decoded at
+         a smaller scale (default None)
+        :param max_bytes: the most bytes of images that can't be read in bands can take once decoded. Larger images are
+         reduced in size to fit (default None, for no limit)
+        """
+
+        self.__file_path = file_path
+        self.__max_bytes = max_bytes
+        self.__pixels = None  # the decoded image, if it can't be read in bands
+        self.__band_reader = None  # the _TiffBandReader or _PngBandReader, if it can be read in bands
+
+        with Image.open(file_path) as image:
+            image_format = image.format
+            self.__width, self.__height = image.size
+
+        if image_format == 'TIFF':
+            self.__band_reader = _TiffBandReader.open(file_path, max_bytes)
+        elif image_format == 'PNG':
+            self.__band_reader = _PngBandReader.open(file_path)
+        if self.__band_reader is None:
+            self.__pixels = self.__decode(required_size)
+            self.__height, self.__width = self.__pixels.shape[:2]
+
+    def get_size(self):
+        """Returns the height and width of the image (which may be smaller than the file's if it had to be reduced)."""
+
+        return self.__height, self.__width
+
+    def get_memory_usage(self):
+        """Returns the number of bytes of the image held between reads: the whole image if it can't be read in bands,
+        else nothing.
+        """
+
+        return 0 if self.__pixels is None else self.__pixels.nbytes
+
+    def read_rows(self, first_row, last_row):
+        """Returns a band of rows of the image. Bands are read fastest in order from the top of the image.
+
+        :param first_row: the first row of the band
+        :param last_row: the row after the last row of the band
+        :return: uint8 array with shape (last_row - first_row, width, 3)
+        """
+
+        from skimage import color, util
+
+        if self.__pixels is not None:
+            return self.__pixels[first_row:last_row]
+
+        band = self.__band_reader.read_rows(first_row, last_row)
+        if band.ndim == 3 and band.shape[2] == 1:
+            band = band[:, :, 0]
+        if band.ndim == 2:
+            band = color.gray2rgb(band)
+        elif band.shape[2] == 2:  # gray with alpha
+            band = np.concatenate((band[:, :, :1],) * 3 + (band[:, :, 1:],), axis=2)
+        if band.shape[2] >= 4:
+            band = color.rgba2rgb(band[:, :, :4])
+        return util.img_as_ubyte(band)
+
+    def close(self):
+        """Releases the image and closes its file."""
+
+        self.__pixels = None
+        if self.__band_reader is not None:
+            self.__band_reader.close()
+            self.__band_reader = None
+
+    def __decode(self, required_size):
+        """Decodes the whole image, reduced in size if it would otherwise take more than max_bytes.
+
+        :param required_size: the (height, width) the image will be downsampled to, or None
+        :return: uint8 array with shape (height, width, 3)
+        """
+
+        with Image.open(self.__file_path) as image:
+            if image.format == 'JPEG':
+                scale = 1  # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale without decoding the whole image first
+                while scale < 8 and self.__max_bytes is not None and \
+                        (self.__height // scale) * (self.__width // scale) * 3 > self.__max_bytes:
+                    scale *= 2
+                draft_size = [self.__width // scale, self.__height // scale]
+                if required_size is not None:
+                    draft_size = [min(draft_size[0], required_size[1]), min(draft_size[1], required_size[0])]
+                image.draft('RGB', (max(1, draft_size[0]), max(1, draft_size[1])))
+
+            image = convert_to_rgb(image)
+            width, height = image.size
+            if self.__max_bytes is not None and height * width * 3 > self.__max_bytes:
+                factor = math.ceil(math.sqrt(height * width * 3 / self.__max_bytes))
+                image = image.reduce(factor)
+            return np.asarray(image)
+
+
+class _TiffBandReader:
+    """Reads bands of rows of a TIFF with chunky gray or RGB pixels, decoding only the strips or tiles they overlap."""
+
+    @classmethod
+    def open(cls, file_path, max_bytes=None):
+        """Returns a reader for the first page of a TIFF, or None if it can't be read in bands.
+
+        :param file_path: the path to the TIFF
+        :param max_bytes: the most bytes a strip or row of tiles can take once decoded (default None, for no limit)
+        """
+
+        import tifffile
+
+        tiff = tifffile.TiffFile(file_path)
+        try:
+            page = tiff.pages[0]
+            samples = page.samplesperpixel
+            readable = page.photometric in (tifffile.PHOTOMETRIC.MINISBLACK, tifffile.PHOTOMETRIC.RGB) and \
+                page.dtype in (np.uint8, np.uint16) and samples <= 4 and \
+                (samples == 1 or page.planarconfig == tifffile.PLANARCONFIG.CONTIG) and \
+                getattr(page, 'imagedepth', 1) == 1 and len(page.dataoffsets) == len(page.databytecounts)
+            if readable and not page.is_contiguous:
+                segment_height = page.tilelength if page.is_tiled else min(page.rowsperstrip, page.imagelength)
+                readable = max_bytes is None or \
+                    segment_height * page.imagewidth * samples * page.dtype.itemsize <= max_bytes
+                if readable:  # decoding a segment raises an error if tifffile has no codec for the compression
+                    tiff.filehandle.seek(page.dataoffsets[0])
+                    page.decode(tiff.filehandle.read(page.databytecounts[0]), 0, jpegtables=page.jpegtables)
+            if readable:
+                return cls(tiff, page)
+        except Exception:
+            pass  # unusual TIFFs are decoded whole by PIL
+        tiff.close()
+        return None
+
+    def __init__(self, tiff, page):
+        self.__tiff = tiff
+        self.__page = page
+        self.__height, self.__width = page.imagelength, page.imagewidth
+        self.__shape = (page.samplesperpixel,)
+        self.__dtype = np.dtype(page.dtype)
+        if page.is_tiled:
+            self.__segment_size = (page.tilelength, page.tilewidth)
+        else:
+            self.__segment_size = (min(page.rowsperstrip, self.__height), self.__width)
+        self.__segment_row = None  # the number and pixels of the last row of strips or tiles decoded
+
+    def read_rows(self, first_row, last_row):
+        """Returns rows first_row to last_row of the image, as an array with shape (rows, width, samples)."""
+
+        file_handle = self.__tiff.filehandle
+        if self.__page.is_contiguous:  # uncompressed, so the rows are read straight from the file
+            row_bytes = self.__width * self.__shape[0] * self.__dtype.itemsize
+            file_handle.seek(self.__page.dataoffsets[0] + first_row * row_bytes)
+            data = file_handle.read((last_row - first_row) * row_bytes)
+            band = np.frombuffer(data, self.__dtype.newbyteorder(self.__tiff.byteorder))
+            return band.reshape((last_row - first_row, self.__width) + self.__shape)
+
+        band = np.empty((last_row - first_row, self.__width) + self.__shape, dtype=self.__dtype)
+        segment_height = self.__segment_size[0]
+        for segment_row in range(first_row // segment_height, (last_row - 1) // segment_height + 1):
+            top = segment_row * segment_height
+            pixels = self.__read_segment_row(segment_row)
+            first, last = max(first_row, top), min(last_row, top + len(pixels))
+            band[first - first_row:last - first_row] = pixels[first - top:last - top]
+        return band
+
+    def __read_segment_row(self, segment_row):
+        """Decodes a row of strips or tiles, keeping the last one decoded as bands usually start part way through it.
+
+        :return: array with shape (rows, width, samples)
+        """
+
+        if self.__segment_row is not None and self.__segment_row[0] == segment_row:
+            return self.__segment_row[1]
+
+        page = self.__page
+        segment_height, segment_width = self.__segment_size
+        top = segment_row * segment_height
+        pixels = np.zeros((min(segment_height, self.__height - top), self.__width) + self.__shape, dtype=self.__dtype)
+        columns = -(-self.__width // segment_width)
+        file_handle = self.__tiff.filehandle
+        for column in range(columns):
+            index = segment_row * columns + column
+            if not page.databytecounts[index]:
+                continue  # missing segments are left empty
+            file_handle.seek(page.dataoffsets[index])
+            segment = page.decode(file_handle.read(page.databytecounts[index]), index, jpegtables=page.jpegtables)[0]
+            segment = np.reshape(segment, segment.shape[1:3] + self.__shape)
+            left = column * segment_width
+            rows, width = min(len(segment), len(pixels)), min(segment.shape[1], self.__width - left)
+            pixels[:rows, left:left + width] = segment[:rows, :width]
+        self.__segment_row = (segment_row, pixels)
+        return pixels
+
+    def close(self):
+        self.__segment_row = None
+        self.__tiff.close()
+
+
+class _PngBandReader:
+    """Reads bands of rows of a non-interlaced 8 bit PNG, inflating only as much of the image data as they need. Each
+    band's filtered rows are unfiltered by PIL, as a small PNG that starts with the unfiltered row before the band.
+    """
+
+    PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+    SAMPLES = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # samples per pixel of each colour type
+    SAMPLES_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}  # a colour type with each number of samples per pixel
+    READ_BYTES = 1024 * 1024  # the most compressed image data read at a time
+    SKIP_BYTES = 16 * 1024 * 1024  # rows before a band are unfiltered in parts of about this many bytes
+
+    @classmethod
+    def open(cls, file_path):
+        """Returns a reader for a PNG, or None if it can't be read in bands."""
+
+        file = open(file_path, 'rb')
+        try:
+            if file.read(8) == cls.PNG_SIGNATURE:
+                length, chunk_type = struct.unpack('>I4s', file.read(8))
+                if chunk_type == b'IHDR':
+                    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', file.read(13))
+                    if bit_depth == 8 and interlace == 0 and color_type in cls.SAMPLES:
+                        return cls(file, width, height, color_type)
+        except (OSError, struct.error):
+            pass  # unreadable PNGs are left to PIL
+        file.close()
+        return None
+
+    def __init__(self, file, width, height, color_type):
+        self.__file = file
+        self.__width, self.__height = width, height
+        self.__color_type = color_type
+        self.__samples = self.SAMPLES[color_type]
+        self.__palette = None
+        self.__image_data_offset = None  # the file offset of the first IDAT chunk
+        self.__read_chunks_before_image_data()
+        self.__restart()
+
+    def __read_chunks_before_image_data(self):
+        """Reads the palette and transparency, and finds the image data."""
+
+        palette, transparency = None, b''
+        self.__file.seek(8)
+        while True:
+            offset = self.__file.tell()
+            header = self.__file.read(8)
+            if len(header) < 8:
+                raise OSError('PNG image data not found')
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type == b'IDAT':
+                self.__image_data_offset = offset
+                break
+            data = self.__file.read(length)
+            self.__file.seek(4, io.SEEK_CUR)  # CRC
+            if chunk_type == b'PLTE':
+                palette = np.frombuffer(data, np.uint8).reshape(-1, 3)
+            elif chunk_type == b'tRNS' and self.__color_type == 3:
+                transparency = data
+
+        if self.__color_type == 3:
+            self.__palette = np.full((256, 4), 255, dtype=np.uint8)
+            self.__palette[:len(palette), :3] = palette
+            self.__palette[:len(transparency), 3] = np.frombuffer(transparency, np.uint8)
+            if not transparency:
+                self.__palette = self.__palette[:, :3]
+
+    def __restart(self):
+        """Starts reading the image data from the first row."""
+
+        self.__file.seek(self.__image_data_offset)
+        self.__chunk_bytes_left = 0  # the bytes of the current IDAT chunk not read yet
+        self.__in_chunk = False  # true once the first IDAT chunk has been started
+        self.__inflater = zlib.decompressobj()
+        self.__filtered = bytearray()  # image data inflated but not unfiltered yet
+        self.__next_row = 0
+        self.__previous_row = bytes(self.__width * self.__samples)  # the unfiltered row before __next_row
+
+    def __read_image_data(self):
+        """Returns the next compressed image data, or b'' at the end of the image data."""
+
+        while not self.__chunk_bytes_left:
+            if self.__in_chunk:
+                self.__file.seek(4, io.SEEK_CUR)  # CRC
+            header = self.__file.read(8)
+            if len(header) < 8 or header[4:] != b'IDAT':
+                return b''
+            self.__chunk_bytes_left = struct.unpack('>I', header[:4])[0]
+            self.__in_chunk = True
+        data = self.__file.read(min(self.__chunk_bytes_left, self.READ_BYTES))
+        self.__chunk_bytes_left -= len(data)
+        return data
+
+    def __inflate(self, byte_count):
+        """Inflates image data until at least byte_count bytes of it are waiting to be unfiltered."""
+
+        while len(self.__filtered) < byte_count:
+            data = self.__inflater.unconsumed_tail or self.__read_image_data()
+            if not data:
+                raise OSError('PNG image data is truncated')
+            self.__filtered += self.__inflater.decompress(data, byte_count - len(self.__filtered))
+
+    def read_rows(self, first_row, last_row):
+        """Returns rows first_row to last_row of the image, as an array with shape (rows, width, samples), or
+        (rows, width) for gray images.
+        """
+
+        if first_row < self.__next_row:
+            self.__restart()
+        skip_rows = max(1, self.SKIP_BYTES // (1 + self.__width * self.__samples))
+        while self.__next_row < first_row:  # each row is unfiltered using the one before it
+            self.__unfilter_rows(min(first_row - self.__next_row, skip_rows))
+        band = self.__unfilter_rows(last_row - first_row)
+        if self.__palette is not None:
+            band = self.__palette[band]
+        return band
+
+    def __unfilter_rows(self, row_count):
+        """Unfilters the next rows of the image.
+
+        :return: uint8 array with shape (row_count, width, samples), or (row_count, width) for one sample per pixel
+        """
+
+        row_bytes = 1 + self.__width * self.__samples
+        self.__inflate(row_count * row_bytes)
+        image_data = b'\x00' + self.__previous_row + self.__filtered[:row_count * row_bytes]
+        del self.__filtered[:row_count * row_bytes]
+
+        header = struct.pack('>IIBBBBB', self.__width, row_count + 1, 8, self.SAMPLES_COLOR_TYPES[self.__samples],
+                             0, 0, 0)
+        png = self.PNG_SIGNATURE + self.__chunk(b'IHDR', header) + \
+            self.__chunk(b'IDAT', zlib.compress(image_data, 0)) + self.__chunk(b'IEND', b'')
+        del image_data
+        with Image.open(io.BytesIO(png)) as image:
+            rows = np.asarray(image)[1:]
+
+        self.__previous_row = rows[-1].tobytes()
+        self.__next_row += row_count
+        return rows
+
+    @staticmethod
+    def __chunk(chunk_type, data):
+        """Returns a PNG chunk."""
+
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    def close(self):
+        self.__filtered = None
+        self.__file.close()
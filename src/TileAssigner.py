@@ -0,0 +1,146 @@
+import numpy as np
+
+
+class TileAssigner:
+    """A class that assigns tiles to the cells of a photomosaic under reuse constraints: each tile can be limited to a
+    maximum number of uses, and a tile can be kept from repeating within a radius of cells. Cell-tile pairs from each
+    cell's closest candidates are assigned greedily, closest pairs first. Cells whose candidates are all ruled out are
+    given new candidates from the tiles still available, in rounds, rather than being retried one at a time.
+
+    :method get_candidate_count: returns the number of candidates to find for each cell
+    :method check_feasible: checks that a grid can be filled under the reuse limit
+    :method assign: assigns a tile to every cell
+    """
+
+    MIN_CANDIDATE_COUNT = 8
+    ROUND_CELL_COUNT = 1024  # the maximum number of unassigned cells given new candidates at a time
+    ROUND_CANDIDATE_COUNT = 64  # rounds are made small enough that each cell needs about this many new candidates
+    POOL_SIZE_FACTOR = 8  # how many times more tiles than candidates per cell are pooled for each round's cells
+
+    def __init__(self, max_tile_uses=None, no_repeat_radius=0):
+        """Initialise the constraints.
+
+        :param max_tile_uses: the maximum number of times each tile can be used, or None for no limit (default None)
+        :param no_repeat_radius: the number of cells around each cell, horizontally, vertically and diagonally, that
+         can't use the same tile (default 0)
+        """
+
+        if max_tile_uses is not None and max_tile_uses < 1:
+            raise ValueError(f'Invalid maximum tile uses {max_tile_uses!r}. Expected None or at least 1.')
+        if no_repeat_radius < 0:
+            raise ValueError(f'Invalid no-repeat radius {no_repeat_radius!r}. Expected at least 0.')
+
+        self.max_tile_uses = max_tile_uses
+        self.no_repeat_radius = no_repeat_radius
+
+    def get_candidate_count(self):
+        """Returns the number of candidates to find for each cell, enough that a tile used by every other cell within
+        the no-repeat radius still leaves one.
+        """
+
+        return max(self.MIN_CANDIDATE_COUNT, (2 * self.no_repeat_radius + 1) ** 2)
+
+    def check_feasible(self, cell_count, tile_count):
+        """Raises a ValueError if the cells can't all be filled without using a tile more than the maximum times.
+
+        :param cell_count: the number of cells in the grid
+        :param tile_count: the number of tiles
+        """
+
+        if self.max_tile_uses is not None and self.max_tile_uses * tile_count < cell_count:
+            raise ValueError(f'Cannot fill {cell_count} cells with {tile_count} tiles used at most '
+                             f'{self.max_tile_uses} times each. Increase the maximum tile uses, add tiles or reduce '
+                             f'the row/column count.')
+
+    def assign(self, candidate_indexes, candidate_distances, tile_index, tile_count, get_cells):
+        """Assigns a tile to every cell. Cells left unassigned after their candidates are used up are given new
+        candidates in rounds of up to ROUND_CELL_COUNT cells that wanted the same tile, each with enough candidates that
+        the round's cells can usually all be filled. Rather than searching every available tile for every cell, the
+        tiles still available that are closest to the average of the round's cells are pooled first and each cell's
+        candidates are found in the pool. The no-repeat radius is relaxed only if no tile that satisfies it is left for
+        the remaining cells.
+
+        :param candidate_indexes: (row_count, column_count, k) array of each cell's candidate tile indexes
+        :param candidate_distances: (row_count, column_count, k) array of the squared distance to each candidate
+        :param tile_index: the fitted TileIndex, used to find new candidates for cells whose candidates are ruled out
+        :param tile_count: the number of tiles
+        :param get_cells: function taking an array of cell numbers (row * column_count + column) and returning those
+         cells of the target, with shape (cell_count, tile_height, tile_width, 3)
+        :return: (row_count, column_count) array of tile indexes
+        """
+
+        row_count, column_count, k = candidate_indexes.shape
+        self.check_feasible(row_count * column_count, tile_count)
+        assignments = np.full((row_count, column_count), -1, dtype=np.intp)
+        uses = [0] * tile_count
+        radius = self.no_repeat_radius
+
+        cell_numbers = np.arange(row_count * column_count)
+        candidate_indexes = np.reshape(candidate_indexes, (len(cell_numbers), k))
+        candidate_distances = np.reshape(candidate_distances, (len(cell_numbers), k))
+        # remaining cells are given new candidates grouped by the tile they were closest to, closest first
+        closest_tiles = candidate_indexes[:, 0].copy()
+        closest_distances = candidate_distances[:, 0].copy()
+        self.__assign_greedily(cell_numbers, candidate_indexes, candidate_distances, assignments, uses, radius)
+
+        while True:
+            cell_numbers = np.flatnonzero(assignments < 0)
+            if len(cell_numbers) == 0:
+                return assignments
+            cell_numbers = cell_numbers[np.lexsort((closest_distances[cell_numbers], closest_tiles[cell_numbers]))]
+            if self.max_tile_uses is None:
+                cell_numbers = cell_numbers[:self.ROUND_CELL_COUNT]
+                available = np.arange(tile_count)
+                k = self.get_candidate_count() + (2 * radius + 1) ** 2
+            else:
+                round_cell_count = min(self.ROUND_CELL_COUNT, self.ROUND_CANDIDATE_COUNT * self.max_tile_uses)
+                cell_numbers = cell_numbers[:round_cell_count]
+                available = np.flatnonzero(np.array(uses) < self.max_tile_uses)
+                k = -(-len(cell_numbers) // self.max_tile_uses) + (2 * radius + 1) ** 2
+            cells = get_cells(cell_numbers)
+            if len(available) > k * self.POOL_SIZE_FACTOR:
+                average_cell = np.mean(cells, axis=0, keepdims=True).astype(cells.dtype)
+                available = np.sort(tile_index.query_k(average_cell, k * self.POOL_SIZE_FACTOR, available)[0][0])
+            candidate_indexes, candidate_distances = tile_index.query_k(cells, k, available)
+            if self.__assign_greedily(cell_numbers, candidate_indexes, candidate_distances, assignments, uses,
+                                      radius) == 0:
+                radius = 0  # no tile is left that satisfies the radius for the closest remaining cells
+
+    def __assign_greedily(self, cell_numbers, candidate_indexes, candidate_distances, assignments, uses, radius):
+        """Assigns cell-tile pairs in order of distance, skipping pairs whose cell is already assigned or whose tile is
+        used up or used within the radius.
+
+        :param cell_numbers: the numbers of the cells the candidates are for
+        :param candidate_indexes: (len(cell_numbers), k) array of candidate tile indexes
+        :param candidate_distances: (len(cell_numbers), k) array of the squared distance to each candidate
+        :param assignments: (row_count, column_count) array of assigned tile indexes, -1 where unassigned, updated in
+         place
+        :param uses: list of the number of times each tile is used, updated in place
+        :param radius: the no-repeat radius
+        :return: the number of cells assigned
+        """
+
+        column_count = assignments.shape[1]
+        flat_assignments = np.reshape(assignments, -1)  # view
+        order = np.argsort(candidate_distances, axis=None, kind='stable')
+        pair_cells = cell_numbers[order // candidate_indexes.shape[1]].tolist()
+        pair_tiles = np.reshape(candidate_indexes, -1)[order].tolist()
+
+        max_tile_uses = self.max_tile_uses
+        unassigned_count = len(cell_numbers)
+        assigned = set()
+        for cell, tile in zip(pair_cells, pair_tiles):
+            if cell in assigned or (max_tile_uses is not None and uses[tile] >= max_tile_uses):
+                continue
+            if radius:
+                row, column = divmod(cell, column_count)
+                if (assignments[max(0, row - radius):row + radius + 1,
+                                max(0, column - radius):column + radius + 1] == tile).any():
+                    continue
+
+            flat_assignments[cell] = tile
+            uses[tile] += 1
+            assigned.add(cell)
+            if len(assigned) == unassigned_count:
+                break
+        return len(assigned)
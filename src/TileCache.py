@@ -0,0 +1,283 @@
+import json
+import os
+import uuid
+import numpy as np
+
+
+class TileCache:
+    """A class that persists pre-processed tiles next to the input image directory so that repeat runs only decode new
+    or changed images. Tiles are stored in a memory-mapped .npy file alongside a manifest recording the path,
+    modification time and size of every image, keyed by tile height, tile width, tile data type and crop mode. Fitted
+    tile indexes are stored as arrays alongside the tiles file they were fitted to and removed with it. Only the
+    MAX_CACHED_KEYS most recently used keys are kept, so trying many tile sizes doesn't fill the disk. Nothing in the
+    cache is unpickled, so a library shared along with its cache can't run code when it is loaded.
+
+    :method load: returns the tiles for the given image files, pre-processing only those that are not already cached
+    :method get_tiles_file_name: returns the name of the tiles file last loaded, which changes whenever the tiles do
+    :method get_tile_file_paths: returns the path of the image each of the tiles last loaded was made from
+    :method load_index: restores the tile index saved for the tiles last loaded
+    :method save_index: saves a tile index fitted to the tiles last loaded
+    """
+
+    CACHE_DIRECTORY_NAME = '.photomosaic_cache'
+    MANIFEST_VERSION = 2  # tiles cached by earlier versions were decoded differently, so are pre-processed again
+    MAX_CACHED_KEYS = 4  # the number of tile sizes, data types and crop modes whose tiles are kept in the cache
+
+    def __init__(self, input_directory_path, tile_height, tile_width, dtype, crop_mode='stretch'):
+        """Initialise the locations of the cache files.
+
+        :param input_directory_path: the path to the directory of the input images
+        :param tile_height: the height of each tile in pixels
+        :param tile_width: the width of each tile in pixels
+        :param dtype: the data type the tiles are stored as
+        :param crop_mode: how the images were fitted to the tile's aspect ratio (default 'stretch')
+        """
+
+        self.__input_directory_path = input_directory_path
+        self.__cache_directory_path = os.path.join(input_directory_path, self.CACHE_DIRECTORY_NAME)
+        self.__key = f'tiles_{tile_height}x{tile_width}_{np.dtype(dtype).name}_{crop_mode}'
+        self.__manifest_path = os.path.join(self.__cache_directory_path, f'{self.__key}.json')
+        self.__tile_shape = (tile_height, tile_width, 3)
+        self.__dtype = np.dtype(dtype)
+        self.__tiles_file_name = None
+        self.__tile_file_paths = None
+
+    def load(self, file_paths, pre_process_tiles):
+        """Returns the tiles for the given image files in the same order, skipping images that could not be
+        pre-processed. Images whose path, modification time and size match the manifest are read from the cache; the
+        rest are passed to pre_process_tiles and the cache is rewritten, discarding tile indexes fitted to the old
+        tiles and the tiles of the least recently used keys beyond MAX_CACHED_KEYS. If the cache cannot be written the
+        tiles are returned in memory instead.
+
+        :param file_paths: the paths of the images to use as tiles
+        :param pre_process_tiles: function taking a list of file paths and returning a list of tiles, with None for
+         images that could not be pre-processed
+        :return: array of tiles with shape (tile_count, tile_height, tile_width, 3)
+        """
+
+        manifest = self.__read_manifest()
+        cached_entries = {entry['path']: entry for entry in manifest['entries']} if manifest is not None else {}
+        cached_tiles = self.__open_tiles(manifest)
+        if cached_tiles is None:
+            cached_entries = {}
+
+        entries = []
+        stale_file_paths = []
+        for file_path in file_paths:
+            entry = self.__get_entry(file_path)
+            cached_entry = cached_entries.get(entry['path'])
+            if cached_entry is not None and cached_entry['mtime_ns'] == entry['mtime_ns'] and \
+                    cached_entry['size'] == entry['size']:
+                entry['index'] = cached_entry['index']
+            else:
+                stale_file_paths.append(file_path)
+                entry['index'] = None
+            entries.append((file_path, entry))
+
+        if not stale_file_paths and manifest is not None and len(entries) == len(cached_entries):
+            self.__tiles_file_name = manifest['tiles_file']
+            self.__set_tile_file_paths(entries, len(cached_tiles))
+            self.__touch_manifest()
+            return cached_tiles
+
+        new_tiles = dict(zip(stale_file_paths, pre_process_tiles(stale_file_paths)))
+        tile_count = sum(1 for file_path, entry in entries
+                         if (new_tiles[file_path] if file_path in new_tiles else entry['index']) is not None)
+
+        tiles_file_name = f'{self.__key}_{uuid.uuid4().hex}.npy'
+        try:
+            os.makedirs(self.__cache_directory_path, exist_ok=True)
+            tiles = np.lib.format.open_memmap(os.path.join(self.__cache_directory_path, tiles_file_name), mode='w+',
+                                              dtype=self.__dtype, shape=(tile_count,) + self.__tile_shape)
+        except OSError:
+            tiles_file_name = None
+            tiles = np.empty((tile_count,) + self.__tile_shape, dtype=self.__dtype)
+
+        index = 0
+        for file_path, entry in entries:
+            if file_path in new_tiles:
+                tile = new_tiles[file_path]
+            else:
+                tile = cached_tiles[entry['index']] if entry['index'] is not None else None
+            if tile is None:
+                entry['index'] = None
+            else:
+                tiles[index] = tile
+                entry['index'] = index
+                index += 1
+
+        if tiles_file_name is not None:
+            tiles.flush()
+            self.__write_manifest({'version': self.MANIFEST_VERSION, 'tiles_file': tiles_file_name,
+                                   'entries': [entry for file_path, entry in entries]})
+            self.__remove_stale_tiles_files(tiles_file_name)
+            self.__remove_least_recently_used_keys()
+            del tiles
+            tiles = np.load(os.path.join(self.__cache_directory_path, tiles_file_name), mmap_mode='r')
+
+        self.__tiles_file_name = tiles_file_name
+        self.__set_tile_file_paths(entries, tile_count)
+        return tiles
+
+    def get_tiles_file_name(self):
+        """Returns the name of the tiles file last loaded, or None if the tiles could not be cached. The name changes
+        whenever the cached tiles do, so it identifies the tile set.
+        """
+
+        return self.__tiles_file_name
+
+    def get_tile_file_paths(self):
+        """Returns a list of the path of the image each of the tiles last loaded was made from, in tile order."""
+
+        return self.__tile_file_paths
+
+    def __set_tile_file_paths(self, entries, tile_count):
+        """Records the path of the image each tile was made from.
+
+        :param entries: list of (file path, manifest entry) tuples, with the entry's index None for images without tiles
+        :param tile_count: the number of tiles
+        """
+
+        self.__tile_file_paths = [None] * tile_count
+        for file_path, entry in entries:
+            if entry['index'] is not None:
+                self.__tile_file_paths[entry['index']] = file_path
+
+    def load_index(self, index_key, tile_index):
+        """Restores the state of the tile index saved for the tiles last loaded.
+
+        :param index_key: the cache key of the tile index
+        :param tile_index: a new, unfitted tile index with the settings the key identifies
+        :return: the tile index with its fitted state restored, or None if there isn't one or it can't be read
+        """
+
+        if self.__tiles_file_name is None:
+            return None
+        try:
+            with np.load(self.__get_index_path(index_key), allow_pickle=False) as state:
+                return tile_index.set_state(dict(state))
+        except Exception:
+            return None
+
+    def save_index(self, index_key, tile_index):
+        """Saves a tile index fitted to the tiles last loaded, ignoring failures to write it.
+
+        :param index_key: the cache key of the tile index
+        :param tile_index: the fitted tile index
+        """
+
+        if self.__tiles_file_name is not None:
+            self.__write_atomically(self.__get_index_path(index_key), 'wb',
+                                    lambda index_file: np.savez(index_file, **tile_index.get_state()))
+
+    def __get_index_path(self, index_key):
+        """Returns the path of the tile index file for the tiles last loaded."""
+
+        tiles_file_stem = os.path.splitext(self.__tiles_file_name)[0]
+        return os.path.join(self.__cache_directory_path, f'{tiles_file_stem}.{index_key}.npz')
+
+    def __get_entry(self, file_path):
+        """Returns the manifest entry identifying the current contents of an image file.
+
+        :param file_path: the path of the image
+        :return: dictionary of the path relative to the input directory, modification time and size
+        """
+
+        stat = os.stat(file_path)
+        return {'path': os.path.relpath(file_path, self.__input_directory_path), 'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size}
+
+    def __read_manifest(self):
+        """Reads the manifest, returning None if it is missing, unreadable or from a different manifest version."""
+
+        try:
+            with open(self.__manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('version') == self.MANIFEST_VERSION else None
+
+    def __write_manifest(self, manifest):
+        """Atomically replaces the manifest."""
+
+        self.__write_atomically(self.__manifest_path, 'w', lambda manifest_file: json.dump(manifest, manifest_file))
+
+    def __write_atomically(self, file_path, mode, write):
+        """Writes a file through a temporary file that then replaces it, so that an interrupted write never leaves a
+        corrupt cache behind. Failures to write are ignored.
+
+        :param file_path: the path of the file
+        :param mode: the mode the temporary file is opened in
+        :param write: function that writes the contents to the open temporary file
+        """
+
+        temp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp_path, mode) as temp_file:
+                write(temp_file)
+            os.replace(temp_path, file_path)
+        except Exception:
+            self.__remove_file(temp_path)
+
+    def __open_tiles(self, manifest):
+        """Memory maps the cached tiles referenced by the manifest, returning None if they are missing or invalid."""
+
+        if manifest is None:
+            return None
+        try:
+            tiles = np.load(os.path.join(self.__cache_directory_path, manifest['tiles_file']), mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+        if tiles.dtype != self.__dtype or tiles.shape[1:] != self.__tile_shape:
+            return None
+        return tiles
+
+    def __remove_stale_tiles_files(self, current_tiles_file_name):
+        """Removes tiles files and their tile indexes for this key other than the current ones, including any left
+        behind by earlier runs.
+        """
+
+        current_tiles_file_stem = os.path.splitext(current_tiles_file_name)[0]
+        for file_name in os.listdir(self.__cache_directory_path):
+            if file_name.startswith(f'{self.__key}_') and not file_name.startswith(current_tiles_file_stem) and \
+                    file_name.endswith(('.npy', '.npz', '.pkl')):  # .pkl indexes were saved by earlier versions
+                self.__remove_file(os.path.join(self.__cache_directory_path, file_name))
+
+    def __touch_manifest(self):
+        """Updates the manifest's modification time, which records when the key was last used. Failures are ignored."""
+
+        try:
+            os.utime(self.__manifest_path)
+        except OSError:
+            pass
+
+    def __remove_least_recently_used_keys(self):
+        """Removes the manifests, tiles files and tile indexes of every key other than this one and the most recently
+        used others, keeping MAX_CACHED_KEYS keys in all. Files of keys without a manifest are removed too.
+        """
+
+        manifest_times = {}
+        for file_name in os.listdir(self.__cache_directory_path):
+            if file_name.startswith('tiles_') and file_name.endswith('.json'):
+                try:
+                    manifest_times[file_name[:-len('.json')]] = os.stat(
+                        os.path.join(self.__cache_directory_path, file_name)).st_mtime_ns
+                except OSError:
+                    pass
+        manifest_times.pop(self.__key, None)
+        kept_keys = [self.__key] + sorted(manifest_times, key=manifest_times.get,
+                                          reverse=True)[:self.MAX_CACHED_KEYS - 1]
+
+        for file_name in os.listdir(self.__cache_directory_path):
+            if file_name.startswith('tiles_') and file_name.endswith(('.json', '.npy', '.npz', '.pkl')) and \
+                    not any(file_name == f'{key}.json' or file_name.startswith(f'{key}_') for key in kept_keys):
+                self.__remove_file(os.path.join(self.__cache_directory_path, file_name))
+
+    @staticmethod
+    def __remove_file(file_path):
+        """Removes a file, ignoring failures (e.g. the file is still memory mapped on Windows)."""
+
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
@@ -0,0 +1,160 @@
+import numpy as np
+
+
+class TileDescriptor:
+    """A base class for compact descriptors of tiles and target cells that are cheap to search.
+
+    :method fit: learns any parameters the descriptor needs from the tiles
+    :method transform: computes the descriptor of each image
+    :method get_cache_key: returns a string identifying the descriptor's settings
+    :method get_state: returns the fitted parameters as a dictionary of arrays
+    :method set_state: restores fitted parameters returned by get_state
+    """
+
+    batch_size = 1024
+
+    def get_cache_key(self):
+        """Returns a string identifying the descriptor's settings, used to name cached tile indexes, or None if indexes
+        using the descriptor shouldn't be cached.
+        """
+
+        return None
+
+    def fit(self, tiles):
+        """Learns any parameters the descriptor needs from the tiles.
+
+        :param tiles: array of tiles with shape (tile_count, tile_height, tile_width, 3)
+        :return: the descriptor
+        """
+
+        return self
+
+    def get_state(self):
+        """Returns the parameters learnt by fit as a dictionary of arrays, so that they can be cached without pickling.
+        Settings aren't included, as they are part of the cache key.
+        """
+
+        return {}
+
+    def set_state(self, state):
+        """Restores the parameters learnt by fit.
+
+        :param state: dictionary of arrays returned by get_state
+        :return: the descriptor
+        """
+
+        return self
+
+    def transform(self, images):
+        """Computes the descriptor of each image in batches.
+
+        :param images: array of tiles or target cells with shape (image_count, tile_height, tile_width, 3)
+        :return: float32 array with one descriptor per row
+        """
+
+        batches = [self._transform_batch(images[start:start + self.batch_size])
+                   for start in range(0, len(images), self.batch_size)]
+        return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+
+    def _transform_batch(self, images):
+        """Computes the descriptor of each image in a batch."""
+
+        raise NotImplementedError
+
+
+class GridDescriptor(TileDescriptor):
+    """A descriptor of the mean colour of each cell in a grid laid over the image. A grid size of 1 gives the mean
+    colour of the whole image.
+    """
+
+    COLOR_SPACES = ('rgb', 'lab')
+
+    def __init__(self, grid_size=2, color_space='rgb'):
+        """Initialise the grid size and colour space.
+
+        :param grid_size: the number of grid cells along each side (default 2)
+        :param color_space: 'rgb' or 'lab' (default 'rgb')
+        """
+
+        if color_space not in self.COLOR_SPACES:
+            raise ValueError(f'Unknown colour space {color_space!r}. Expected one of {", ".join(self.COLOR_SPACES)}.')
+
+        self.grid_size = grid_size
+        self.color_space = color_space
+
+    def get_cache_key(self):
+        """Returns a string identifying the grid size and colour space."""
+
+        return f'grid{self.grid_size}-{self.color_space}'
+
+    def _transform_batch(self, images):
+        """Averages each grid cell of every image in a batch, then converts the averages to the colour space."""
+
+        height, width = images.shape[1:3]
+        row_starts = np.unique(np.linspace(0, height, min(self.grid_size, height) + 1).astype(int)[:-1])
+        column_starts = np.unique(np.linspace(0, width, min(self.grid_size, width) + 1).astype(int)[:-1])
+        sums = np.add.reduceat(np.add.reduceat(images.astype(np.float32), row_starts, axis=1), column_starts, axis=2)
+        counts = np.outer(np.diff(np.append(row_starts, height)), np.diff(np.append(column_starts, width)))
+        means = sums / counts[np.newaxis, :, :, np.newaxis]
+
+        if self.color_space == 'lab':
+            from skimage import color
+
+            means = color.rgb2lab(means / 255).astype(np.float32)
+        return np.reshape(means, (len(images), -1))
+
+
+class PcaDescriptor(TileDescriptor):
+    """A descriptor of the full pixel vector projected onto its principal components, fitted incrementally so that the
+    tiles are only ever converted to float32 one batch at a time.
+    """
+
+    def __init__(self, n_components=16):
+        """Initialise the number of principal components.
+
+        :param n_components: the number of dimensions each descriptor is reduced to (default 16)
+        """
+
+        self.n_components = n_components
+        self.__mean = None
+        self.__components = None
+
+    def get_cache_key(self):
+        """Returns a string identifying the number of principal components."""
+
+        return f'pca{self.n_components}'
+
+    def fit(self, tiles):
+        """Fits the principal components to the tiles."""
+
+        from sklearn import decomposition
+
+        rows = np.reshape(tiles, (len(tiles), -1))
+        n_components = min(self.n_components, *rows.shape)
+        pca = decomposition.IncrementalPCA(n_components=n_components)
+        batch_size = max(self.batch_size, n_components)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            if len(batch) >= n_components:
+                pca.partial_fit(batch.astype(np.float32))
+        self.__mean = pca.mean_.astype(np.float32)
+        self.__components = pca.components_.astype(np.float32)
+        return self
+
+    def get_state(self):
+        """Returns the mean and principal components of the tiles."""
+
+        return {'mean': self.__mean, 'components': self.__components}
+
+    def set_state(self, state):
+        """Restores the mean and principal components of the tiles."""
+
+        self.__mean = state['mean']
+        self.__components = state['components']
+        return self
+
+    def _transform_batch(self, images):
+        """Projects each image in a batch onto the principal components."""
+
+        rows = np.reshape(images, (len(images), -1)).astype(np.float32)
+        return (rows - self.__mean) @ self.__components.T
@@ -0,0 +1,355 @@
+import numpy as np
+from TileDescriptors import GridDescriptor, PcaDescriptor
+from TileMatcher import TileMatcher
+
+
+class TileIndex:
+    """A base class for search indexes that find the closest tile to each target cell.
+
+    :method fit: builds the index from the tiles
+    :method attach: restores the index's references to the tiles after it has been unpickled or its state set
+    :method query: finds the index of the closest tile to each target cell
+    :method query_k: finds the indexes of the k closest tiles to each target cell
+    :method get_cache_key: returns a string identifying the index's settings
+    :method get_state: returns the fitted index as a dictionary of arrays, leaving out the tiles
+    :method set_state: restores a fitted index returned by get_state
+    """
+
+    def get_cache_key(self):
+        """Returns a string identifying the settings that affect fitting, used to cache fitted indexes on disk. Indexes
+        that return None are never cached.
+        """
+
+        return None
+
+    def fit(self, tiles):
+        """Builds the index from the tiles.
+
+        :param tiles: array of tiles with shape (tile_count, tile_height, tile_width, 3)
+        :return: the index
+        """
+
+        raise NotImplementedError
+
+    def get_state(self):
+        """Returns the fitted index as a dictionary of arrays, so that it can be cached on disk without pickling, which
+        would let a tile library shared with its cache run code when it is loaded. Settings aren't included, as they
+        are part of the cache key, and the tiles are left out so that the cached index doesn't duplicate the tile cache.
+
+        :return: dictionary of arrays
+        """
+
+        raise NotImplementedError
+
+    def set_state(self, state):
+        """Restores a fitted index returned by get_state. attach must be called before it is queried.
+
+        :param state: dictionary of arrays
+        :return: the index
+        """
+
+        raise NotImplementedError
+
+    def attach(self, tiles):
+        """Restores the index's references to the tiles after it has been unpickled or its state set. Tiles are left out
+        when an index is pickled to be sent to worker processes, as they share the tiles.
+
+        :param tiles: the tiles the index was fitted to
+        :return: the index
+        """
+
+        raise NotImplementedError
+
+    def query(self, cells):
+        """Finds the index of the closest tile to each target cell.
+
+        :param cells: array of target cells with shape (cell_count, tile_height, tile_width, 3)
+        :return: array of tile indexes
+        """
+
+        raise NotImplementedError
+
+    def query_k(self, cells, k, candidate_indexes=None):
+        """Finds the indexes of the k closest tiles to each target cell, for assigning tiles under constraints.
+
+        :param cells: array of target cells with shape (cell_count, tile_height, tile_width, 3)
+        :param k: the number of tiles to find for each cell, capped at the number of tiles searched
+        :param candidate_indexes: indexes of the tiles to search, e.g. those not yet used up (default all tiles)
+        :return: tuple of (cell_count, k) arrays of tile indexes and squared distances, closest first. Distances are
+         between pixels, or between descriptors for indexes that rank tiles by descriptor alone
+        """
+
+        raise NotImplementedError
+
+
+class ClusterIndex(TileIndex):
+    """An index that clusters the full pixel vectors of the tiles with MiniBatchKMeans and searches every tile in the
+    cell's cluster exactly.
+    """
+
+    def __init__(self, n_clusters=8, batch_size=1024, passes=3):
+        """Initialise the clustering settings.
+
+        :param n_clusters: the maximum number of clusters (default 8)
+        :param batch_size: the number of tiles converted to float32 at a time (default 1024)
+        :param passes: the number of passes made over the tiles when fitting (default 3)
+        """
+
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.passes = passes
+        self.__cluster_centers = None
+        self.__cluster_matcher = None
+        self.__tile_clusters = None
+        self.__tile_matcher = None
+
+    def fit(self, tiles):
+        """Fits the tiles into clusters. Tiles are converted to float32 one batch at a time so that the whole library
+        is never copied out of its compact representation.
+        """
+
+        from sklearn import cluster
+
+        rows = np.reshape(tiles, (len(tiles), -1))
+        n_clusters = min(self.n_clusters, len(tiles))
+        clusters = cluster.MiniBatchKMeans(n_clusters=n_clusters, batch_size=self.batch_size, random_state=0)
+        batch_size = max(self.batch_size, n_clusters)
+        for _ in range(self.passes):
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                if len(batch) >= n_clusters:
+                    clusters.partial_fit(batch.astype(np.float32))
+
+        self.__set_cluster_centers(clusters.cluster_centers_)
+        self.__tile_clusters = self.__predict_clusters(rows)
+        return self.attach(tiles)
+
+    def get_state(self):
+        """Returns the cluster centers and the cluster of each tile."""
+
+        return {'cluster_centers': self.__cluster_centers, 'tile_clusters': self.__tile_clusters}
+
+    def set_state(self, state):
+        """Restores the cluster centers and the cluster of each tile."""
+
+        self.__set_cluster_centers(state['cluster_centers'])
+        self.__tile_clusters = state['tile_clusters']
+        return self
+
+    def __set_cluster_centers(self, cluster_centers):
+        """Sets the cluster centers, which cells are assigned to the closest of."""
+
+        self.__cluster_centers = np.asarray(cluster_centers, dtype=np.float32)
+        self.__cluster_matcher = TileMatcher(self.__cluster_centers)
+
+    def attach(self, tiles):
+        """Rebuilds the exact matcher over the tiles."""
+
+        self.__tile_matcher = TileMatcher(tiles)
+        return self
+
+    def get_cache_key(self):
+        """Returns a string identifying the clustering settings."""
+
+        return f'cluster-{self.n_clusters}-{self.batch_size}-{self.passes}'
+
+    def __getstate__(self):
+        """Returns the state to pickle, leaving out the tiles."""
+
+        state = self.__dict__.copy()
+        state['_ClusterIndex__tile_matcher'] = None
+        return state
+
+    def query(self, cells):
+        """Predicts the cluster of every cell in one batched pass and scores each cluster's tiles together."""
+
+        rows = np.reshape(cells, (len(cells), -1))
+        cell_clusters = self.__predict_clusters(rows)
+        tile_indexes = np.zeros(len(rows), dtype=np.intp)
+
+        for cluster_num in np.unique(cell_clusters):
+            cell_mask = cell_clusters == cluster_num
+            candidate_indexes = np.flatnonzero(self.__tile_clusters == cluster_num)
+            if len(candidate_indexes) == 0:
+                candidate_indexes = None  # falls back to every tile if no tiles were assigned to the cluster
+            tile_indexes[cell_mask] = self.__tile_matcher.nearest(rows[cell_mask], candidate_indexes)[0]
+
+        return tile_indexes
+
+    def query_k(self, cells, k, candidate_indexes=None):
+        """Finds the k closest tiles in each cell's cluster, or in every tile searched if the cluster has fewer than k.
+        """
+
+        rows = np.reshape(cells, (len(cells), -1))
+        cell_clusters = self.__predict_clusters(rows)
+        searched = np.ones(len(self.__tile_clusters), dtype=bool)
+        if candidate_indexes is not None:
+            searched[:] = False
+            searched[candidate_indexes] = True
+        k = max(1, min(k, np.count_nonzero(searched)))
+        tile_indexes = np.zeros((len(rows), k), dtype=np.intp)
+        distances = np.zeros((len(rows), k))
+
+        for cluster_num in np.unique(cell_clusters):
+            cell_mask = cell_clusters == cluster_num
+            cluster_candidate_indexes = np.flatnonzero(searched & (self.__tile_clusters == cluster_num))
+            if len(cluster_candidate_indexes) < k:
+                cluster_candidate_indexes = np.flatnonzero(searched)
+            tile_indexes[cell_mask], distances[cell_mask] = self.__tile_matcher.nearest_k(rows[cell_mask], k,
+                                                                                          cluster_candidate_indexes)
+
+        return tile_indexes, distances
+
+    def __predict_clusters(self, rows):
+        """Predicts the cluster of each row as its closest cluster center, converting to float one block at a time."""
+
+        return self.__cluster_matcher.nearest(rows)[0]
+
+
+class DescriptorIndex(TileIndex):
+    """An index that searches compact tile descriptors for the closest candidates to each cell, then re-ranks those
+    candidates by exact distance on the full pixels. With no re-ranking, tiles are ranked by descriptor distance alone,
+    e.g. perceptual distance for CIELAB grid descriptors, and full-resolution tiles are never compared.
+    """
+
+    BACKENDS = ('kdtree', 'brute')
+
+    def __init__(self, descriptor=None, backend='kdtree', rerank_count=16):
+        """Initialise the descriptor and search backend.
+
+        :param descriptor: the TileDescriptor used to describe tiles and cells (default a 2x2 RGB GridDescriptor)
+        :param backend: 'kdtree' to search a KD-tree, or 'brute' for exact blocked nearest neighbours (default
+         'kdtree')
+        :param rerank_count: the number of candidates found per cell and re-ranked on the full pixels, or 0 to rank
+         tiles by descriptor distance alone (default 16)
+        """
+
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Unknown search backend {backend!r}. Expected one of {", ".join(self.BACKENDS)}.')
+
+        self.descriptor = descriptor if descriptor is not None else GridDescriptor(2)
+        self.backend = backend
+        self.rerank_count = rerank_count
+        self.__descriptors = None
+        self.__search_tree = None
+        self.__descriptor_matcher = None
+        self.__tile_matcher = None
+
+    def fit(self, tiles):
+        """Computes the descriptor of every tile and builds the search backend over them."""
+
+        self.__set_descriptors(self.descriptor.fit(tiles).transform(tiles))
+        return self.attach(tiles)
+
+    def get_state(self):
+        """Returns the descriptor of every tile and the descriptor's fitted parameters. The KD-tree is left out, as it
+        is quick to rebuild from the descriptors.
+        """
+
+        state = {f'descriptor_{name}': value for name, value in self.descriptor.get_state().items()}
+        state['descriptors'] = self.__descriptors
+        return state
+
+    def set_state(self, state):
+        """Restores the descriptor of every tile and the descriptor's parameters, and rebuilds the search backend."""
+
+        self.descriptor.set_state({name[len('descriptor_'):]: value for name, value in state.items()
+                                   if name.startswith('descriptor_')})
+        self.__set_descriptors(state['descriptors'])
+        return self
+
+    def __set_descriptors(self, descriptors):
+        """Sets the descriptor of every tile and builds the search backend over them."""
+
+        from sklearn import neighbors
+
+        self.__descriptors = descriptors
+        if self.backend == 'kdtree':
+            self.__search_tree = neighbors.KDTree(descriptors)
+            self.__descriptor_matcher = None
+        else:
+            self.__search_tree = None
+            self.__descriptor_matcher = TileMatcher(descriptors)
+
+    def attach(self, tiles):
+        """Rebuilds the exact matcher used to re-rank candidates, if they are re-ranked."""
+
+        self.__tile_matcher = TileMatcher(tiles) if self.rerank_count > 0 else None
+        return self
+
+    def get_cache_key(self):
+        """Returns a string identifying the descriptor, search backend and whether candidates are re-ranked."""
+
+        descriptor_key = self.descriptor.get_cache_key()
+        if descriptor_key is None:
+            return None
+        return f'descriptor-{descriptor_key}-{self.backend}' + ('-unranked' if self.rerank_count == 0 else '')
+
+    def __getstate__(self):
+        """Returns the state to pickle, leaving out the tiles."""
+
+        state = self.__dict__.copy()
+        state['_DescriptorIndex__tile_matcher'] = None
+        if self.__search_tree is not None:
+            state['_DescriptorIndex__descriptor_matcher'] = None  # rebuilt from the descriptors when needed
+        return state
+
+    def query(self, cells):
+        """Finds the closest candidates to each cell by descriptor and picks the best by exact pixel distance."""
+
+        descriptors = self.descriptor.transform(cells)
+        if self.rerank_count == 0:
+            return self.__query_descriptors(descriptors, 1)[0][:, 0]
+        if self.__search_tree is not None:
+            k = min(self.rerank_count, self.__search_tree.data.shape[0])
+            candidate_indexes = self.__search_tree.query(descriptors, k=k, return_distance=False)
+        else:
+            candidate_indexes = self.__descriptor_matcher.nearest_k(descriptors, self.rerank_count)[0]
+        return self.__tile_matcher.rerank(cells, candidate_indexes)[0]
+
+    def query_k(self, cells, k, candidate_indexes=None):
+        """Finds at least k candidates for each cell by descriptor and keeps the k closest by exact pixel distance. The
+        KD-tree can't be limited to some tiles, so searches of some tiles are made on the descriptors directly.
+        """
+
+        descriptors = self.descriptor.transform(cells)
+        if self.rerank_count == 0:
+            return self.__query_descriptors(descriptors, k, candidate_indexes)
+        cell_candidate_indexes = self.__query_descriptors(descriptors, max(k, self.rerank_count), candidate_indexes)[0]
+        return self.__tile_matcher.rerank_k(cells, cell_candidate_indexes, k)
+
+    def __query_descriptors(self, descriptors, k, candidate_indexes=None):
+        """Finds the k tiles with the closest descriptors to each descriptor.
+
+        :return: tuple of (descriptor_count, k) arrays of tile indexes and squared descriptor distances, closest first
+        """
+
+        if self.__search_tree is not None and candidate_indexes is None:
+            distances, tile_indexes = self.__search_tree.query(descriptors, k=min(k, self.__search_tree.data.shape[0]))
+            return tile_indexes, distances ** 2
+        if self.__descriptor_matcher is None:
+            self.__descriptor_matcher = TileMatcher(self.__descriptors)
+        return self.__descriptor_matcher.nearest_k(descriptors, k, candidate_indexes)
+
+
+TILE_INDEXES = {
+    'cluster': ClusterIndex,
+    'kdtree': lambda: DescriptorIndex(GridDescriptor(2), 'kdtree'),
+    'brute': lambda: DescriptorIndex(GridDescriptor(4), 'brute'),
+    'pca': lambda: DescriptorIndex(PcaDescriptor(16), 'kdtree'),
+    'lab': lambda: DescriptorIndex(GridDescriptor(3, 'lab'), 'kdtree', rerank_count=0),
+}
+
+
+def create_tile_index(tile_index):
+    """Returns a new tile index from its name, or the tile index itself if one is given.
+
+    :param tile_index: a TileIndex, or the name of one of TILE_INDEXES
+    :return: the tile index
+    """
+
+    if isinstance(tile_index, TileIndex):
+        return tile_index
+    if tile_index not in TILE_INDEXES:
+        raise ValueError(f'Unknown tile index {tile_index!r}. Expected one of {", ".join(TILE_INDEXES)}.')
+    return TILE_INDEXES[tile_index]()
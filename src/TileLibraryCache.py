@@ -0,0 +1,96 @@
+import collections
+import threading
+
+
+class TileLibraryCache:
+    """A class that keeps a PhotomosaicGenerator warm for each tile library (directory of input images) in use, so that
+    the library's tiles and tile index stay in memory between photomosaics. Generators that aren't in use are evicted,
+    least recently used first, when the generators together hold more than the memory budget.
+
+    :method acquire: returns the generator for a library for exclusive use, creating it if needed
+    :method release: returns a generator after use, evicting generators to keep within the memory budget
+    :method get_libraries: describes the libraries held
+    :method close: closes every generator
+    """
+
+    def __init__(self, create_generator, memory_budget=None):
+        """Initialise the empty cache.
+
+        :param create_generator: function that returns a new PhotomosaicGenerator
+        :param memory_budget: the number of bytes the generators can hold before those not in use are evicted, or None
+         for no limit (default None)
+        """
+
+        self.__create_generator = create_generator
+        self.__memory_budget = memory_budget
+        self.__libraries = collections.OrderedDict()  # directory to library, least recently used first
+        self.__lock = threading.Lock()
+
+    def acquire(self, input_directory_path):
+        """Returns the generator for a library, set to the library's directory, waiting until no other thread is using
+        it. Every call must be followed by a call to release.
+
+        :param input_directory_path: the directory of the library's images
+        :return: the PhotomosaicGenerator
+        """
+
+        with self.__lock:
+            library = self.__libraries.get(input_directory_path)
+            if library is None:
+                library = self.__libraries[input_directory_path] = _TileLibrary(self.__create_generator())
+            self.__libraries.move_to_end(input_directory_path)
+            library.users += 1  # keeps the library from being evicted while waiting for it
+        library.lock.acquire()
+        library.generator.set_input_directory_path(input_directory_path)
+        return library.generator
+
+    def release(self, input_directory_path):
+        """Releases a generator returned by acquire and evicts the least recently used generators not in use until
+        the rest fit in the memory budget.
+
+        :param input_directory_path: the directory of the library's images
+        """
+
+        with self.__lock:
+            library = self.__libraries[input_directory_path]
+            library.memory_usage = library.generator.get_memory_usage()
+            library.users -= 1
+            library.lock.release()
+            if self.__memory_budget is None:
+                return
+
+            memory_usage = sum(library.memory_usage for library in self.__libraries.values())
+            for evicted_directory_path, evicted_library in list(self.__libraries.items()):
+                if memory_usage <= self.__memory_budget:
+                    break
+                if evicted_library.users == 0 and evicted_directory_path != input_directory_path:
+                    memory_usage -= evicted_library.memory_usage
+                    evicted_library.generator.close()
+                    del self.__libraries[evicted_directory_path]
+
+    def get_libraries(self):
+        """Returns a list of dictionaries of the directory, bytes held and number of users of each library, least
+        recently used first.
+        """
+
+        with self.__lock:
+            return [{'source': input_directory_path, 'memory_bytes': library.memory_usage, 'users': library.users}
+                    for input_directory_path, library in self.__libraries.items()]
+
+    def close(self):
+        """Closes every generator."""
+
+        with self.__lock:
+            for library in self.__libraries.values():
+                library.generator.close()
+            self.__libraries.clear()
+
+
+class _TileLibrary:
+    """A generator held by a TileLibraryCache, with the lock that gives a thread exclusive use of it."""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.lock = threading.Lock()
+        self.users = 0  # the number of threads using or waiting for the generator
+        self.memory_usage = 0
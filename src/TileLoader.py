@@ -0,0 +1,466 @@
+import contextlib
+import io
+import math
+import multiprocessing
+import os
+import tempfile
+from multiprocessing import pool
+import numpy as np
+from PIL import ExifTags, Image
+
+EXIF_ORIENTATION = 0x0112
+EXIF_THUMBNAIL_OFFSET = 0x0201
+EXIF_THUMBNAIL_LENGTH = 0x0202
+ORIENTATION_TRANSPOSES = {2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180,
+                          4: Image.Transpose.FLIP_TOP_BOTTOM, 5: Image.Transpose.TRANSPOSE,
+                          6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE, 8: Image.Transpose.ROTATE_90}
+THUMBNAIL_ASPECT_TOLERANCE = 0.01  # EXIF thumbnails whose aspect ratio differs from the image's by more than this are
+# assumed to be letterboxed and aren't used
+RESIZE_REDUCING_GAP = 3.0  # images are first shrunk by whole factors to within this many times the tile size, which
+# is faster than resampling them from full size and indistinguishable at tile size
+CROP_MODES = ('stretch', 'center', 'entropy', 'saliency')
+CROP_ANALYSIS_SIZE = 64  # the longer side in pixels of the thumbnail that entropy and saliency crops are chosen on
+ENTROPY_CROP_POSITIONS = 17  # the number of evenly spaced crop positions whose entropy is compared
+PROCESS_CONTEXT = multiprocessing.get_context('spawn')  # worker processes are spawned, not forked, as they are
+# started from threaded processes (the GUI's worker thread, the server's request threads), whose locks a fork could
+# copy while other threads hold them
+READ_BACK_CHUNK_BYTES = 64 * 1024 * 1024  # tiles loaded by worker processes are read back from their shared file in
+# chunks of this size, so that no more than this is held twice
+
+
+def load_tile(file_path, tile_height, tile_width, crop_mode='stretch', crop_position=None):
+    """Opens an image and resizes it to be the correct height and width for a tile. JPEGs are decoded at the smallest
+    scale that is still at least as large as the tile, or from their embedded EXIF thumbnail if that is large enough,
+    rather than at full resolution. The tile is rotated and flipped as given by the image's EXIF orientation, and
+    grayscale, palette, 16 bit and CMYK images are converted to RGB, with transparency composited onto white.
+
+    :param file_path: the file path of the image
+    :param tile_height: the height of the tile in pixels
+    :param tile_width: the width of the tile in pixels
+    :param crop_mode: 'stretch' to resize the whole image to the tile's aspect ratio, or 'center', 'entropy' or
+     'saliency' to crop the largest part of the image with the tile's aspect ratio from its center, its most detailed
+     position or its most salient position (default 'stretch')
+    :param crop_position: the position of the crop found for the image before, if known (default None)
+    :return: the resized tile as a uint8 array, or None if the image could not be opened
+    """
+
+    return _load_tile(file_path, tile_height, tile_width, crop_mode, crop_position)[0]
+
+
+def _load_tile(file_path, tile_height, tile_width, crop_mode, crop_position):
+    """Opens an image and crops and resizes it to a tile in a single resampling pass, as described by load_tile.
+
+    :return: tuple of the tile as a uint8 array, or None if the image could not be opened, and the position of the crop
+     along the axis the image was cropped on, from 0 (left or top) to 1 (right or bottom), or None if it wasn't cropped
+    """
+
+    try:
+        with Image.open(file_path) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+            # the tile's size before the orientation is applied, as (width, height) like PIL sizes
+            stored_size = (tile_height, tile_width) if orientation in (5, 6, 7, 8) else (tile_width, tile_height)
+            crop_fraction = _get_crop_fraction(image.size, stored_size) if crop_mode != 'stretch' else (1, 1)
+            decoded_image = convert_to_rgb(_decode_reduced(image, (math.ceil(stored_size[0] / crop_fraction[0]),
+                                                                    math.ceil(stored_size[1] / crop_fraction[1]))))
+
+            box = None
+            if crop_mode != 'stretch':
+                if crop_position is None:
+                    crop_position = _find_crop_position(decoded_image, crop_fraction, crop_mode)
+                box = _get_crop_box(decoded_image.size, crop_fraction, crop_position)
+            tile = decoded_image.resize(stored_size, Image.Resampling.BILINEAR, box=box,
+                                        reducing_gap=RESIZE_REDUCING_GAP)
+            if orientation in ORIENTATION_TRANSPOSES:
+                tile = tile.transpose(ORIENTATION_TRANSPOSES[orientation])
+            return np.asarray(tile), crop_position
+    except Exception:
+        return None, None
+
+
+def _get_crop_fraction(image_size, tile_size):
+    """Returns the fraction of an image's width and height in the largest crop of it with a tile's aspect ratio.
+
+    :param image_size: the (width, height) of the image
+    :param tile_size: the (width, height) of the tile
+    :return: tuple of the fractions of the width and height, one of which is 1
+    """
+
+    image_width, image_height = image_size
+    tile_width, tile_height = tile_size
+    if image_width * tile_height > tile_width * image_height:
+        return tile_width * image_height / (tile_height * image_width), 1
+    return 1, tile_height * image_width / (tile_width * image_height)
+
+
+def _get_crop_box(image_size, crop_fraction, crop_position):
+    """Returns the box of an image to crop, in the image's pixels.
+
+    :param image_size: the (width, height) of the image
+    :param crop_fraction: the fractions of the width and height cropped, as returned by _get_crop_fraction
+    :param crop_position: the position of the crop along the cropped axis, from 0 to 1
+    :return: tuple of the left, top, right and bottom of the box
+    """
+
+    width, height = image_size
+    left = (1 - crop_fraction[0]) * crop_position * width
+    top = (1 - crop_fraction[1]) * crop_position * height
+    return left, top, left + crop_fraction[0] * width, top + crop_fraction[1] * height
+
+
+def _find_crop_position(image, crop_fraction, crop_mode):
+    """Chooses where to crop an image along the axis it is cropped on, using a grayscale thumbnail of it.
+
+    :param image: the RGB PIL image
+    :param crop_fraction: the fractions of the width and height cropped, as returned by _get_crop_fraction
+    :param crop_mode: 'center', 'entropy' to choose the crop whose histogram has the most entropy, or 'saliency' to
+     choose the crop containing the most spectral residual saliency
+    :return: the position of the crop, from 0 (left or top) to 1 (right or bottom)
+    """
+
+    if crop_mode == 'center' or crop_fraction == (1, 1):
+        return 0.5
+
+    scale = min(1, CROP_ANALYSIS_SIZE / max(image.size))
+    thumbnail = image.convert('L').resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                          Image.Resampling.BILINEAR, reducing_gap=RESIZE_REDUCING_GAP)
+    pixels = np.asarray(thumbnail, dtype=np.float32)
+    if crop_fraction[0] < 1:
+        pixels = pixels.T  # crops are searched for along the first axis
+    crop_length = max(1, round(min(crop_fraction) * len(pixels)))
+    if crop_length >= len(pixels):
+        return 0.5
+
+    if crop_mode == 'entropy':
+        starts = np.unique(np.linspace(0, len(pixels) - crop_length, ENTROPY_CROP_POSITIONS).round().astype(int))
+        entropies = [_get_entropy(pixels[start:start + crop_length]) for start in starts]
+        best_start = starts[int(np.argmax(entropies))]
+    else:
+        line_saliency = np.concatenate(([0], np.cumsum(_get_saliency(pixels).sum(axis=1))))
+        best_start = int(np.argmax(line_saliency[crop_length:] - line_saliency[:-crop_length]))
+    return best_start / (len(pixels) - crop_length)
+
+
+def _get_entropy(pixels):
+    """Returns the Shannon entropy in bits of the histogram of an array of 8 bit gray levels."""
+
+    histogram = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256) / pixels.size
+    histogram = histogram[histogram > 0]
+    return -np.sum(histogram * np.log2(histogram))
+
+
+def _get_saliency(pixels):
+    """Returns a spectral residual saliency map (Hou and Zhang, 2007) of a small grayscale image.
+
+    :param pixels: 2D float array of gray levels
+    :return: 2D float array of the same shape, larger where the image is more salient
+    """
+
+    from scipy import ndimage
+
+    spectrum = np.fft.fft2(pixels)
+    log_amplitude = np.log(np.abs(spectrum) + 1e-8)
+    spectral_residual = log_amplitude - ndimage.uniform_filter(log_amplitude, size=3, mode='nearest')
+    saliency = np.abs(np.fft.ifft2(np.exp(spectral_residual + 1j * np.angle(spectrum)))) ** 2
+    return ndimage.gaussian_filter(saliency, sigma=max(pixels.shape) / 32)
+
+
+def _decode_reduced(image, size):
+    """Decodes an image at the smallest scale its format allows that is at least the given size. JPEGs use their EXIF
+    thumbnail if it is large enough and otherwise are decoded at a reduced DCT scale; other formats are decoded in
+    full.
+
+    :param image: the opened PIL image
+    :param size: the (width, height) the image will be resized to
+    :return: the decoded PIL image
+    """
+
+    if image.format != 'JPEG':
+        return image
+
+    thumbnail = _open_exif_thumbnail(image, size)
+    if thumbnail is not None:
+        return thumbnail
+    image.draft('RGB', size)
+    return image
+
+
+def _open_exif_thumbnail(image, size):
+    """Returns a JPEG's embedded EXIF thumbnail, decoded, if it is at least the given size and has the same aspect
+    ratio as the image, else None.
+
+    :param image: the opened PIL JPEG image
+    :param size: the (width, height) the image will be resized to
+    :return: the decoded thumbnail PIL image, or None
+    """
+
+    exif_data = image.info.get('exif')
+    if not exif_data:
+        return None
+    thumbnail_ifd = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset, length = thumbnail_ifd.get(EXIF_THUMBNAIL_OFFSET), thumbnail_ifd.get(EXIF_THUMBNAIL_LENGTH)
+    if not offset or not length:
+        return None
+
+    header_length = 6 if exif_data.startswith(b'Exif\x00\x00') else 0  # offsets are from the TIFF header after it
+    try:
+        thumbnail = Image.open(io.BytesIO(exif_data[header_length + offset:header_length + offset + length]))
+        if thumbnail.width < size[0] or thumbnail.height < size[1] or \
+                abs(thumbnail.width * image.height / (thumbnail.height * image.width) - 1) > THUMBNAIL_ASPECT_TOLERANCE:
+            return None
+        thumbnail.load()
+    except Exception:
+        return None
+    return thumbnail
+
+
+def convert_to_rgb(image):
+    """Converts an image of any mode to 8 bit RGB. 16 and 32 bit integer images are scaled down from 16 bits rather
+    than clipped, and transparent images are composited onto white.
+
+    :param image: the PIL image
+    :return: the RGB PIL image
+    """
+
+    if image.mode in ('I', 'I;16', 'I;16L', 'I;16B', 'I;16N'):
+        image = Image.fromarray(np.rint(np.clip(np.asarray(image, dtype=np.float32) / 257, 0, 255)).astype(np.uint8))
+    elif image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    elif image.mode in ('LA', 'La', 'PA', 'RGBa'):
+        image = image.convert('RGBA')
+
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+
+def _load_tiles_into(tiles, start, file_paths, crop_mode, crop_positions):
+    """Loads a chunk of images into consecutive rows of a tile array.
+
+    :param tiles: the uint8 array to write the tiles into
+    :param start: the row of the array that the first image is written to
+    :param file_paths: the file paths of the images in the chunk
+    :param crop_mode: how the images are cropped, one of CROP_MODES
+    :param crop_positions: list of the crop position found for each image before, or None where unknown
+    :return: tuple of start, a list of whether each image was loaded and a list of the crop position of each image
+    """
+
+    loaded = []
+    found_crop_positions = []
+    for offset, (file_path, crop_position) in enumerate(zip(file_paths, crop_positions)):
+        tile, crop_position = _load_tile(file_path, tiles.shape[1], tiles.shape[2], crop_mode, crop_position)
+        if tile is not None:
+            tiles[start + offset] = tile
+        loaded.append(tile is not None)
+        found_crop_positions.append(crop_position)
+    return start, loaded, found_crop_positions
+
+
+def _load_tiles_into_file(tiles_file_path, shape, start, file_paths, crop_mode, crop_positions):
+    """Loads a chunk of images into a tile array mapped from a shared file so that tiles aren't pickled back to the
+    parent process.
+
+    :param tiles_file_path: the path of the file holding the raw tile array
+    :param shape: the shape of the tile array
+    :param start: the row of the array that the first image is written to
+    :param file_paths: the file paths of the images in the chunk
+    :param crop_mode: how the images are cropped, one of CROP_MODES
+    :param crop_positions: list of the crop position found for each image before, or None where unknown
+    :return: tuple of start, a list of whether each image was loaded and a list of the crop position of each image
+    """
+
+    tiles = np.memmap(tiles_file_path, dtype=np.uint8, mode='r+', shape=shape)
+    try:
+        return _load_tiles_into(tiles, start, file_paths, crop_mode, crop_positions)
+    finally:
+        tiles.flush()
+        del tiles
+
+
+def _read_back_tiles(tiles_file, tiles):
+    """Reads a raw tile array from a file into an array, a chunk at a time from the end, truncating the file after each
+    chunk so that the tiles are never held in full both in the file and in the array.
+
+    :param tiles_file: the file, opened for reading and writing
+    :param tiles: the C-contiguous uint8 array to read into, of the file's size
+    """
+
+    flat_tiles = tiles.reshape(-1)
+    for end in range(flat_tiles.size, 0, -READ_BACK_CHUNK_BYTES):
+        start = max(0, end - READ_BACK_CHUNK_BYTES)
+        tiles_file.seek(start)
+        if tiles_file.readinto(flat_tiles[start:end]) != end - start:
+            raise OSError(f'The tile file {tiles_file.name!r} ended early.')
+        tiles_file.truncate(start)
+
+
+def _call(function_and_args):
+    """Calls a function with a tuple of arguments, so that functions taking several arguments can be used with
+    imap_unordered.
+    """
+
+    function, args = function_and_args
+    return function(*args)
+
+
+class TileLoader:
+    """A class that decodes and resizes images into tiles in parallel.
+
+    :method load: loads the given images as tiles
+    :method start: starts workers that are shared by the following calls to load
+    :method close: stops the shared workers
+    """
+
+    BACKENDS = ('auto', 'threads', 'processes')
+
+    def __init__(self, tile_height, tile_width, backend='auto', workers=None, crop_mode='stretch'):
+        """Initialise the tile size and executor settings.
+
+        :param tile_height: the height of each tile in pixels
+        :param tile_width: the width of each tile in pixels
+        :param backend: 'threads', 'processes' or 'auto', which uses processes when there is more than one CPU and
+         enough images to make starting them worthwhile (default 'auto')
+        :param workers: the number of threads or processes used (default the number of CPUs)
+        :param crop_mode: how images are fitted to the tile's aspect ratio, one of CROP_MODES, as taken by load_tile
+         (default 'stretch')
+        """
+
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Unknown tile loader backend {backend!r}. Expected one of {", ".join(self.BACKENDS)}.')
+        if crop_mode not in CROP_MODES:
+            raise ValueError(f'Unknown crop mode {crop_mode!r}. Expected one of {", ".join(CROP_MODES)}.')
+
+        self.__tile_height = tile_height
+        self.__tile_width = tile_width
+        self.__backend = backend
+        self.__workers = workers if workers is not None else os.cpu_count() or 1
+        self.__crop_mode = crop_mode
+        self.__pool = None  # the workers started by start, shared by calls to load until close, or None
+        self.__pool_uses_processes = False
+
+    def start(self, image_count):
+        """Starts workers that are shared by the following calls to load until close is called, so that callers that
+        load images in many small batches don't start and stop workers for each one.
+
+        :param image_count: the total number of images expected to be loaded, which the 'auto' backend chooses between
+         threads and processes by
+        """
+
+        self.close()
+        self.__pool_uses_processes = self.__use_processes(image_count)
+        self.__pool = pool.Pool(self.__workers, context=PROCESS_CONTEXT) if self.__pool_uses_processes else \
+            pool.ThreadPool(self.__workers)
+
+    def close(self):
+        """Stops the workers started by start, if any."""
+
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    def load(self, file_paths, progress_callback=None, crop_positions=None):
+        """Decodes, crops and resizes each image into a tile. Images are dispatched to the workers in chunks and each
+        worker writes its uint8 tiles straight into a shared array. With processes, that array is a temporary file,
+        which is read back into the returned array a chunk at a time while being shrunk, so the tiles are never held
+        twice.
+
+        :param file_paths: the file paths of the images
+        :param progress_callback: function called as each chunk finishes with the number of images in it that were
+         loaded and the number that failed to load (default None)
+        :param crop_positions: if given, a dictionary of file paths to the crop positions found for them before, which
+         are used instead of searching again, and which the crop positions found for the other images are added to
+         (default None)
+        :return: tuple of the uint8 tile array with shape (image_count, tile_height, tile_width, 3) and a boolean array
+         of whether each image was loaded (rows of images that failed to load are left uninitialised)
+        """
+
+        shape = (len(file_paths), self.__tile_height, self.__tile_width, 3)
+        loaded = np.zeros(len(file_paths), dtype=bool)
+        if not file_paths:
+            return np.empty(shape, dtype=np.uint8), loaded
+
+        chunk_size = max(1, min(64, math.ceil(len(file_paths) / (self.__workers * 4))))
+        known_crop_positions = crop_positions if crop_positions is not None else {}
+        chunks = [(start, file_paths[start:start + chunk_size],
+                   [known_crop_positions.get(file_path) for file_path in file_paths[start:start + chunk_size]])
+                  for start in range(0, len(file_paths), chunk_size)]
+        found_crop_positions = [None] * len(file_paths)
+
+        use_processes = self.__pool_uses_processes if self.__pool is not None else \
+            self.__use_processes(len(file_paths))
+        if use_processes:
+            file_descriptor, tiles_file_path = tempfile.mkstemp(suffix='.tiles')
+            try:
+                with open(file_descriptor, 'r+b') as tiles_file:
+                    tiles_file.truncate(int(np.prod(shape)))
+                    with self.__get_pool(True) as p:
+                        # each worker unmaps the file after its chunk, so it can be shrunk as it is read back even on
+                        # Windows
+                        self.__collect_results(p.imap_unordered(_call, ((_load_tiles_into_file,
+                                                                         (tiles_file_path, shape, start, chunk,
+                                                                          self.__crop_mode, chunk_crop_positions))
+                                                                        for start, chunk, chunk_crop_positions
+                                                                        in chunks)),
+                                               loaded, found_crop_positions, progress_callback)
+                    tiles = np.empty(shape, dtype=np.uint8)
+                    _read_back_tiles(tiles_file, tiles)
+            finally:
+                os.remove(tiles_file_path)
+        else:
+            tiles = np.empty(shape, dtype=np.uint8)
+            with self.__get_pool(False) as p:
+                self.__collect_results(p.imap_unordered(_call, ((_load_tiles_into, (tiles, start, chunk,
+                                                                                    self.__crop_mode,
+                                                                                    chunk_crop_positions))
+                                                                for start, chunk, chunk_crop_positions in chunks)),
+                                       loaded, found_crop_positions, progress_callback)
+
+        if crop_positions is not None:
+            crop_positions.update((file_path, crop_position) for file_path, crop_position
+                                  in zip(file_paths, found_crop_positions) if crop_position is not None)
+        return tiles, loaded
+
+    @contextlib.contextmanager
+    def __get_pool(self, use_processes):
+        """Gives the workers started by start, or else new workers that are stopped afterwards.
+
+        :param use_processes: whether new workers are processes rather than threads
+        """
+
+        if self.__pool is not None:
+            yield self.__pool
+            return
+        p = pool.Pool(self.__workers, context=PROCESS_CONTEXT) if use_processes else pool.ThreadPool(self.__workers)
+        try:
+            yield p
+        finally:
+            p.terminate()
+            p.join()
+
+    @staticmethod
+    def __collect_results(results, loaded, crop_positions, progress_callback):
+        """Records which images in each finished chunk were loaded and where they were cropped, reporting progress as
+        chunks finish.
+
+        :param results: iterator of (start, list of whether each image was loaded, list of crop positions) tuples in
+         order of completion
+        :param loaded: boolean array to record whether each image was loaded in
+        :param crop_positions: list to record the crop position of each image in
+        :param progress_callback: function called with the number of images loaded and failed in each chunk, or None
+        """
+
+        for start, chunk_loaded, chunk_crop_positions in results:
+            loaded[start:start + len(chunk_loaded)] = chunk_loaded
+            crop_positions[start:start + len(chunk_crop_positions)] = chunk_crop_positions
+            if progress_callback is not None:
+                loaded_count = sum(chunk_loaded)
+                progress_callback(loaded_count, len(chunk_loaded) - loaded_count)
+
+    def __use_processes(self, image_count):
+        """Returns whether images should be loaded in worker processes rather than threads."""
+
+        if self.__backend == 'auto':
+            return self.__workers > 1 and (os.cpu_count() or 1) > 1 and image_count >= self.__workers * 8
+        return self.__backend == 'processes'
@@ -0,0 +1,169 @@
+import numpy as np
+
+
+class TileMatcher:
+    """A class that finds the closest tiles to target cells using blocked matrix distance computations. Tiles are kept
+    in their stored data type (e.g. uint8) and only converted to float64 one block at a time.
+
+    :method nearest: finds the index of the closest tile to each target cell
+    :method nearest_k: finds the indexes of the k closest tiles to each target cell
+    :method rerank: picks the closest tile to each target cell from its own list of candidates
+    :method rerank_k: sorts each target cell's own list of candidates and keeps the k closest
+    """
+
+    def __init__(self, tiles, max_block_elements=2 ** 22):
+        """Initialise the tile matrix and the squared norm of each tile.
+
+        :param tiles: array of tiles with shape (tile_count, ...), each tile is flattened into a row
+        :param max_block_elements: the maximum number of elements in each block of float64 data (default 2 ** 22)
+        """
+
+        self.__tiles = np.reshape(tiles, (len(tiles), -1))
+        self.__max_block_elements = max_block_elements
+        self.__squared_norms = self.__get_squared_norms(self.__tiles)
+
+    def nearest(self, cells, candidate_indexes=None):
+        """Finds the closest candidate tile to each target cell by Euclidean distance.
+
+        :param cells: array of target cells with shape (cell_count, ...), each cell is flattened into a row
+        :param candidate_indexes: indexes of the tiles to consider (default all tiles)
+        :return: tuple of the index of the closest tile to each cell and the squared distance to it
+        """
+
+        indexes, distances = self.nearest_k(cells, 1, candidate_indexes)
+        return indexes[:, 0], distances[:, 0]
+
+    def nearest_k(self, cells, k, candidate_indexes=None):
+        """Finds the k closest candidate tiles to each target cell by Euclidean distance. Squared distances are computed
+        as ||a||² + ||b||² - 2ab in blocks so that the full (cell_count, tile_count) distance matrix is never held in
+        memory.
+
+        :param cells: array of target cells with shape (cell_count, ...), each cell is flattened into a row
+        :param k: the number of tiles to find for each cell, capped at the number of candidates
+        :param candidate_indexes: indexes of the tiles to consider (default all tiles)
+        :return: tuple of (cell_count, k) arrays of tile indexes and squared distances, closest first
+        """
+
+        cells = np.reshape(cells, (len(cells), -1))
+        if candidate_indexes is None:
+            candidate_indexes = np.arange(len(self.__tiles))
+        candidate_indexes = np.asarray(candidate_indexes, dtype=np.intp)
+        k = max(1, min(k, len(candidate_indexes)))
+
+        best_indexes = np.zeros((len(cells), k), dtype=np.intp)
+        best_distances = np.full((len(cells), k), np.inf)
+        if len(cells) == 0 or len(candidate_indexes) == 0:
+            return best_indexes, best_distances
+
+        cell_squared_norms = self.__get_squared_norms(cells)
+        dimensions = cells.shape[1]
+        tile_block_size = max(1, min(len(candidate_indexes),
+                                     self.__max_block_elements // max(dimensions, min(len(cells), 1024))))
+        cell_block_size = max(1, self.__max_block_elements // max(dimensions, tile_block_size + k))
+
+        for tile_start in range(0, len(candidate_indexes), tile_block_size):
+            block_indexes = candidate_indexes[tile_start:tile_start + tile_block_size]
+            tile_block = self.__tiles[block_indexes].astype(np.float64)
+            tile_squared_norms = self.__squared_norms[block_indexes]
+
+            for cell_start in range(0, len(cells), cell_block_size):
+                cell_end = min(cell_start + cell_block_size, len(cells))
+                distances = np.dot(cells[cell_start:cell_end].astype(np.float64), tile_block.T)
+                distances *= -2
+                distances += tile_squared_norms
+                distances += cell_squared_norms[cell_start:cell_end, np.newaxis]
+
+                # merges the block's distances with the best found so far and keeps the k smallest
+                distances = np.concatenate((best_distances[cell_start:cell_end], distances), axis=1)
+                indexes = np.concatenate((best_indexes[cell_start:cell_end],
+                                          np.broadcast_to(block_indexes, (cell_end - cell_start, len(block_indexes)))),
+                                         axis=1)
+                kept = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                best_distances[cell_start:cell_end] = np.take_along_axis(distances, kept, axis=1)
+                best_indexes[cell_start:cell_end] = np.take_along_axis(indexes, kept, axis=1)
+
+        order = np.argsort(best_distances, axis=1)
+        best_distances = np.take_along_axis(best_distances, order, axis=1)
+        np.maximum(best_distances, 0, out=best_distances)  # rounding can make distances slightly negative
+        return np.take_along_axis(best_indexes, order, axis=1), best_distances
+
+    def rerank(self, cells, candidate_indexes):
+        """Picks the closest tile to each target cell from its own list of candidates by exact Euclidean distance.
+
+        :param cells: array of target cells with shape (cell_count, ...), each cell is flattened into a row
+        :param candidate_indexes: (cell_count, k) array of the candidate tile indexes for each cell
+        :return: tuple of the index of the closest candidate tile to each cell and the squared distance to it
+        """
+
+        cells = np.reshape(cells, (len(cells), -1))
+        candidate_indexes = np.asarray(candidate_indexes, dtype=np.intp)
+        best_indexes = np.zeros(len(cells), dtype=np.intp)
+        best_distances = np.full(len(cells), np.inf)
+        if len(cells) == 0 or candidate_indexes.shape[1] == 0:
+            return best_indexes, best_distances
+
+        for start, distances in self.__get_candidate_distances(cells, candidate_indexes):
+            block_candidates = candidate_indexes[start:start + len(distances)]
+            best = np.argmin(distances, axis=1)
+            best_indexes[start:start + len(best)] = block_candidates[np.arange(len(best)), best]
+            best_distances[start:start + len(best)] = distances[np.arange(len(best)), best]
+
+        np.maximum(best_distances, 0, out=best_distances)  # rounding can make distances slightly negative
+        return best_indexes, best_distances
+
+    def rerank_k(self, cells, candidate_indexes, k):
+        """Sorts each target cell's own list of candidates by exact Euclidean distance and keeps the k closest.
+
+        :param cells: array of target cells with shape (cell_count, ...), each cell is flattened into a row
+        :param candidate_indexes: (cell_count, candidate_count) array of the candidate tile indexes for each cell
+        :param k: the number of candidates to keep for each cell, capped at candidate_count
+        :return: tuple of (cell_count, k) arrays of tile indexes and squared distances, closest first
+        """
+
+        cells = np.reshape(cells, (len(cells), -1))
+        candidate_indexes = np.asarray(candidate_indexes, dtype=np.intp)
+        k = max(1, min(k, candidate_indexes.shape[1]))
+        best_indexes = np.zeros((len(cells), k), dtype=np.intp)
+        best_distances = np.full((len(cells), k), np.inf)
+        if len(cells) == 0 or candidate_indexes.shape[1] == 0:
+            return best_indexes, best_distances
+
+        for start, distances in self.__get_candidate_distances(cells, candidate_indexes):
+            order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+            best_indexes[start:start + len(order)] = np.take_along_axis(candidate_indexes[start:start + len(order)],
+                                                                        order, axis=1)
+            best_distances[start:start + len(order)] = np.take_along_axis(distances, order, axis=1)
+
+        np.maximum(best_distances, 0, out=best_distances)  # rounding can make distances slightly negative
+        return best_indexes, best_distances
+
+    def __get_candidate_distances(self, cells, candidate_indexes):
+        """Computes the squared distance from each flattened cell to each of its own candidates in blocks of cells.
+
+        :return: generator of tuples of the first cell in the block and the block's (block_size, candidate_count)
+         squared distances
+        """
+
+        cell_squared_norms = self.__get_squared_norms(cells)
+        block_size = max(1, self.__max_block_elements // (candidate_indexes.shape[1] * max(1, cells.shape[1])))
+
+        for start in range(0, len(cells), block_size):
+            block_candidates = candidate_indexes[start:start + block_size]
+            distances = np.einsum('ikd,id->ik', self.__tiles[block_candidates].astype(np.float64),
+                                  cells[start:start + block_size].astype(np.float64))
+            distances *= -2
+            distances += self.__squared_norms[block_candidates]
+            distances += cell_squared_norms[start:start + block_size, np.newaxis]
+            yield start, distances
+
+    def __get_squared_norms(self, rows):
+        """Returns the squared Euclidean norm of each row, converting to float64 in blocks so that integer rows don't
+        overflow.
+        """
+
+        squared_norms = np.empty(len(rows))
+        block_size = max(1, self.__max_block_elements // max(1, rows.shape[1]))
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size].astype(np.float64)
+            squared_norms[start:start + block_size] = np.einsum('ij,ij->i', block, block)
+        return squared_norms
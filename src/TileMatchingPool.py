@@ -0,0 +1,109 @@
+import os
+import pickle
+from multiprocessing import pool, shared_memory
+import numpy as np
+from TileLoader import PROCESS_CONTEXT
+
+_tile_index = None  # the worker process's copy of the tile index
+_tiles_buffer = None  # the worker process's handle on the shared memory holding the tiles, kept open while in use
+
+
+def _open_tiles(tiles_location):
+    """Opens the tiles shared by the parent process without copying them.
+
+    :param tiles_location: tuple of 'file' and the path of a .npy file to memory map, or of 'shared_memory', the name
+     of the block, and the shape and data type of the tile array
+    :return: the tile array
+    """
+
+    global _tiles_buffer
+
+    if tiles_location[0] == 'file':
+        return np.load(tiles_location[1], mmap_mode='r')
+    name, shape, dtype = tiles_location[1:]
+    _tiles_buffer = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_tiles_buffer.buf)
+
+
+def _initialise_worker(pickled_tile_index, tiles_location):
+    """Unpickles the tile index in a worker process and attaches it to the shared tiles.
+
+    :param pickled_tile_index: the pickled tile index, which leaves out the tiles
+    :param tiles_location: where the tiles are shared, as taken by _open_tiles
+    """
+
+    global _tile_index
+
+    _tile_index = pickle.loads(pickled_tile_index).attach(_open_tiles(tiles_location))
+
+
+def _query(cells, k):
+    """Finds the index of the closest tile, or the indexes and distances of the k closest tiles, to each cell with the
+    worker process's tile index.
+    """
+
+    return _tile_index.query(cells) if k is None else _tile_index.query_k(cells, k)
+
+
+class TileMatchingPool:
+    """A class that matches target cells to tiles in worker processes. The tiles are shared with the workers without
+    copying them, by memory mapping the tile cache's file where the tiles are cached and otherwise through a block of
+    shared memory, and each worker unpickles its own copy of the (tile-less) tile index once. Workers are spawned
+    rather than forked, like the TileLoader's, as pools are started from threaded processes. Every cell is matched
+    independently of the others, so the results are identical to matching in a single process.
+
+    :method submit: starts matching a batch of cells
+    :method close: stops the worker processes and frees the shared tiles
+    """
+
+    def __init__(self, tile_index, tiles, workers):
+        """Starts the worker processes.
+
+        :param tile_index: the fitted TileIndex to match with
+        :param tiles: the tiles the index was fitted to
+        :param workers: the number of worker processes
+        """
+
+        self.__buffer = None
+        if self.__is_whole_file(tiles):
+            tiles_location = ('file', tiles.filename)
+        else:
+            self.__buffer = shared_memory.SharedMemory(create=True, size=max(1, tiles.nbytes))
+            np.copyto(np.ndarray(tiles.shape, dtype=tiles.dtype, buffer=self.__buffer.buf), tiles)
+            tiles_location = ('shared_memory', self.__buffer.name, tiles.shape, tiles.dtype.str)
+
+        self.__pool = pool.Pool(workers, _initialise_worker, (pickle.dumps(tile_index), tiles_location),
+                                context=PROCESS_CONTEXT)
+
+    @staticmethod
+    def __is_whole_file(tiles):
+        """Returns whether the tiles are a memory map of the whole of a .npy file, which workers can map themselves."""
+
+        if not isinstance(tiles, np.memmap) or tiles.filename is None or not os.path.exists(tiles.filename):
+            return False
+        try:
+            file_tiles = np.load(tiles.filename, mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        return file_tiles.shape == tiles.shape and file_tiles.dtype == tiles.dtype and file_tiles.offset == tiles.offset
+
+    def submit(self, cells, k=None):
+        """Starts matching a batch of cells in a worker process.
+
+        :param cells: array with shape (cell_count, tile_height, tile_width, 3)
+        :param k: if given, the number of closest tiles to find for each cell, as with TileIndex.query_k (default None)
+        :return: AsyncResult whose get method returns the index of the closest tile to each cell, or the indexes and
+         distances of the k closest
+        """
+
+        return self.__pool.apply_async(_query, (cells, k))
+
+    def close(self):
+        """Stops the worker processes and frees the shared tiles."""
+
+        self.__pool.terminate()
+        self.__pool.join()
+        if self.__buffer is not None:
+            self.__buffer.close()
+            self.__buffer.unlink()
+            self.__buffer = None
@@ -0,0 +1,104 @@
+import collections
+import contextlib
+import numpy as np
+from TileLoader import TileLoader
+
+
+class TileRenderer:
+    """A class that renders the tiles chosen for a photomosaic at a larger size than they were matched at. Only the
+    chosen tiles are loaded, from their source images, as they are needed, and recently rendered tiles are kept up to a
+    memory limit so that tiles used many times are only loaded once.
+
+    :method get_tile_size: returns the height and width of the rendered tiles
+    :method rendering: shares one set of loading workers between the calls to get_tiles for a photomosaic
+    :method get_tiles: returns the rendered tiles with the given indexes
+    """
+
+    def __init__(self, file_paths, tiles, tile_height, tile_width, cache_bytes, backend='auto', workers=None,
+                 crop_mode='stretch', crop_positions=None):
+        """Initialise the source images and rendered tile size.
+
+        :param file_paths: the path of the image each tile was made from, in tile index order
+        :param tiles: the tiles as they were matched, which are resized instead for images that fail to load again
+        :param tile_height: the height of each rendered tile in pixels
+        :param tile_width: the width of each rendered tile in pixels
+        :param cache_bytes: the maximum number of bytes of rendered tiles kept between calls to get_tiles
+        :param backend: the TileLoader backend used to load the tiles (default 'auto')
+        :param workers: the number of threads or processes used to load the tiles (default the number of CPUs)
+        :param crop_mode: how the images are fitted to the tile's aspect ratio, as taken by TileLoader (default
+         'stretch')
+        :param crop_positions: dictionary of file paths to the positions the images were cropped at when they were
+         matched, so that they are cropped the same way when rendered (default None)
+        """
+
+        self.__file_paths = file_paths
+        self.__tiles = tiles
+        self.__tile_height = tile_height
+        self.__tile_width = tile_width
+        self.__tile_loader = TileLoader(tile_height, tile_width, backend, workers, crop_mode)
+        self.__crop_positions = crop_positions if crop_positions is not None else {}
+        self.__max_cached_tiles = cache_bytes // (tile_height * tile_width * 3)
+        self.__cached_tiles = collections.OrderedDict()  # tile index to rendered tile, least recently used first
+
+    def get_tile_size(self):
+        """Returns the height and width of the rendered tiles."""
+
+        return self.__tile_height, self.__tile_width
+
+    @contextlib.contextmanager
+    def rendering(self, tile_count):
+        """Starts the workers that load tiles once for every call to get_tiles in the block, such as the parts of the
+        rows of one photomosaic, and stops them afterwards.
+
+        :param tile_count: the number of distinct tiles expected to be rendered, which the 'auto' backend chooses
+         between threads and processes by
+        """
+
+        self.__tile_loader.start(tile_count)
+        try:
+            yield self
+        finally:
+            self.__tile_loader.close()
+
+    def get_tiles(self, tile_indexes):
+        """Returns the rendered tiles with the given indexes, loading those that aren't cached in a single batch.
+
+        :param tile_indexes: array of distinct tile indexes
+        :return: uint8 array with shape (len(tile_indexes), tile_height, tile_width, 3)
+        """
+
+        rendered_tiles = np.empty((len(tile_indexes), self.__tile_height, self.__tile_width, 3), dtype=np.uint8)
+        missing = []
+        for position, tile_index in enumerate(tile_indexes.tolist()):
+            tile = self.__cached_tiles.get(tile_index)
+            if tile is None:
+                missing.append(position)
+            else:
+                self.__cached_tiles.move_to_end(tile_index)
+                rendered_tiles[position] = tile
+
+        if missing:
+            missing_indexes = tile_indexes[missing].tolist()
+            tiles, loaded = self.__tile_loader.load([self.__file_paths[tile_index] for tile_index in missing_indexes],
+                                                    crop_positions=self.__crop_positions)
+            for position, tile_index, tile, is_loaded in zip(missing, missing_indexes, tiles, loaded):
+                rendered_tiles[position] = tile if is_loaded else self.__resize_tile(tile_index)
+                self.__cache_tile(tile_index, rendered_tiles[position])
+        return rendered_tiles
+
+    def __resize_tile(self, tile_index):
+        """Returns the matched tile with the given index resized to the rendered tile size."""
+
+        from skimage import transform, util
+
+        tile = np.asarray(self.__tiles[tile_index], dtype=np.float32) / 255
+        return util.img_as_ubyte(np.clip(transform.resize(tile, (self.__tile_height, self.__tile_width)), 0, 1))
+
+    def __cache_tile(self, tile_index, tile):
+        """Keeps a copy of a rendered tile, evicting the least recently used tiles beyond the memory limit."""
+
+        if self.__max_cached_tiles <= 0:
+            return
+        self.__cached_tiles[tile_index] = tile.copy()
+        while len(self.__cached_tiles) > self.__max_cached_tiles:
+            self.__cached_tiles.popitem(last=False)
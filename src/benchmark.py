@@ -0,0 +1,281 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import traceback
+import numpy as np
+from PIL import Image
+from ProgressReporter import get_current_memory
+
+STAGE_UNITS = {'pre_process_target': None, 'pre_process_tiles': 'images/s', 'fit_tile_index': 'tiles/s',
+               'match_tiles': 'cells/s', 'combine_tiles': 'rows/s'}  # the stages the PhotomosaicGenerator reports
+
+
+def parse_args(args=None):
+    """Parses the command line arguments.
+
+    :param args: the arguments to parse (default sys.argv[1:])
+    :return: the parsed arguments
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmark each stage of photomosaic generation on synthesized tile '
+                                                 'libraries and targets. Every photomosaic is generated by the '
+                                                 'PhotomosaicGenerator in a fresh process, each stage is timed by its '
+                                                 'progress reports, and its memory is measured from the end of setup. '
+                                                 'Results are written as JSON.')
+    parser.add_argument('--tiles', type=int, nargs='+', default=[1000, 10000],
+                        help='tile library sizes (default 1000 10000)')
+    parser.add_argument('--grids', type=int, nargs='+', default=[50, 100],
+                        help='grid sizes, each benchmarked as an N x N grid of cells (default 50 100)')
+    parser.add_argument('--stages', nargs='+', choices=tuple(STAGE_UNITS), default=list(STAGE_UNITS),
+                        help='stages to report (default all)')
+    parser.add_argument('--tile-size', type=int, default=20, help='height and width of each tile (default 20)')
+    parser.add_argument('--tile-index', default='kdtree', help='tile index used (default kdtree)')
+    parser.add_argument('--tile-loader-backend', default='auto', help='tile loader backend used (default auto)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each benchmark; the fastest is reported '
+                                                              '(default 1)')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'photomosaic_benchmark'),
+                        help='directory synthesized tile libraries are kept in between runs')
+    parser.add_argument('-o', '--output', help='file to write the JSON results to (default stdout)')
+    return parser.parse_args(args)
+
+
+def synthesize_tiles(tile_count, tile_height, tile_width, seed=0):
+    """Returns tiles of random flat colours with mild noise, similar in statistics to resized photos.
+
+    :param tile_count: the number of tiles
+    :param tile_height: the height of each tile in pixels
+    :param tile_width: the width of each tile in pixels
+    :param seed: the random seed (default 0)
+    :return: uint8 array with shape (tile_count, tile_height, tile_width, 3)
+    """
+
+    rng = np.random.default_rng(seed)
+    tiles = np.empty((tile_count, tile_height, tile_width, 3), dtype=np.uint8)
+    for start in range(0, tile_count, 1024):
+        batch = tiles[start:start + 1024]
+        colours = rng.integers(0, 256, (len(batch), 1, 1, 3))
+        noise = rng.normal(0, 20, batch.shape)
+        np.copyto(batch, np.clip(colours + noise, 0, 255), casting='unsafe')
+    return tiles
+
+
+def synthesize_library(work_dir, tile_count):
+    """Writes a library of synthesized JPEG photos, reusing it if it was written by an earlier run.
+
+    :param work_dir: the directory libraries are kept in
+    :param tile_count: the number of photos in the library
+    :return: the path of the library's directory
+    """
+
+    library_path = os.path.join(work_dir, f'library_{tile_count}')
+    if len(glob.glob(os.path.join(library_path, '*.jpg'))) == tile_count:
+        return library_path
+
+    os.makedirs(library_path, exist_ok=True)
+    photos = synthesize_tiles(tile_count, 12, 16, seed=tile_count)
+    for i, photo in enumerate(photos):
+        Image.fromarray(photo).resize((320, 240), Image.BILINEAR).save(os.path.join(library_path, f'{i:06d}.jpg'),
+                                                                       quality=90)
+    return library_path
+
+
+def synthesize_target(work_dir, size):
+    """Writes a target of smooth gradients with mild noise, reusing it if it was written by an earlier run.
+
+    :param work_dir: the directory targets are kept in
+    :param size: the height and width of the target in pixels
+    :return: the path of the target
+    """
+
+    target_path = os.path.join(work_dir, f'target_{size}.png')
+    if not os.path.exists(target_path):
+        y, x = np.mgrid[0:size, 0:size] * (255 / size)
+        pixels = np.stack((x, y, (x + y) / 2), axis=-1) + np.random.default_rng(3).normal(0, 10, (size, size, 3))
+        os.makedirs(work_dir, exist_ok=True)
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(target_path)
+    return target_path
+
+
+def reset_peak_memory():
+    """Resets the peak resident set size of the process to its current size, on Linux only.
+
+    :return: True if it was reset, else False
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def read_peak_memory():
+    """Returns the peak resident set size of the process in bytes since it was last reset, or None if it can't be read.
+    """
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def run_generator(tile_count, grid_size, args, library_path, target_path):
+    """Generates one photomosaic with the PhotomosaicGenerator, measuring every stage it reports. The libraries are
+    imported and the generator created before anything is measured, so memory is measured from the end of setup.
+    Tiles loaded or matched in worker processes don't count towards the memory of this process.
+
+    :param tile_count: the number of tiles in the library
+    :param grid_size: the number of rows and columns in the grid
+    :param args: the parsed command line arguments
+    :param library_path: the directory of the synthesized library's photos
+    :param target_path: the path of the synthesized target
+    :return: dictionary of the resident memory in bytes at the end of setup and, for each stage, a dictionary of its
+     duration in seconds, the number of items completed, the change in resident memory over the stage and its peak
+     resident memory above that at its start, in bytes (None if it can't be measured)
+    """
+
+    import PhotomosaicGenerator
+
+    PhotomosaicGenerator.warm_up()
+    photomosaic_generator = PhotomosaicGenerator.PhotomosaicGenerator(
+        use_tile_cache=False, tile_index=args.tile_index, tile_loader_backend=args.tile_loader_backend)
+    stages = {}
+    start_memory = {}
+
+    def record_stage(event):
+        if event.kind == event.STARTED:  # match_tiles and combine_tiles are interleaved, so share a peak
+            start_memory[event.stage] = get_current_memory() if reset_peak_memory() else None
+        elif event.kind == event.FINISHED:
+            peak_memory = read_peak_memory() if start_memory[event.stage] is not None else None
+            stages[event.stage] = {'duration_s': event.duration, 'items': event.completed,
+                                   'memory_change_bytes': event.memory_change,
+                                   'peak_rss_increase_bytes': peak_memory - start_memory[event.stage]
+                                   if peak_memory is not None else None}
+
+    photomosaic_generator.add_progress_callback(record_stage)
+    setup_memory = get_current_memory()
+    try:
+        photomosaic_generator.set_target_image(target_path)
+        photomosaic_generator.set_input_directory_path(library_path)
+        photomosaic_generator.pre_process_images(grid_size, grid_size)
+        photomosaic_generator.generate_photomosaic()
+    finally:
+        photomosaic_generator.close()
+    return {'setup_rss_bytes': setup_memory, 'stages': stages}
+
+
+def _send_result(connection, function, args):
+    """Calls a function and sends its result, or the traceback of the exception it raised, through a connection."""
+
+    try:
+        connection.send((True, function(*args)))
+    except BaseException:
+        connection.send((False, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def run_in_process(context, function, args):
+    """Calls a function in a fresh process and returns its result. The process isn't a daemon, as pool workers are, so
+    the function can start processes of its own, e.g. to load or match tiles.
+
+    :param context: the multiprocessing context the process is started from
+    :param function: the function to call, which must be importable by the new process
+    :param args: tuple of the function's arguments
+    :return: the function's return value
+    """
+
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_send_result, args=(sender, function, args))
+    process.start()
+    sender.close()
+    try:
+        succeeded, result = receiver.recv()
+    except EOFError:  # the process died without sending anything
+        succeeded, result = False, None
+    finally:
+        receiver.close()
+        process.join()
+    if not succeeded:
+        raise RuntimeError(f'Benchmark failed:\n{result}' if result is not None else
+                           f'Benchmark process exited with code {process.exitcode}.')
+    return result
+
+
+def benchmark(args):
+    """Runs every requested benchmark, each photomosaic in a fresh process.
+
+    :param args: the parsed command line arguments
+    :return: dictionary of the environment and the results
+    """
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for tile_count in args.tiles:
+        library_path = synthesize_library(args.work_dir, tile_count)
+        for grid_size in args.grids:
+            target_path = synthesize_target(args.work_dir, grid_size * args.tile_size)
+            runs = []
+            for _ in range(args.repeat):
+                runs.append(run_in_process(context, run_generator,
+                                           (tile_count, grid_size, args, library_path, target_path)))
+
+            for stage in args.stages:
+                stage_runs = [run['stages'][stage] for run in runs if stage in run['stages']]
+                if not stage_runs:
+                    continue
+                stage_run = min(stage_runs, key=lambda r: r['duration_s'])
+                results.append({
+                    'stage': stage,
+                    'tiles': tile_count,
+                    'grid': grid_size,
+                    'tile_size': args.tile_size,
+                    'tile_index': args.tile_index,
+                    'tile_loader_backend': args.tile_loader_backend,
+                    'wall_time_s': stage_run['duration_s'],
+                    'items': stage_run['items'],
+                    'throughput': stage_run['items'] / stage_run['duration_s']
+                    if STAGE_UNITS[stage] is not None and stage_run['duration_s'] > 0 else None,
+                    'throughput_unit': STAGE_UNITS[stage],
+                    'setup_rss_bytes': min((run['setup_rss_bytes'] for run in runs), key=lambda b: b or 0),
+                    'memory_change_bytes': stage_run['memory_change_bytes'],
+                    'peak_rss_increase_bytes': max((r['peak_rss_increase_bytes'] for r in stage_runs),
+                                                   key=lambda b: b or 0),
+                })
+                print(f'{stage} tiles={tile_count} grid={grid_size}: {stage_run["duration_s"]:.3f}s', file=sys.stderr)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def main(args=None):
+    """Runs the benchmarks and writes the results as JSON."""
+
+    args = parse_args(args)
+    report = json.dumps(benchmark(args), indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+import time
+
+START_TIME = time.perf_counter()  # taken before the other imports so that the time to the first photomosaic includes
+# them
+
+import argparse
+import csv
+import json
+import os
+import sys
+from PhotomosaicGenerator import PhotomosaicGenerator
+from ProgressReporter import get_peak_memory
+from FrameSequence import FrameSequence
+from ImageWriters import BAND_WRITERS
+from TileIndex import TILE_INDEXES
+
+
+def positive_int(value):
+    """Converts a command line argument or manifest value to an int of at least 1.
+
+    :param value: the value, e.g. '100' or 100
+    :return: the int
+    """
+
+    try:
+        number = int(value) if not isinstance(value, (bool, float)) else None
+    except ValueError:
+        number = None
+    if number is None or number < 1:
+        raise argparse.ArgumentTypeError(f'invalid value {value!r}, expected a whole number of at least 1')
+    return number
+
+
+def create_parser():
+    """Returns the parser of the command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Generate photomosaics without the GUI. Every job reuses the same '
+                                                 'generator, so the tile library is loaded and indexed once for each '
+                                                 'tile size.')
+    parser.add_argument('targets', nargs='*', help='target images to make photomosaics of, or frame sequences with '
+                                                   '--sequence')
+    parser.add_argument('-s', '--source', help='directory of the images used as tiles')
+    parser.add_argument('-m', '--manifest', help='JSON or CSV file of jobs, each with a target and optionally an '
+                                                 'output, source, columns and rows')
+    parser.add_argument('-o', '--output-dir', default='.', help='directory that outputs of jobs without an output '
+                                                                'path are saved in (default the current directory)')
+    parser.add_argument('-f', '--output-format', default='jpg', choices=('jpg', 'png', 'tif', 'dzi'),
+                        help='format of outputs of jobs without an output path: jpg, png, tiled (Big)TIFF or a Deep '
+                             'Zoom pyramid (default jpg)')
+    parser.add_argument('-c', '--columns', type=positive_int, default=100,
+                        help='number of tiles in each row (default 100)')
+    parser.add_argument('-r', '--rows', type=positive_int, default=100,
+                        help='number of tiles in each column (default 100)')
+    parser.add_argument('--tile-index', default='kdtree', choices=tuple(TILE_INDEXES),
+                        help='tile search index (default kdtree)')
+    parser.add_argument('--tile-loader-backend', default='auto', choices=('auto', 'threads', 'processes'),
+                        help='how tiles are decoded in parallel (default auto)')
+    parser.add_argument('--workers', type=int, help='number of threads or processes that decode tiles (default the '
+                                                    'number of CPUs)')
+    parser.add_argument('--match-workers', type=int, help='number of processes that large grids are matched in '
+                                                          '(default the number of CPUs)')
+    parser.add_argument('--max-tile-uses', type=int, help='maximum number of times each tile can be used (default no '
+                                                          'limit)')
+    parser.add_argument('--no-repeat-radius', type=int, default=0, help="number of cells around each cell that can't "
+                                                                         'use the same tile (default 0)')
+    parser.add_argument('--render-scale', type=float, default=1,
+                        help='how many times larger tiles are in the output than the cells they are matched to; only '
+                             'the chosen tiles are loaded at the larger size (default 1)')
+    parser.add_argument('--crop', default='center', choices=('stretch', 'center', 'entropy', 'saliency'),
+                        help='how images are fitted to the aspect ratio of the tiles: stretched, or cropped from the '
+                             'center, the most detailed part or the most salient part (default center)')
+    parser.add_argument('--no-cache', action='store_true', help="don't cache pre-processed tiles next to the source")
+    parser.add_argument('--memory-budget', type=int, help='stream targets too large to pre-process within this many '
+                                                          'bytes')
+    parser.add_argument('--stream', action='store_true', help='stream .png, .tif and .dzi outputs to disk band by '
+                                                              'band instead of holding them in memory')
+    parser.add_argument('--sequence', action='store_true',
+                        help='treat each target as a frame sequence (a directory of images, an animated image, or a '
+                             'video if imageio is installed) and save a photomosaic of every frame in a directory; '
+                             'only the cells that change between frames are matched again (every cell is if the frame '
+                             'size changes enough to change the tile size), and frames are streamed to disk in formats '
+                             'that can be')
+    parser.add_argument('--change-threshold', type=float, default=0,
+                        help='mean difference in 0-255 levels a cell must change by since its tile was matched to be '
+                             'matched again when the grid is reused, e.g. between frames; cells are compared by grid '
+                             'position, so only changes made in place are saved (default 0, any change)')
+    parser.add_argument('--timings', help='JSON file to write the duration, item counts and change in resident memory '
+                                          'of every stage of every job, the peak memory of the process so far, and '
+                                          'the time since startup that each job finished, to')
+    return parser
+
+
+def parse_args(args=None):
+    """Parses the command line arguments.
+
+    :param args: the arguments to parse (default sys.argv[1:])
+    :return: the parsed arguments
+    """
+
+    return create_parser().parse_args(args)
+
+
+def read_manifest(manifest_path):
+    """Reads the jobs in a JSON or CSV manifest.
+
+    :param manifest_path: the path to the manifest, a JSON list of objects or a CSV file with a header row
+    :return: list of job dictionaries
+    """
+
+    with open(manifest_path, newline='') as manifest_file:
+        if os.path.splitext(manifest_path)[1].lower() == '.json':
+            jobs = json.load(manifest_file)
+        else:
+            jobs = [{key: value for key, value in row.items() if value} for row in csv.DictReader(manifest_file)]
+
+    for job in jobs:
+        if 'target' not in job:
+            raise ValueError(f'Job {job} in {manifest_path} has no target.')
+    return jobs
+
+
+def get_jobs(args, parser):
+    """Returns the jobs to run, filling in anything a job doesn't specify from the command line arguments. Jobs with a
+    column or row count below 1 are reported through parser.error, which exits.
+
+    :param args: the parsed command line arguments
+    :param parser: the parser the arguments were parsed with
+    :return: list of job dictionaries with target, output, source, columns and rows. The outputs of frame sequences
+     are directories that the frames are saved in
+    """
+
+    jobs = [{'target': target} for target in args.targets]
+    if args.manifest is not None:
+        jobs.extend(read_manifest(args.manifest))
+
+    for job in jobs:
+        if 'output' not in job:
+            target_name = os.path.splitext(os.path.basename(os.path.normpath(job['target'])))[0]
+            job['output'] = os.path.join(args.output_dir, f'{target_name}_photomosaic' if args.sequence else
+                                         f'{target_name}_photomosaic.{args.output_format}')
+        job.setdefault('source', args.source)
+        if job['source'] is None:
+            raise ValueError(f'Job for {job["target"]} has no source directory. Use --source or give it a source.')
+        for key in ('columns', 'rows'):
+            try:
+                job[key] = positive_int(job.get(key, getattr(args, key)))
+            except argparse.ArgumentTypeError as e:
+                parser.error(f'job for {job["target"]}: {key}: {e}')
+    return jobs
+
+
+def run_job(photomosaic_generator, job, stream):
+    """Generates and saves the photomosaic for a job.
+
+    :param photomosaic_generator: the photomosaic generator, reused between jobs
+    :param job: the job dictionary
+    :param stream: whether outputs in formats that can be streamed are streamed to disk
+    :return: dictionary of the time in seconds taken by each stage
+    """
+
+    timings = {}
+    start_time = time.perf_counter()
+    photomosaic_generator.set_target_image(job['target'])
+    photomosaic_generator.set_input_directory_path(job['source'])
+    photomosaic_generator.pre_process_images(job['columns'], job['rows'])
+    timings['pre_process'] = time.perf_counter() - start_time
+
+    os.makedirs(os.path.dirname(job['output']) or '.', exist_ok=True)
+    stream_file_path = job['output'] if stream and os.path.splitext(job['output'])[1].lower() in BAND_WRITERS else None
+    start_time = time.perf_counter()
+    photomosaic_generator.generate_photomosaic(stream_file_path)
+    timings['generate'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    if stream_file_path is None:
+        photomosaic_generator.save_image(job['output'])
+    timings['save'] = time.perf_counter() - start_time
+    return timings
+
+
+def run_sequence_job(photomosaic_generator, job, output_format):
+    """Generates and saves a photomosaic of every frame of a frame sequence job, as frame_00000.<format> onwards in the
+    job's output directory. The tiles are pre-processed once, and each frame matches only the cells that have changed
+    since the tiles they keep were matched, unless its size changes the tile size, which is reported. Frames in formats
+    that ImageWriters.BAND_WRITERS supports are streamed to disk as they are combined.
+
+    :param photomosaic_generator: the photomosaic generator, reused between jobs
+    :param job: the job dictionary
+    :param output_format: the extension the frames are saved with, without the dot
+    :return: tuple of a dictionary of the time in seconds taken by each stage of all the frames, the number of frames
+     and the number of cells matched
+    """
+
+    frames = FrameSequence(job['target']).read_frames()
+    os.makedirs(job['output'], exist_ok=True)
+    photomosaic_generator.set_input_directory_path(job['source'])
+    timings = {'decode': 0.0, 'pre_process': 0.0, 'generate': 0.0, 'save': 0.0}
+    frame_count = 0
+    matched_cell_count = 0
+    frame_size = None
+    while True:
+        start_time = time.perf_counter()
+        frame = next(frames, None)
+        timings['decode'] += time.perf_counter() - start_time
+        if frame is None:
+            break
+
+        start_time = time.perf_counter()
+        photomosaic_generator.set_target_frame(frame)
+        photomosaic_generator.pre_process_images(job['columns'], job['rows'])
+        timings['pre_process'] += time.perf_counter() - start_time
+
+        output = os.path.join(job['output'], f'frame_{frame_count:05d}.{output_format}')
+        stream_file_path = output if f'.{output_format}' in BAND_WRITERS else None
+        start_time = time.perf_counter()
+        photomosaic_generator.generate_photomosaic(stream_file_path)
+        timings['generate'] += time.perf_counter() - start_time
+        matched_cell_count += photomosaic_generator.get_matched_cell_count()
+        if frame_size is not None and frame.shape[:2] != frame_size and \
+                photomosaic_generator.get_matched_cell_count() == job['columns'] * job['rows']:
+            print(f'  frame {frame_count} is {frame.shape[1]}x{frame.shape[0]} instead of {frame_size[1]}x'
+                  f'{frame_size[0]}, so its tiles were resized and every cell was matched again')
+        frame_size = frame.shape[:2]
+
+        start_time = time.perf_counter()
+        if stream_file_path is None:
+            photomosaic_generator.save_image(output)
+        timings['save'] += time.perf_counter() - start_time
+        frame_count += 1
+    return timings, frame_count, matched_cell_count
+
+
+def write_timings(timings_path, records):
+    """Writes the timing records of the jobs as JSON.
+
+    :param timings_path: the path to write to
+    :param records: list of job timing records
+    """
+
+    os.makedirs(os.path.dirname(timings_path) or '.', exist_ok=True)
+    with open(timings_path, 'w') as timings_file:
+        json.dump(records, timings_file, indent=2)
+
+
+def main(args=None):
+    """Runs every job, reporting the time each stage took, and returns 1 if any failed else 0."""
+
+    parser = create_parser()
+    args = parser.parse_args(args)
+    try:
+        jobs = get_jobs(args, parser)
+    except (OSError, ValueError) as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 1
+    if not jobs:
+        print('error: no targets given. Pass target images or --manifest.', file=sys.stderr)
+        return 1
+
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=not args.no_cache,
+                                                 tile_loader_backend=args.tile_loader_backend,
+                                                 tile_loader_workers=args.workers, tile_index=args.tile_index,
+                                                 memory_budget=args.memory_budget,
+                                                 tile_matcher_workers=args.match_workers,
+                                                 max_tile_uses=args.max_tile_uses,
+                                                 no_repeat_radius=args.no_repeat_radius,
+                                                 render_scale=args.render_scale, crop_mode=args.crop,
+                                                 change_threshold=args.change_threshold)
+    stages = {}
+
+    def record_stage(event):
+        if event.kind == event.FINISHED:  # stages that run once per frame of a sequence are added up
+            stage_record = stages.setdefault(event.stage, {'duration_s': 0.0, 'completed': 0, 'skipped': 0})
+            stage_record['duration_s'] += event.duration
+            stage_record['completed'] += event.completed
+            stage_record['skipped'] += event.skipped
+            stage_record['memory_change_bytes'] = event.memory_change  # of the last run
+            stage_record['process_peak_memory_bytes'] = event.process_peak_memory
+
+    photomosaic_generator.add_progress_callback(record_stage)
+    records = []
+    failures = 0
+    total_start_time = time.perf_counter()
+    for job_number, job in enumerate(jobs, 1):
+        print(f'[{job_number}/{len(jobs)}] {job["target"]} -> {job["output"]} '
+              f'({job["columns"]}x{job["rows"]} tiles from {job["source"]})')
+        stages.clear()
+        record = {'target': job['target'], 'output': job['output']}
+        try:
+            if args.sequence:
+                timings, frame_count, matched_cell_count = run_sequence_job(photomosaic_generator, job,
+                                                                            args.output_format)
+            else:
+                timings = run_job(photomosaic_generator, job, args.stream)
+        except Exception as e:
+            failures += 1
+            record['error'] = str(e)
+            print(f'  failed: {e}', file=sys.stderr)
+        else:
+            stage_durations = {'decode': timings['decode']} if 'decode' in timings else {}
+            stage_durations.update({stage: stage_record['duration_s'] for stage, stage_record in stages.items()})
+            stage_durations['save'] = timings['save']
+            skipped = stages.get('pre_process_tiles', {}).get('skipped', 0)
+            print('  ' + ', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in stage_durations.items()) +
+                  f', total {sum(timings.values()):.2f}s' + (f', {skipped} images skipped' if skipped else ''))
+            record['total_s'] = sum(timings.values())
+            if args.sequence:
+                cell_count = frame_count * job['columns'] * job['rows']
+                record.update({'frames': frame_count, 'fps': frame_count / max(record['total_s'], 1e-9),
+                               'matched_cells': matched_cell_count})
+                print(f'  {frame_count} frames, {record["fps"]:.2f} fps, '
+                      f'{100 * matched_cell_count / max(cell_count, 1):.1f}% of cells matched')
+        record['stages'] = dict(stages)
+        record['process_peak_memory_bytes'] = get_peak_memory()
+        record['since_start_s'] = time.perf_counter() - START_TIME
+        records.append(record)
+
+    photomosaic_generator.close()
+    if args.timings is not None:
+        write_timings(args.timings, records)
+
+    print(f'{len(jobs) - failures}/{len(jobs)} photomosaics generated in {time.perf_counter() - total_start_time:.2f}s')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,103 @@
+import time
+
+START_TIME = time.perf_counter()  # taken before the other imports so that the startup timings include them
+
+import argparse
+import json
 import sys
-from PyQt5 import QtWidgets
+import threading
+from PyQt5 import QtCore, QtWidgets
 import PhotomosaicGenerator
 import GUI
 
 
-def main():
-    """Instantiates the PhotomosaicGenerator and runs the GUI."""
-    photomosaic_generator = PhotomosaicGenerator.PhotomosaicGenerator()
-    app = QtWidgets.QApplication(sys.argv)
+def parse_args(args=None):
+    """Parses the command line arguments, leaving any that aren't recognised for Qt.
+
+    :param args: the arguments to parse (default sys.argv[1:])
+    :return: the parsed arguments and the list of unrecognised arguments
+    """
+
+    parser = argparse.ArgumentParser(description='Run the photomosaic generator GUI.')
+    parser.add_argument('--startup-timing', action='store_true',
+                        help='print the seconds from startup to the first window being shown, the libraries being '
+                             'warmed up and, given --target and --source, the first photomosaic being displayed, as '
+                             'JSON, then exit')
+    parser.add_argument('-t', '--target', help='target image of the photomosaic generated with --startup-timing')
+    parser.add_argument('-s', '--source', help='directory of the images used as tiles with --startup-timing')
+    parser.add_argument('-c', '--columns', type=int, default=100, help='number of columns of tiles with '
+                                                                       '--startup-timing (default 100)')
+    parser.add_argument('-r', '--rows', type=int, default=100, help='number of rows of tiles with --startup-timing '
+                                                                    '(default 100)')
+    return parser.parse_known_args(args)
+
+
+def warm_up(timings):
+    """Imports the libraries the PhotomosaicGenerator uses, recording the seconds since startup at which they were
+    imported.
+
+    :param timings: dictionary that warm_up_s is set in
+    """
+
+    PhotomosaicGenerator.warm_up()
+    timings['warm_up_s'] = time.perf_counter() - START_TIME
+
+
+def measure_startup(app, gui, args, timings, warm_up_thread):
+    """Prints the seconds since startup at which the window was first shown, the libraries were warmed up and, if a
+    target and source are given, the first photomosaic was displayed, then quits the application.
+
+    :param app: the QApplication
+    :param gui: the GUI.Window
+    :param args: the parsed command line arguments
+    :param timings: dictionary of the timings recorded so far, which the others are added to
+    :param warm_up_thread: the thread running warm_up
+    """
+
+    def finish():
+        warm_up_thread.join()
+        print(json.dumps(timings))
+        app.exit(0 if 'error' not in timings else 1)
+
+    def on_generating_photomosaic_finished():
+        if 'first_mosaic_s' not in timings:
+            timings['first_mosaic_s'] = time.perf_counter() - START_TIME
+            if gui.error_msg is not None:
+                timings['error'] = gui.error_msg
+            finish()
+
+    def on_first_window():
+        timings['first_window_s'] = time.perf_counter() - START_TIME
+        if args.target is None or args.source is None:
+            finish()
+            return
+
+        gui.photomosaic_generator.set_target_image(args.target)
+        gui.photomosaic_generator.set_input_directory_path(args.source)
+        gui.x_tiles_spin_box.setValue(args.columns)
+        gui.y_tiles_spin_box.setValue(args.rows)
+        gui.generating_photomosaic_finished.connect(on_generating_photomosaic_finished)
+        gui.generate_photomosaic()
+
+    QtCore.QTimer.singleShot(0, on_first_window)  # runs once the event loop has shown the window
+
+
+def main(args=None):
+    """Shows the GUI, then imports the libraries the PhotomosaicGenerator uses in the background while the user
+    chooses the images.
+    """
+
+    args, qt_args = parse_args(args)
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     app.setQuitOnLastWindowClosed(False)
+    photomosaic_generator = PhotomosaicGenerator.PhotomosaicGenerator()
     gui = GUI.Window(photomosaic_generator)
+
+    timings = {}
+    warm_up_thread = threading.Thread(target=warm_up, args=(timings,), daemon=True)
+    warm_up_thread.start()
+    if args.startup_timing:
+        measure_startup(app, gui, args, timings, warm_up_thread)
     sys.exit(app.exec_())
 
 
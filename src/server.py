@@ -0,0 +1,376 @@
+import argparse
+import hmac
+import io
+import json
+import os
+import secrets
+import socketserver
+import sys
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from PIL import Image
+from FairQueue import FairQueue, QueueFullError
+from ImageWriters import BAND_WRITERS
+from PhotomosaicGenerator import MissingComponentError, PhotomosaicGenerator, warm_up
+from TileIndex import TILE_INDEXES
+from TileLibraryCache import TileLibraryCache
+
+RESPONSE_FORMATS = {'png': ('PNG', 'image/png'), 'jpg': ('JPEG', 'image/jpeg')}
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')  # the names TCP requests can give in their Host header, along with
+# --host, so that pages on other sites can't reach the service by rebinding their domain to this machine
+
+
+def parse_args(args=None):
+    """Parses the command line arguments.
+
+    :param args: the arguments to parse (default sys.argv[1:])
+    :return: the parsed arguments
+    """
+
+    parser = argparse.ArgumentParser(description='Run a local photomosaic rendering service. Tile libraries stay '
+                                                 'loaded and indexed between requests, so that repeat photomosaics '
+                                                 'from the same library skip pre-processing. POST a JSON job (target, '
+                                                 'source, columns, rows and optionally output and format) to '
+                                                 '/mosaics, and GET /status for the queue and the libraries held. '
+                                                 'Every request must have an "Authorization: Bearer <token>" header '
+                                                 'with the token printed at startup.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8765, help='port to listen on (default 8765)')
+    parser.add_argument('--unix-socket', help='listen on this Unix socket path, which only the current user can '
+                                              'connect to, instead of a TCP port')
+    parser.add_argument('--token', help='the token requests must give (default a new random token each launch)')
+    parser.add_argument('--token-file', help='write the token to this file, readable only by the current user')
+    parser.add_argument('--root', action='append', dest='roots',
+                        help='directory that targets and sources must be in, as well as the --source directory (may '
+                             'be given more than once) (default the current directory)')
+    parser.add_argument('--output-root', help='directory that jobs can save photomosaics in (default none, so '
+                                              'photomosaics are only sent back)')
+    parser.add_argument('-s', '--source', help='directory of the images used as tiles by jobs that give no source')
+    parser.add_argument('--jobs', type=int, default=1, help='number of photomosaics generated at once, each from a '
+                                                            'different library (default 1)')
+    parser.add_argument('--max-queue', type=int, default=64, help='number of jobs that can wait before requests are '
+                                                                  'refused (default 64)')
+    parser.add_argument('--library-memory', type=int, help='bytes the loaded libraries can hold before the least '
+                                                           'recently used are unloaded (default no limit)')
+    parser.add_argument('--tile-index', default='kdtree', choices=tuple(TILE_INDEXES),
+                        help='tile search index (default kdtree)')
+    parser.add_argument('--match-workers', type=int, help='number of processes that large grids are matched in '
+                                                          '(default the number of CPUs)')
+    parser.add_argument('--no-cache', action='store_true', help="don't cache pre-processed tiles next to the source")
+    parser.add_argument('--memory-budget', type=int, help='stream targets too large to pre-process within this many '
+                                                          'bytes')
+    return parser.parse_args(args)
+
+
+def resolve_path(path, roots, description):
+    """Returns the real path of a path given by a job, checking that it is inside one of the roots.
+
+    :param path: the path given by the job
+    :param roots: the real paths of the directories the path can be in
+    :param description: what the path is, for the error message
+    :return: the real path, with any symbolic links resolved
+    """
+
+    real_path = os.path.realpath(path)
+    if not any(os.path.commonpath((real_path, root)) == root for root in roots):
+        raise PermissionError(f'{description} {path!r} is not in {" or ".join(map(repr, roots))}.')
+    return real_path
+
+
+def read_job(body, default_source, roots, output_root=None):
+    """Reads and validates a job from the body of a request.
+
+    :param body: the JSON body of the request
+    :param default_source: the source directory of jobs that don't give one, or None
+    :param roots: the real paths of the directories that targets and sources must be in
+    :param output_root: the real path of the directory that outputs must be in, or None if jobs can't give outputs
+     (default None)
+    :return: job dictionary with target, source, columns, rows, output and format, with the real paths of the files
+    """
+
+    try:
+        job = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f'Job is not valid JSON: {e}')
+    if not isinstance(job, dict) or 'target' not in job:
+        raise ValueError('Job has no target.')
+
+    job.setdefault('source', default_source)
+    if job['source'] is None:
+        raise ValueError('Job has no source directory.')
+    job.setdefault('columns', 100)
+    job.setdefault('rows', 100)
+    job.setdefault('output', None)
+    job.setdefault('format', 'png')
+    for key in ('target', 'source', 'output', 'format'):
+        if not isinstance(job[key], str) and (key != 'output' or job[key] is not None):
+            raise ValueError(f'Invalid {key} {job[key]!r}. Expected a string.')
+    for key in ('columns', 'rows'):
+        if not isinstance(job[key], int) or isinstance(job[key], bool) or job[key] < 1:
+            raise ValueError(f'Invalid {key} {job[key]!r}. Expected a whole number of at least 1.')
+    if job['output'] is None and job['format'] not in RESPONSE_FORMATS:
+        raise ValueError(f'Unknown format {job["format"]!r}. Expected one of {", ".join(RESPONSE_FORMATS)}.')
+    for key in ('target', 'source'):
+        job[key] = resolve_path(job[key], roots, key.capitalize())
+        if not os.path.exists(job[key]):
+            raise ValueError(f'{key.capitalize()} {job[key]!r} does not exist.')
+    if job['output'] is not None:
+        if output_root is None:
+            raise PermissionError('Jobs cannot save outputs. Start the server with --output-root to allow them.')
+        job['output'] = resolve_path(job['output'], (output_root,), 'Output')
+    return job
+
+
+def run_job(library_cache, job):
+    """Generates the photomosaic for a job with the warm generator for its library, saving it to the job's output, or
+    encoding it to be sent back if it has none.
+
+    :param library_cache: the TileLibraryCache
+    :param job: the job dictionary
+    :return: dictionary of the duration of each stage, and the encoded photomosaic if the job has no output
+    """
+
+    stages = {}
+
+    def record_stage(event):
+        if event.kind == event.FINISHED:
+            stages[event.stage] = event.duration
+
+    photomosaic_generator = library_cache.acquire(job['source'])
+    photomosaic_generator.add_progress_callback(record_stage)
+    try:
+        photomosaic_generator.set_target_image(job['target'])
+        photomosaic_generator.pre_process_images(job['columns'], job['rows'])
+        output = job['output']
+        stream = output is not None and os.path.splitext(output)[1].lower() in BAND_WRITERS
+        if output is not None:
+            os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        photomosaic_generator.generate_photomosaic(output if stream else None)
+
+        start_time = time.perf_counter()
+        result = {}
+        if output is None:
+            image_format, content_type = RESPONSE_FORMATS[job['format']]
+            image_file = io.BytesIO()
+            Image.fromarray(photomosaic_generator.get_output_image()).save(image_file, image_format, quality=95)
+            result['image'] = image_file.getvalue()
+            result['content_type'] = content_type
+        elif not stream:
+            photomosaic_generator.save_image(output)
+        stages['save'] = time.perf_counter() - start_time
+    finally:
+        photomosaic_generator.remove_progress_callback(record_stage)
+        library_cache.release(job['source'])
+    result['stages'] = stages
+    return result
+
+
+def work(queue, library_cache):
+    """Runs jobs from the queue forever, recording each job's result or error and signalling that it is done.
+
+    :param queue: the FairQueue of jobs
+    :param library_cache: the TileLibraryCache
+    """
+
+    while True:
+        job = queue.get()
+        job['started_time'] = time.perf_counter()
+        try:
+            job['result'] = run_job(library_cache, job)
+        except Exception as e:
+            job['error'] = e
+        finally:
+            job['done'].set()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """A class that handles requests to the rendering service. Jobs are queued for the worker threads and the request
+    waits for its job to finish.
+    """
+
+    server_version = 'PhotomosaicServer/1.0'
+
+    def do_GET(self):
+        """Reports the jobs waiting for each client and the libraries held."""
+
+        if not self.__check_request():
+            return
+        if self.path != '/status':
+            self.__send_json(HTTPStatus.NOT_FOUND, {'error': f'Unknown path {self.path!r}.'})
+            return
+
+        self.__send_json(HTTPStatus.OK, {'uptime_s': time.perf_counter() - self.server.start_time,
+                                         'queue': {str(client): length
+                                                   for client, length in self.server.queue.get_lengths().items()},
+                                         'libraries': self.server.library_cache.get_libraries()})
+
+    def do_POST(self):
+        """Queues a photomosaic job and responds with the photomosaic, or with where it was saved, once it is done."""
+
+        if not self.__check_request():
+            return
+        if self.path != '/mosaics':
+            self.__send_json(HTTPStatus.NOT_FOUND, {'error': f'Unknown path {self.path!r}.'})
+            return
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self.__send_json(HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                             {'error': f'Unsupported content type {content_type!r}. Expected application/json.'})
+            return
+
+        received_time = time.perf_counter()
+        try:
+            job = read_job(self.rfile.read(int(self.headers.get('Content-Length', 0))), self.server.default_source,
+                           self.server.roots, self.server.output_root)
+        except PermissionError as e:
+            self.__send_json(HTTPStatus.FORBIDDEN, {'error': str(e)})
+            return
+        except ValueError as e:
+            self.__send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+
+        job.update({'done': threading.Event(), 'result': None, 'error': None})
+        try:
+            self.server.queue.put(self.headers.get('X-Client-Id', self.address_string()), job)
+        except QueueFullError as e:
+            self.__send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': f'Too busy. {e}'})
+            return
+        job['done'].wait()
+
+        if job['error'] is not None:
+            error = job['error']
+            status = HTTPStatus.BAD_REQUEST if isinstance(error, (ValueError, OSError, MissingComponentError)) else \
+                HTTPStatus.INTERNAL_SERVER_ERROR
+            self.__send_json(status, {'error': str(error) or type(error).__name__})
+            return
+
+        result = job['result']
+        timings = {'queued_s': job['started_time'] - received_time,
+                   'total_s': time.perf_counter() - received_time, 'stages': result['stages']}
+        if 'image' in result:
+            self.__send(HTTPStatus.OK, result['image'], result['content_type'], {'X-Timings': json.dumps(timings)})
+        else:
+            self.__send_json(HTTPStatus.OK, dict(timings, output=job['output']))
+
+    def __check_request(self):
+        """Checks that a request comes from a client of this machine that has the server's token, rather than from a
+        web page in a browser, sending an error response if not.
+
+        :return: True if the request can be handled, else False
+        """
+
+        if 'Origin' in self.headers:  # only browsers send it, and the service has no pages of its own
+            self.__send_json(HTTPStatus.FORBIDDEN, {'error': 'Requests from web pages are not allowed.'})
+            return False
+        if self.server.allowed_hosts is not None:
+            try:
+                host = urlsplit('//' + self.headers.get('Host', '')).hostname
+            except ValueError:
+                host = None
+            if host not in self.server.allowed_hosts:
+                self.__send_json(HTTPStatus.FORBIDDEN, {'error': f'Unknown host {host!r}.'})
+                return False
+        authorization = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization.encode(), f'Bearer {self.server.token}'.encode()):
+            self.__send_json(HTTPStatus.UNAUTHORIZED, {'error': 'Missing or wrong token.'},
+                             {'WWW-Authenticate': 'Bearer'})
+            return False
+        return True
+
+    def address_string(self):
+        """Returns the client's address, which Unix socket connections don't have."""
+
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def __send_json(self, status, content, headers=None):
+        """Sends a JSON response."""
+
+        self.__send(status, json.dumps(content).encode(), 'application/json', headers)
+
+    def __send(self, status, body, content_type, headers=None):
+        """Sends a response with a body."""
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A class for an HTTP server listening on a Unix socket, handling each connection in its own thread."""
+
+    daemon_threads = True
+
+
+def create_server(args):
+    """Creates the server and starts the threads that generate photomosaics, and one that imports the libraries they
+    use so that the first job doesn't wait for them.
+
+    :param args: the parsed command line arguments
+    :return: the server, not yet serving
+    """
+
+    def create_generator():
+        return PhotomosaicGenerator(use_tile_cache=not args.no_cache, tile_index=args.tile_index,
+                                    memory_budget=args.memory_budget, tile_matcher_workers=args.match_workers)
+
+    if args.unix_socket is not None:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)  # left behind by a server that didn't shut down cleanly
+        previous_umask = os.umask(0o177)  # so that the socket is created readable and writable only by its owner
+        try:
+            server = ThreadingUnixHTTPServer(args.unix_socket, RequestHandler)
+        finally:
+            os.umask(previous_umask)
+        server.allowed_hosts = None  # clients of a Unix socket can give any host name
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+        server.daemon_threads = True
+        server.allowed_hosts = {host.lower() for host in LOCAL_HOSTS + (args.host,)}
+
+    server.token = args.token if args.token is not None else secrets.token_urlsafe(32)
+    if args.token_file is not None:
+        file_descriptor = os.open(args.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(file_descriptor, 0o600)  # in case the file already existed
+        with os.fdopen(file_descriptor, 'w') as token_file:
+            token_file.write(server.token)
+    roots = (args.roots or [os.getcwd()]) + ([args.source] if args.source is not None else [])
+    server.roots = [os.path.realpath(root) for root in roots]
+    server.output_root = os.path.realpath(args.output_root) if args.output_root is not None else None
+    threading.Thread(target=warm_up, daemon=True).start()
+    server.queue = FairQueue(args.max_queue)
+    server.library_cache = TileLibraryCache(create_generator, args.library_memory)
+    server.default_source = args.source
+    server.start_time = time.perf_counter()
+    for _ in range(args.jobs):
+        threading.Thread(target=work, args=(server.queue, server.library_cache), daemon=True).start()
+    return server
+
+
+def main(args=None):
+    """Runs the server until it is interrupted."""
+
+    args = parse_args(args)
+    server = create_server(args)
+    address = args.unix_socket if args.unix_socket is not None else f'http://{args.host}:{server.server_port}'
+    print(f'Serving photomosaics on {address} with token {server.token}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.library_cache.close()
+        if args.unix_socket is not None and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import os
+import sys
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+def write_library(directory, count, seed=0, size=(24, 16)):
+    """Writes a library of images of random solid colours with random noise, returning their paths."""
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    file_paths = []
+    for number in range(count):
+        pixels = np.clip(rng.integers(0, 256, 3) + rng.integers(-20, 21, (size[1], size[0], 3)), 0, 255)
+        file_path = os.path.join(directory, f'tile_{number:03d}.png')
+        Image.fromarray(pixels.astype(np.uint8)).save(file_path)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def write_target(file_path, height=120, width=160, seed=1):
+    """Writes a target image of smooth gradients plus noise."""
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack((x * 255 / width, y * 255 / height, (x + y) * 255 / (width + height)), axis=-1)
+    pixels = np.clip(pixels + rng.integers(-10, 11, pixels.shape), 0, 255)
+    Image.fromarray(pixels.astype(np.uint8)).save(file_path)
+    return file_path
+
+
+@pytest.fixture
+def library(tmp_path):
+    """A directory of 40 tile images."""
+
+    directory = str(tmp_path / 'library')
+    write_library(directory, 40)
+    return directory
+
+
+@pytest.fixture
+def target(tmp_path):
+    """The path of a 160x120 target image."""
+
+    return write_target(str(tmp_path / 'target.png'))
@@ -0,0 +1,13 @@
+import json
+import benchmark
+
+
+def test_benchmark_runs_with_process_tile_loader(tmp_path):
+    output_path = tmp_path / 'results.json'
+    benchmark.main(['--tiles', '20', '--grids', '4', '--tile-size', '8', '--tile-loader-backend', 'processes',
+                    '--work-dir', str(tmp_path / 'work'), '-o', str(output_path)])
+
+    results = json.loads(output_path.read_text())['results']
+    assert {result['stage'] for result in results} == set(benchmark.STAGE_UNITS)
+    assert all(result['tile_loader_backend'] == 'processes' and result['wall_time_s'] >= 0 for result in results)
+    assert next(result for result in results if result['stage'] == 'match_tiles')['items'] == 16
@@ -0,0 +1,92 @@
+import json
+import os
+import numpy as np
+import pytest
+from PIL import Image
+import cli
+from conftest import write_target
+
+
+def write_animation(file_path, frame_count=3, height=60, width=80):
+    """Writes an animated GIF of a gradient with a block that moves a little each frame, returning its frames."""
+
+    y, x = np.mgrid[0:height, 0:width]
+    background = np.stack((x * 255 // width, y * 255 // height, np.full_like(x, 128)), axis=-1).astype(np.uint8)
+    frames = []
+    for number in range(frame_count):
+        frame = background.copy()
+        frame[10:20, 10 + 5 * number:20 + 5 * number] = (255, 0, 0)
+        frames.append(frame)
+    images = [Image.fromarray(frame).quantize(256, dither=Image.Dither.NONE) for frame in frames]
+    images[0].save(file_path, save_all=True, append_images=images[1:], duration=100, loop=0)
+    return frames
+
+
+def test_manifest_jobs_are_filled_from_arguments(tmp_path, library):
+    json_manifest = tmp_path / 'jobs.json'
+    json_manifest.write_text(json.dumps([{'target': 'a.png', 'columns': 7}, {'target': 'b.png', 'output': 'b.tif',
+                                                                            'source': 'other', 'rows': '9'}]))
+    csv_manifest = tmp_path / 'jobs.csv'
+    csv_manifest.write_text('target,columns,rows,output\nc.png,5,,\n')
+
+    parser = cli.create_parser()
+    args = parser.parse_args(['x.png', '-m', str(json_manifest), '-s', library, '-c', '11', '-r', '12', '-o', 'out',
+                              '-f', 'png'])
+    assert cli.get_jobs(args, parser) == [
+        {'target': 'x.png', 'output': os.path.join('out', 'x_photomosaic.png'), 'source': library, 'columns': 11,
+         'rows': 12},
+        {'target': 'a.png', 'output': os.path.join('out', 'a_photomosaic.png'), 'source': library, 'columns': 7,
+         'rows': 12},
+        {'target': 'b.png', 'output': 'b.tif', 'source': 'other', 'columns': 11, 'rows': 9}]
+
+    args = parser.parse_args(['-m', str(csv_manifest), '-s', library])
+    assert cli.get_jobs(args, parser) == [{'target': 'c.png', 'output': os.path.join('.', 'c_photomosaic.jpg'),
+                                           'source': library, 'columns': 5, 'rows': 100}]
+
+
+@pytest.mark.parametrize('arguments', [['-c', '0'], ['-r', '-3'], ['-c', 'many']])
+def test_invalid_grid_arguments_are_refused(capsys, target, library, arguments):
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main([target, '-s', library] + arguments)
+    assert exit_info.value.code == 2
+    assert 'at least 1' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('job', [{'columns': 0}, {'rows': -1}, {'columns': 2.5}, {'rows': 'many'}])
+def test_invalid_manifest_grid_sizes_are_refused(capsys, tmp_path, target, library, job):
+    manifest = tmp_path / 'jobs.json'
+    manifest.write_text(json.dumps([dict(job, target=target)]))
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(['-m', str(manifest), '-s', library])
+    assert exit_info.value.code == 2
+    assert f'job for {target}' in capsys.readouterr().err
+
+
+def test_timings_are_written_for_every_job(tmp_path, target, library):
+    other_target = write_target(str(tmp_path / 'other.png'), seed=2)
+    timings_path = tmp_path / 'timings' / 'run.json'
+    assert cli.main([target, other_target, '-s', library, '-c', '8', '-r', '6', '--no-cache',
+                     '-o', str(tmp_path / 'out'), '--timings', str(timings_path)]) == 0
+
+    records = json.loads(timings_path.read_text())
+    assert len(records) == 2
+    for record in records:
+        assert os.path.exists(record['output'])
+        assert {'pre_process_target', 'match_tiles', 'combine_tiles'} <= set(record['stages'])
+        assert record['stages']['match_tiles']['completed'] == 8 * 6
+        assert record['total_s'] > 0 and record['since_start_s'] > 0
+    assert records[1]['stages'].get('pre_process_tiles') is None  # the tiles are loaded once for both jobs
+
+
+def test_sequence_saves_every_frame_in_order(tmp_path, library):
+    animation_path = str(tmp_path / 'clip.gif')
+    frames = write_animation(animation_path)
+    output_path = tmp_path / 'out' / 'clip_photomosaic'
+    timings_path = tmp_path / 'timings.json'
+    assert cli.main([animation_path, '--sequence', '-s', library, '-c', '8', '-r', '6', '-f', 'png', '--no-cache',
+                     '-o', str(tmp_path / 'out'), '--timings', str(timings_path)]) == 0
+
+    assert sorted(os.listdir(output_path)) == [f'frame_{number:05d}.png' for number in range(len(frames))]
+    record = json.loads(timings_path.read_text())[0]
+    assert record['frames'] == len(frames)
+    assert 8 * 6 < record['matched_cells'] < len(frames) * 8 * 6  # later frames only match the cells that moved
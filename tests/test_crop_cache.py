@@ -0,0 +1,28 @@
+import os
+from conftest import write_library
+from CropCache import CropCache
+
+
+def test_crop_positions_are_reused_at_the_same_aspect_ratio(tmp_path):
+    file_paths = write_library(str(tmp_path), 3)
+    CropCache(str(tmp_path), 'entropy', 8, 6).save({file_paths[0]: 0.25, file_paths[1]: 1.0})
+
+    assert CropCache(str(tmp_path), 'entropy', 16, 12).load(file_paths) == {file_paths[0]: 0.25, file_paths[1]: 1.0}
+    assert CropCache(str(tmp_path), 'entropy', 6, 8).load(file_paths) == {}  # another aspect ratio
+    assert CropCache(str(tmp_path), 'saliency', 8, 6).load(file_paths) == {}  # another crop mode
+
+
+def test_changed_image_invalidates_its_crop_position(tmp_path):
+    file_paths = write_library(str(tmp_path), 3)
+    crop_cache = CropCache(str(tmp_path), 'entropy', 8, 6)
+    crop_cache.save({file_path: 0.5 for file_path in file_paths})
+
+    write_library(str(tmp_path), 1, seed=5)  # rewrites tile_000.png
+    stat = os.stat(file_paths[0])
+    os.utime(file_paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    crop_cache = CropCache(str(tmp_path), 'entropy', 8, 6)
+    assert crop_cache.load(file_paths) == {file_paths[1]: 0.5, file_paths[2]: 0.5}
+
+    crop_cache.save({file_paths[0]: 0.75})
+    assert CropCache(str(tmp_path), 'entropy', 8, 6).load(file_paths) == {file_paths[0]: 0.75, file_paths[1]: 0.5,
+                                                                          file_paths[2]: 0.5}
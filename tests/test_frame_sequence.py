@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+import cli
+from FrameSequence import FrameSequence
+from PhotomosaicGenerator import PhotomosaicGenerator
+
+COLOURS = [(200, 30, 30), (30, 200, 30), (30, 30, 200), (220, 220, 40), (40, 220, 220)]
+
+
+def write_animation(file_path, colours=COLOURS, height=60, width=80):
+    """Writes an animated GIF of solid coloured frames with a gray stripe, returning the frames."""
+
+    frames = []
+    for colour in colours:
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = colour
+        frame[:, :10] = 128
+        frames.append(frame)
+    images = [Image.fromarray(frame) for frame in frames]
+    images[0].save(file_path, save_all=True, append_images=images[1:], duration=100, loop=0)
+    return frames
+
+
+def test_animated_gif_frames_are_read_in_order(tmp_path):
+    file_path = str(tmp_path / 'clip.gif')
+    frames = write_animation(file_path)
+    frame_sequence = FrameSequence(file_path)
+    assert frame_sequence.get_frame_count() == len(frames)
+
+    read_frames = list(frame_sequence.read_frames())
+    assert len(read_frames) == len(frames)
+    for read_frame, frame in zip(read_frames, frames):
+        assert np.array_equal(read_frame, frame)
+
+
+def test_directory_frames_are_read_in_name_order(tmp_path):
+    frames = write_animation(str(tmp_path / 'clip.gif'))
+    directory = tmp_path / 'frames'
+    directory.mkdir()
+    for number in reversed(range(len(frames))):  # written out of order
+        Image.fromarray(frames[number]).save(directory / f'frame_{number:03d}.png')
+    (directory / 'notes.txt').write_text('not a frame')
+
+    frame_sequence = FrameSequence(str(directory))
+    assert frame_sequence.get_frame_count() == len(frames)
+    assert all(np.array_equal(read_frame, frame) for read_frame, frame in zip(frame_sequence.read_frames(), frames))
+
+
+def test_directory_without_frames_is_refused(tmp_path):
+    with pytest.raises(ValueError, match='has no frames'):
+        FrameSequence(str(tmp_path))
+
+
+def test_sequence_frames_are_written_in_order(tmp_path, library):
+    file_path = str(tmp_path / 'clip.gif')
+    frames = write_animation(file_path)
+    assert cli.main([file_path, '--sequence', '-s', library, '-c', '8', '-r', '6', '-f', 'png', '--no-cache',
+                     '-o', str(tmp_path / 'out')]) == 0
+
+    output_directory = tmp_path / 'out' / 'clip_photomosaic'
+    file_names = sorted(os.listdir(output_directory))
+    assert file_names == [f'frame_{number:05d}.png' for number in range(len(frames))]
+    for number, file_name in enumerate(file_names):
+        with Image.open(output_directory / file_name) as image:
+            mean_colour = np.asarray(image)[:, image.width // 4:].reshape(-1, 3).mean(axis=0)
+        # each photomosaic is closest in colour to its own frame
+        assert np.argmin(np.abs(np.array(COLOURS) - mean_colour).sum(axis=1)) == number
+
+
+def test_tile_set_is_reused_across_frames(tmp_path, library):
+    frames = write_animation(str(tmp_path / 'clip.gif'))
+    stages = []
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False)
+    photomosaic_generator.add_progress_callback(
+        lambda event: stages.append(event.stage) if event.kind == event.FINISHED else None)
+    photomosaic_generator.set_input_directory_path(library)
+    matched_cell_counts = []
+    for frame in frames + frames[-1:]:
+        photomosaic_generator.set_target_frame(frame)
+        photomosaic_generator.pre_process_images(8, 6)
+        photomosaic_generator.generate_photomosaic()
+        matched_cell_counts.append(photomosaic_generator.get_matched_cell_count())
+    photomosaic_generator.close()
+
+    assert stages.count('pre_process_tiles') == 1
+    assert stages.count('fit_tile_index') == 1
+    assert stages.count('match_tiles') == len(frames) + 1
+    assert matched_cell_counts[-1] == 0  # a repeated frame keeps every tile
@@ -0,0 +1,64 @@
+import math
+import os
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+from ImageWriters import DeepZoomBandWriter, PngBandWriter, TiffBandWriter
+from PhotomosaicGenerator import PhotomosaicGenerator
+
+
+@pytest.fixture
+def pixels():
+    return np.random.default_rng(0).integers(0, 256, (301, 257, 3), dtype=np.uint8)
+
+
+def write_in_bands(band_writer, pixels, band_ends=(1, 41, 141, 148, 300)):
+    with band_writer:
+        for band in np.split(pixels, band_ends):
+            band_writer.write_band(band)
+
+
+def read_image(file_path):
+    if file_path.endswith('.tif'):
+        return tifffile.imread(file_path)
+    with Image.open(file_path) as image:
+        return np.asarray(image)
+
+
+@pytest.mark.parametrize('extension', ['.png', '.tif'])
+@pytest.mark.parametrize('memory_budget', [None, 1])  # a budget of 1 byte streams a row of cells at a time
+def test_streamed_output_equals_output_in_memory(tmp_path, target, library, extension, memory_budget):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, memory_budget=memory_budget)
+    photomosaic_generator.set_target_image(target)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.pre_process_images(20, 15)
+    photomosaic_generator.generate_photomosaic()
+    expected = photomosaic_generator.get_output_image()
+
+    stream_file_path = str(tmp_path / f'mosaic{extension}')
+    photomosaic_generator.generate_photomosaic(stream_file_path)
+    photomosaic_generator.close()
+    assert np.array_equal(read_image(stream_file_path), expected)
+
+
+@pytest.mark.parametrize('band_writer_class, extension', [(PngBandWriter, '.png'), (TiffBandWriter, '.tif')])
+def test_bands_equal_image(tmp_path, pixels, band_writer_class, extension):
+    file_path = str(tmp_path / f'image{extension}')
+    write_in_bands(band_writer_class(file_path, *pixels.shape[:2]), pixels)
+    assert np.array_equal(read_image(file_path), pixels)
+
+
+def test_deep_zoom_tiles_equal_image(tmp_path, pixels):
+    tile_size, overlap = 64, 1
+    write_in_bands(DeepZoomBandWriter(str(tmp_path / 'image.dzi'), *pixels.shape[:2], tile_size, overlap, 'png'),
+                   pixels)
+    assert os.path.exists(tmp_path / 'image.dzi')
+
+    level_path = tmp_path / 'image_files' / str(math.ceil(math.log2(max(pixels.shape))))
+    for row, column in np.ndindex(math.ceil(pixels.shape[0] / tile_size), math.ceil(pixels.shape[1] / tile_size)):
+        top, left = max(0, row * tile_size - overlap), max(0, column * tile_size - overlap)
+        expected = pixels[top:(row + 1) * tile_size + overlap, left:(column + 1) * tile_size + overlap]
+        assert np.array_equal(read_image(str(level_path / f'{column}_{row}.png')), expected)
+    assert len(os.listdir(tmp_path / 'image_files')) == math.ceil(math.log2(max(pixels.shape))) + 1
+    assert read_image(str(tmp_path / 'image_files' / '0' / '0_0.png')).shape[:2] == (1, 1)
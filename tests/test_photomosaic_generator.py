@@ -0,0 +1,148 @@
+import os
+import threading
+import numpy as np
+from PIL import Image
+from conftest import write_library
+from PhotomosaicGenerator import PhotomosaicGenerator
+from TileDescriptors import GridDescriptor
+from TileIndex import DescriptorIndex
+
+
+def generate(photomosaic_generator, target, library, columns=20, rows=15):
+    photomosaic_generator.set_target_image(target)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.pre_process_images(columns, rows)
+    photomosaic_generator.generate_photomosaic()
+    return photomosaic_generator.get_output_image()
+
+
+def test_unchanged_target_matches_no_cells(target, library):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False)
+    first = generate(photomosaic_generator, target, library)
+    second = generate(photomosaic_generator, target, library)
+    assert photomosaic_generator.get_matched_cell_count() == 0
+    assert np.array_equal(first, second)
+
+
+def test_incremental_matching_equals_full_matching(tmp_path, target, library):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False)
+    generate(photomosaic_generator, target, library)
+
+    pixels = np.array(Image.open(target))
+    pixels[:40, :50] = (255, 0, 0)
+    edited = str(tmp_path / 'edited.png')
+    Image.fromarray(pixels).save(edited)
+    incremental = generate(photomosaic_generator, edited, library)
+    assert 0 < photomosaic_generator.get_matched_cell_count() < 20 * 15
+
+    full = generate(PhotomosaicGenerator(use_tile_cache=False), edited, library)
+    assert np.array_equal(incremental, full)
+
+
+def test_change_threshold_follows_drift(target, library):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, change_threshold=4)
+    photomosaic_generator.set_input_directory_path(library)
+    pixels = np.asarray(Image.open(target)).astype(int)
+    matched_cell_counts = []
+    for step in range(7):
+        photomosaic_generator.set_target_frame(np.clip(pixels + step, 0, 255).astype(np.uint8))
+        photomosaic_generator.pre_process_images(20, 15)
+        photomosaic_generator.generate_photomosaic()
+        matched_cell_counts.append(photomosaic_generator.get_matched_cell_count())
+    assert matched_cell_counts[0] == 20 * 15
+    assert matched_cell_counts[1:5] == [0] * 4  # changes of up to 4 levels keep their tiles
+    assert matched_cell_counts[5] > 0  # until they add up past the threshold
+
+
+def test_tile_index_instance_refitted_on_new_library(tmp_path, target, library):
+    small_library = str(tmp_path / 'small_library')
+    write_library(small_library, 7, seed=2)
+    tile_index = DescriptorIndex(GridDescriptor(2))
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, tile_index=tile_index)
+    generate(photomosaic_generator, target, library)
+
+    output = generate(photomosaic_generator, target, small_library)
+    assert photomosaic_generator.get_matched_cell_count() == 20 * 15  # matches with the larger library are stale
+    expected = generate(PhotomosaicGenerator(use_tile_cache=False, tile_index=DescriptorIndex(GridDescriptor(2))),
+                        target, small_library)
+    assert np.array_equal(output, expected)
+
+
+def test_tile_index_instance_refitted_with_tile_cache(tmp_path, target, library):
+    small_library = str(tmp_path / 'small_library')
+    write_library(small_library, 7, seed=2)
+    photomosaic_generator = PhotomosaicGenerator(tile_index=DescriptorIndex(GridDescriptor(2)))
+    generate(photomosaic_generator, target, library)
+    generate(photomosaic_generator, target, small_library)
+    assert photomosaic_generator.get_matched_cell_count() == 20 * 15
+    assert os.path.isdir(os.path.join(small_library, '.photomosaic_cache'))
+
+
+def test_tile_matching_pool_rebuilt_for_refitted_tile_index(tmp_path, target, library):
+    small_library = str(tmp_path / 'small_library')
+    write_library(small_library, 7, seed=2)
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, tile_index=DescriptorIndex(GridDescriptor(2)),
+                                                 tile_matcher_workers=2)
+    photomosaic_generator.PARALLEL_MATCHING_CELLS = 1  # matches even this small grid in worker processes
+    try:
+        generate(photomosaic_generator, target, library)
+        output = generate(photomosaic_generator, target, small_library)
+    finally:
+        photomosaic_generator.close()
+    expected = generate(PhotomosaicGenerator(use_tile_cache=False, tile_index=DescriptorIndex(GridDescriptor(2))),
+                        target, small_library)
+    assert np.array_equal(output, expected)
+
+
+def test_frame_with_new_tile_size_matches_every_cell(target, library):
+    frame = np.array(Image.open(target))
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.set_target_frame(frame)
+    photomosaic_generator.pre_process_images(20, 15)
+    photomosaic_generator.generate_photomosaic()
+
+    smaller = np.array(Image.fromarray(frame).resize((80, 60)))  # halves the tile size
+    photomosaic_generator.set_target_frame(smaller)
+    photomosaic_generator.pre_process_images(20, 15)
+    photomosaic_generator.generate_photomosaic()
+    assert photomosaic_generator.get_matched_cell_count() == 20 * 15
+
+    fresh = PhotomosaicGenerator(use_tile_cache=False)
+    fresh.set_input_directory_path(library)
+    fresh.set_target_frame(smaller)
+    fresh.pre_process_images(20, 15)
+    fresh.generate_photomosaic()
+    assert np.array_equal(photomosaic_generator.get_output_image(), fresh.get_output_image())
+
+
+def test_shifted_frame_matches_every_cell(target, library):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False)
+    photomosaic_generator.set_input_directory_path(library)
+    pixels = np.asarray(Image.open(target))
+    for frame in (pixels, np.roll(pixels, 8, axis=1)):  # cells are compared by grid position, not content
+        photomosaic_generator.set_target_frame(frame)
+        photomosaic_generator.pre_process_images(20, 15)
+        photomosaic_generator.generate_photomosaic()
+    assert photomosaic_generator.get_matched_cell_count() == 20 * 15
+
+
+def test_worker_processes_started_from_a_thread(target, library):
+    outputs = []
+
+    def generate_in_processes():  # like the GUI's worker thread and the server's request threads
+        photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, tile_loader_backend='processes',
+                                                     tile_loader_workers=2, tile_matcher_workers=2)
+        photomosaic_generator.PARALLEL_MATCHING_CELLS = 1
+        try:
+            outputs.append(generate(photomosaic_generator, target, library))
+        finally:
+            photomosaic_generator.close()
+
+    held_lock = threading.Lock()
+    with held_lock:  # held by another thread while the workers start, which a forked worker would inherit held
+        worker_thread = threading.Thread(target=generate_in_processes)
+        worker_thread.start()
+        worker_thread.join(120)
+    assert not worker_thread.is_alive()
+    assert np.array_equal(outputs[0], generate(PhotomosaicGenerator(use_tile_cache=False), target, library))
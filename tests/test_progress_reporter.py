@@ -0,0 +1,40 @@
+import sys
+import numpy as np
+import pytest
+from PhotomosaicGenerator import PhotomosaicGenerator
+from ProgressReporter import ProgressReporter
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='current memory is read from /proc')
+def test_memory_change_is_measured_over_the_stage():
+    events = []
+    progress_reporter = ProgressReporter()
+    progress_reporter.add_callback(events.append)
+    held = np.ones(64 * 1024 * 1024, dtype=np.uint8)  # allocated before the stage, so not counted in it
+    with progress_reporter.stage('allocate'):
+        allocated = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+
+    finished = events[-1]
+    assert finished.kind == finished.FINISHED
+    assert 48 * 1024 * 1024 < finished.memory_change < 100 * 1024 * 1024
+    assert finished.process_peak_memory >= held.nbytes + allocated.nbytes
+
+
+def test_preview_callback_receives_partial_images(target, library):
+    previews = []
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, memory_budget=1)  # combines a row at a time
+    photomosaic_generator.add_preview_callback(previews.append)
+    photomosaic_generator.set_target_image(target)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.pre_process_images(20, 15)
+    photomosaic_generator.generate_photomosaic()
+    output_image = photomosaic_generator.get_output_image()
+    photomosaic_generator.close()
+
+    assert len(previews) == 15
+    combined_rows = [np.count_nonzero(preview.reshape(15, -1).any(axis=1)) for preview in previews]
+    assert combined_rows == list(range(1, 16))  # each preview adds a row of cells, the rest left black
+    for preview in previews[:-1]:
+        assert preview.shape == output_image.shape
+        assert not preview[-8:].any()
+    assert np.array_equal(previews[-1], output_image)  # smaller than PREVIEW_SIZE, so the tiles aren't shrunk
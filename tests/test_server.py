@@ -0,0 +1,56 @@
+import http.client
+import json
+import threading
+import pytest
+import server
+
+
+@pytest.fixture
+def service(tmp_path, target, library):
+    args = server.parse_args(['--port', '0', '--token', 'secret', '--root', str(tmp_path),
+                              '--output-root', str(tmp_path / 'outputs')])
+    photomosaic_server = server.create_server(args)
+    threading.Thread(target=photomosaic_server.serve_forever, daemon=True).start()
+    yield photomosaic_server
+    photomosaic_server.shutdown()
+    photomosaic_server.server_close()
+    photomosaic_server.library_cache.close()
+
+
+def request(photomosaic_server, job, **headers):
+    headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer secret', **headers}
+    connection = http.client.HTTPConnection('127.0.0.1', photomosaic_server.server_port)
+    connection.request('POST', '/mosaics', json.dumps(job), {k: v for k, v in headers.items() if v is not None})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def test_job_is_rendered(service, target, library):
+    assert request(service, {'target': target, 'source': library, 'columns': 4, 'rows': 3}) == 200
+
+
+@pytest.mark.parametrize('headers, status', [
+    ({'Authorization': None}, 401),
+    ({'Authorization': 'Bearer wrong'}, 401),
+    ({'Content-Type': 'text/plain'}, 415),
+    ({'Origin': 'http://example.com'}, 403),
+    ({'Host': 'attacker.example:8765'}, 403),
+])
+def test_untrusted_requests_are_refused(service, target, library, headers, status):
+    assert request(service, {'target': target, 'source': library, 'columns': 4, 'rows': 3}, **headers) == status
+
+
+def test_paths_outside_roots_are_refused(service, tmp_path, target, library):
+    job = {'target': target, 'source': library, 'columns': 4, 'rows': 3}
+    assert request(service, dict(job, target='/etc/hostname')) == 403
+    assert request(service, dict(job, output=str(tmp_path / 'escaped.png'))) == 403
+    assert request(service, dict(job, output=str(tmp_path / 'outputs' / 'mosaic.png'))) == 200
+    assert (tmp_path / 'outputs' / 'mosaic.png').exists()
+
+
+@pytest.mark.parametrize('fields', [{'columns': [3]}, {'rows': 0}, {'columns': -2}, {'rows': 2.5}, {'columns': True},
+                                    {'target': 5}, {'source': ['library']}, {'output': {}}, {'format': ['png']}])
+def test_invalid_job_fields_are_refused(service, target, library, fields):
+    assert request(service, dict({'target': target, 'source': library, 'columns': 4, 'rows': 3}, **fields)) == 400
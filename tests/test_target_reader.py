@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+from PhotomosaicGenerator import PhotomosaicGenerator
+from TargetReader import TargetReader
+from TileLoader import convert_to_rgb
+
+BANDS = ((0, 37), (37, 100), (100, 101), (20, 60), (150, 301))  # out of order bands restart PNGs from the top
+
+
+@pytest.fixture
+def pixels():
+    pixels = np.random.default_rng(0).integers(0, 256, (301, 257, 4), dtype=np.uint8)
+    pixels[:, :100] = np.linspace(0, 255, 100, dtype=np.uint8)[None, :, None]  # smooth, so PNG filters are used
+    return pixels
+
+
+def write_rgb_png(file_path, pixels):
+    Image.fromarray(pixels[:, :, :3]).save(file_path)
+
+
+def write_rgba_png(file_path, pixels):
+    Image.fromarray(pixels).save(file_path)
+
+
+def write_palette_png(file_path, pixels):
+    Image.fromarray(pixels[:, :, :3]).quantize(200).save(file_path, transparency=bytes(range(200)))
+
+
+def write_gray_alpha_png(file_path, pixels):
+    Image.fromarray(pixels[:, :, [0, 3]], 'LA').save(file_path)
+
+
+def write_uncompressed_tiff(file_path, pixels):
+    tifffile.imwrite(file_path, pixels[:, :, :3])
+
+
+def write_deflate_tiff(file_path, pixels):
+    tifffile.imwrite(file_path, pixels[:, :, :3], compression='zlib', rowsperstrip=5)
+
+
+def write_tiled_tiff(file_path, pixels):
+    tifffile.imwrite(file_path, pixels[:, :, :3], compression='zlib', tile=(64, 48))
+
+
+def write_gray_16_bit_tiff(file_path, pixels):
+    tifffile.imwrite(file_path, pixels[:, :, 0].astype(np.uint16) * 257, byteorder='>')
+
+
+@pytest.mark.parametrize('write, extension', [
+    (write_rgb_png, '.png'), (write_rgba_png, '.png'), (write_palette_png, '.png'), (write_gray_alpha_png, '.png'),
+    (write_uncompressed_tiff, '.tif'), (write_deflate_tiff, '.tif'), (write_tiled_tiff, '.tif'),
+    (write_gray_16_bit_tiff, '.tif')])
+def test_bands_equal_whole_image(tmp_path, pixels, write, extension):
+    file_path = str(tmp_path / f'target{extension}')
+    write(file_path, pixels)
+    with Image.open(file_path) as image:
+        expected = np.asarray(convert_to_rgb(image))
+
+    target_reader = TargetReader(file_path, max_bytes=100000)
+    try:
+        assert target_reader.get_memory_usage() == 0  # read in bands, so never held whole
+        assert target_reader.get_size() == expected.shape[:2]
+        for first_row, last_row in BANDS:
+            assert np.array_equal(target_reader.read_rows(first_row, last_row), expected[first_row:last_row])
+    finally:
+        target_reader.close()
+
+
+def test_unstreamable_image_is_reduced_to_fit(tmp_path, pixels):
+    file_path = str(tmp_path / 'target.jpg')
+    Image.fromarray(pixels[:, :, :3]).save(file_path)
+
+    target_reader = TargetReader(file_path, max_bytes=30000)
+    try:
+        height, width = target_reader.get_size()
+        assert 0 < target_reader.get_memory_usage() <= 30000
+        assert target_reader.get_memory_usage() == height * width * 3
+        assert target_reader.read_rows(3, 9).shape == (6, width, 3)
+    finally:
+        target_reader.close()
+
+
+def test_streamed_target_equals_whole_target(target, library):
+    outputs = []
+    for memory_budget in (1, None):  # a budget of 1 byte streams the target a row of cells at a time
+        photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, memory_budget=memory_budget)
+        photomosaic_generator.set_target_image(target)
+        photomosaic_generator.set_input_directory_path(library)
+        photomosaic_generator.pre_process_images(20, 15)
+        photomosaic_generator.generate_photomosaic()
+        outputs.append(photomosaic_generator.get_output_image())
+        photomosaic_generator.close()
+    assert np.array_equal(*outputs)
+
+
+def test_streamed_target_reopened_after_close(target, library):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, memory_budget=1)
+    photomosaic_generator.set_target_image(target)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.pre_process_images(20, 15)
+    photomosaic_generator.generate_photomosaic()
+    first = photomosaic_generator.get_output_image()
+    photomosaic_generator.close()
+
+    photomosaic_generator.generate_photomosaic()
+    assert np.array_equal(photomosaic_generator.get_output_image(), first)
+    photomosaic_generator.close()
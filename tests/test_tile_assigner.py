@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from PhotomosaicGenerator import PhotomosaicGenerator
+from TileAssigner import TileAssigner
+from TileDescriptors import GridDescriptor
+from TileIndex import DescriptorIndex
+
+ROW_COUNT = 6
+COLUMN_COUNT = 8
+
+
+@pytest.fixture
+def tiles():
+    return np.random.default_rng(0).integers(0, 256, (30, 4, 4, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def cells():
+    return np.random.default_rng(1).integers(0, 256, (ROW_COUNT * COLUMN_COUNT, 4, 4, 3), dtype=np.uint8)
+
+
+def assign(tile_assigner, tiles, cells):
+    tile_index = DescriptorIndex(GridDescriptor(2), 'brute', rerank_count=len(tiles)).fit(tiles)
+    k = min(tile_assigner.get_candidate_count(), len(tiles))
+    candidate_indexes, candidate_distances = tile_index.query_k(cells, k)
+    return tile_assigner.assign(np.reshape(candidate_indexes, (ROW_COUNT, COLUMN_COUNT, k)),
+                                np.reshape(candidate_distances, (ROW_COUNT, COLUMN_COUNT, k)), tile_index, len(tiles),
+                                lambda cell_numbers: cells[cell_numbers])
+
+
+def get_repeats(assignments, radius):
+    """Returns the number of cells that share a tile with another cell within the radius."""
+
+    repeats = 0
+    for row, column in np.ndindex(assignments.shape):
+        window = assignments[max(0, row - radius):row + radius + 1, max(0, column - radius):column + radius + 1]
+        repeats += np.count_nonzero(window == assignments[row, column]) > 1
+    return repeats
+
+
+def test_unconstrained_assignment_is_nearest_tile(tiles, cells):
+    tile_assigner = TileAssigner(max_tile_uses=len(cells))
+    distances = ((cells.reshape(len(cells), 1, -1).astype(float) - tiles.reshape(1, len(tiles), -1)) ** 2).sum(axis=2)
+    nearest = np.argmin(distances, axis=1).reshape(ROW_COUNT, COLUMN_COUNT)
+    assert np.array_equal(assign(tile_assigner, tiles, cells), nearest)
+
+
+@pytest.mark.parametrize('max_tile_uses, no_repeat_radius', [(2, 0), (None, 1), (None, 2), (2, 1)])
+def test_assignment_respects_constraints(tiles, cells, max_tile_uses, no_repeat_radius):
+    assignments = assign(TileAssigner(max_tile_uses, no_repeat_radius), tiles, cells)
+    assert assignments.shape == (ROW_COUNT, COLUMN_COUNT)
+    assert (assignments >= 0).all() and (assignments < len(tiles)).all()
+    if max_tile_uses is not None:
+        assert np.bincount(assignments.ravel()).max() <= max_tile_uses
+    assert get_repeats(assignments, no_repeat_radius) == 0
+
+
+def test_tight_limit_uses_every_tile(tiles, cells):
+    assignments = assign(TileAssigner(max_tile_uses=2), tiles[:24], cells)
+    assert (np.bincount(assignments.ravel(), minlength=24) == 2).all()
+
+
+def test_infeasible_limit_is_refused(tiles, cells):
+    with pytest.raises(ValueError, match='Cannot fill 48 cells with 30 tiles'):
+        assign(TileAssigner(max_tile_uses=1), tiles, cells)
+
+
+@pytest.mark.parametrize('max_tile_uses, no_repeat_radius', [(0, 0), (None, -1)])
+def test_invalid_constraints_are_refused(max_tile_uses, no_repeat_radius):
+    with pytest.raises(ValueError):
+        TileAssigner(max_tile_uses, no_repeat_radius)
+
+
+def test_generator_refuses_infeasible_limit(target, library):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, max_tile_uses=1)
+    photomosaic_generator.set_target_image(target)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.pre_process_images(10, 5)  # 50 cells but only 40 tiles
+    with pytest.raises(ValueError, match='Increase the maximum tile uses'):
+        photomosaic_generator.generate_photomosaic()
+    photomosaic_generator.close()
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+from conftest import write_library
+from TileCache import TileCache
+from TileIndex import TILE_INDEXES, create_tile_index
+from TileLoader import load_tile
+
+
+class CountingPreProcessor:
+    """Pre-processes tiles like the generator does, recording which images were pre-processed."""
+
+    def __init__(self, tile_height=8):
+        self.file_paths = []
+        self.tile_height = tile_height
+
+    def __call__(self, file_paths):
+        self.file_paths.extend(file_paths)
+        return [load_tile(file_path, self.tile_height, 6) for file_path in file_paths]
+
+
+def load(library, file_paths, tile_height=8):
+    tile_cache = TileCache(library, tile_height, 6, np.uint8)
+    pre_process_tiles = CountingPreProcessor(tile_height)
+    tiles = tile_cache.load(file_paths, pre_process_tiles)
+    return tile_cache, tiles, pre_process_tiles.file_paths
+
+
+def test_unchanged_images_are_read_from_cache(tmp_path):
+    file_paths = write_library(str(tmp_path), 10)
+    first_cache, first_tiles, pre_processed = load(str(tmp_path), file_paths)
+    assert pre_processed == file_paths
+
+    second_cache, second_tiles, pre_processed = load(str(tmp_path), file_paths)
+    assert pre_processed == []
+    assert np.array_equal(first_tiles, second_tiles)
+    assert second_cache.get_tiles_file_name() == first_cache.get_tiles_file_name()
+
+
+def test_changed_added_and_removed_images_invalidate_cache(tmp_path):
+    file_paths = write_library(str(tmp_path), 10)
+    first_cache = load(str(tmp_path), file_paths)[0]
+
+    write_library(str(tmp_path), 1, seed=5)  # rewrites tile_000.png
+    stat = os.stat(file_paths[0])
+    os.utime(file_paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    tile_cache, tiles, pre_processed = load(str(tmp_path), file_paths)
+    assert pre_processed == file_paths[:1]
+    assert tile_cache.get_tiles_file_name() != first_cache.get_tiles_file_name()
+    assert np.array_equal(tiles[0], load_tile(file_paths[0], 8, 6))
+
+    tile_cache, tiles, pre_processed = load(str(tmp_path), file_paths[1:])
+    assert pre_processed == []
+    assert len(tiles) == 9
+    assert tile_cache.get_tile_file_paths() == file_paths[1:]
+
+
+@pytest.mark.parametrize('tile_index_name', [name for name in TILE_INDEXES
+                                             if create_tile_index(name).get_cache_key() is not None])
+def test_saved_index_queries_like_fitted_index(tmp_path, tile_index_name):
+    file_paths = write_library(str(tmp_path), 30)
+    tile_cache, tiles = load(str(tmp_path), file_paths)[:2]
+    fitted = create_tile_index(tile_index_name).fit(tiles)
+    tile_cache.save_index(fitted.get_cache_key(), fitted)
+
+    tile_cache, tiles = load(str(tmp_path), file_paths)[:2]
+    loaded = tile_cache.load_index(fitted.get_cache_key(), create_tile_index(tile_index_name))
+    assert loaded is not None
+    loaded.attach(tiles)
+
+    cells = np.random.default_rng(2).integers(0, 256, (50,) + tiles.shape[1:], dtype=np.uint8)
+    assert np.array_equal(loaded.query(cells), fitted.query(cells))
+
+
+def test_index_is_not_unpickled(tmp_path):
+    file_paths = write_library(str(tmp_path), 10)
+    tile_cache, tiles = load(str(tmp_path), file_paths)[:2]
+    tile_index = create_tile_index('kdtree')
+    tiles_file_stem = os.path.splitext(tile_cache.get_tiles_file_name())[0]
+    index_path = os.path.join(str(tmp_path), TileCache.CACHE_DIRECTORY_NAME,
+                              f'{tiles_file_stem}.{tile_index.get_cache_key()}.npz')
+    np.savez(index_path, descriptors=np.array([object()] * len(tiles)))  # only loadable by unpickling
+
+    assert tile_cache.load_index(tile_index.get_cache_key(), tile_index) is None
+
+
+def test_least_recently_used_tile_sizes_are_removed(tmp_path):
+    file_paths = write_library(str(tmp_path), 5)
+    cache_directory_path = tmp_path / TileCache.CACHE_DIRECTORY_NAME
+    tile_heights = range(8, 8 + TileCache.MAX_CACHED_KEYS)
+    for tile_height in tile_heights:
+        load(str(tmp_path), file_paths, tile_height)
+    for age, tile_height in enumerate(reversed(tile_heights), 1):  # the first size loaded is the least recently used
+        os.utime(cache_directory_path / f'tiles_{tile_height}x6_uint8_stretch.json', (0, 10 ** 9 - age))
+
+    assert load(str(tmp_path), file_paths, 8)[2] == []  # reusing the first size makes the second the least recent
+    load(str(tmp_path), file_paths, 20)
+
+    file_names = os.listdir(cache_directory_path)
+    assert not any(file_name.startswith('tiles_9x6_') for file_name in file_names)
+    for tile_height in [8, *tile_heights[2:], 20]:
+        assert f'tiles_{tile_height}x6_uint8_stretch.json' in file_names
+        assert sum(file_name.startswith(f'tiles_{tile_height}x6_') and file_name.endswith('.npy')
+                   for file_name in file_names) == 1
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from TileDescriptors import GridDescriptor
+from TileIndex import TILE_INDEXES, ClusterIndex, DescriptorIndex, create_tile_index
+
+TILE_COUNT = 60
+
+
+@pytest.fixture
+def tiles():
+    return np.random.default_rng(0).integers(0, 256, (TILE_COUNT, 8, 6, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def cells():
+    return np.random.default_rng(1).integers(0, 256, (40, 8, 6, 3), dtype=np.uint8)
+
+
+def get_squared_distances(cells, tiles):
+    rows = np.reshape(cells, (len(cells), 1, -1)).astype(np.float64)
+    return ((rows - np.reshape(tiles, (1, len(tiles), -1))) ** 2).sum(axis=2)
+
+
+@pytest.mark.parametrize('tile_index_name', TILE_INDEXES)
+def test_tiles_find_themselves(tiles, tile_index_name):
+    tile_index = create_tile_index(tile_index_name).fit(tiles)
+    assert np.array_equal(tile_index.query(tiles), np.arange(TILE_COUNT))
+
+    indexes, distances = tile_index.query_k(tiles, 4)
+    assert np.array_equal(indexes[:, 0], np.arange(TILE_COUNT))
+    assert np.allclose(distances[:, 0], 0)
+    assert np.all(np.diff(distances, axis=1) >= 0)
+
+
+@pytest.mark.parametrize('tile_index_name', [name for name in TILE_INDEXES if name != 'lab'])
+def test_k_nearest_distances_are_pixel_distances(tiles, cells, tile_index_name):
+    indexes, distances = create_tile_index(tile_index_name).fit(tiles).query_k(cells, 4)
+    assert np.allclose(distances, np.take_along_axis(get_squared_distances(cells, tiles), indexes, axis=1))
+
+
+@pytest.mark.parametrize('tile_index', [ClusterIndex(n_clusters=1),  # each searches or re-ranks every tile
+                                        DescriptorIndex(GridDescriptor(2), 'kdtree', TILE_COUNT),
+                                        DescriptorIndex(GridDescriptor(4), 'brute', TILE_COUNT)])
+def test_exhaustive_indexes_equal_brute_force(tiles, cells, tile_index):
+    expected_distances = get_squared_distances(cells, tiles)
+    tile_index.fit(tiles)
+    assert np.array_equal(tile_index.query(cells), np.argmin(expected_distances, axis=1))
+
+    indexes, distances = tile_index.query_k(cells, 5)
+    assert np.array_equal(indexes, np.argsort(expected_distances, axis=1)[:, :5])
+    assert np.allclose(distances, np.sort(expected_distances, axis=1)[:, :5])
+
+
+@pytest.mark.parametrize('tile_index_name', TILE_INDEXES)
+def test_k_nearest_searches_only_candidates(tiles, cells, tile_index_name):
+    candidate_indexes = np.arange(1, TILE_COUNT, 3)
+    indexes = create_tile_index(tile_index_name).fit(tiles).query_k(cells, 4, candidate_indexes)[0]
+    assert indexes.shape == (len(cells), 4)
+    assert np.isin(indexes, candidate_indexes).all()
+    assert all(len(set(cell_indexes)) == 4 for cell_indexes in indexes)
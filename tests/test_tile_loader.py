@@ -0,0 +1,180 @@
+import io
+import struct
+import numpy as np
+import pytest
+from PIL import Image
+import TileLoader
+from conftest import write_library
+from TileLoader import TileLoader as Loader, convert_to_rgb, load_tile
+
+STORED_TRANSPOSES = {2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180,
+                     4: Image.Transpose.FLIP_TOP_BOTTOM, 5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_90,
+                     7: Image.Transpose.TRANSVERSE, 8: Image.Transpose.ROTATE_270}  # undo each EXIF orientation
+
+
+@pytest.fixture
+def photo():
+    """A 600x450 image of smooth gradients with a few sharp shapes."""
+
+    y, x = np.mgrid[0:450, 0:600]
+    pixels = np.stack((x * 255 // 600, y * 255 // 450, (x + y) * 255 // 1050), axis=-1).astype(np.uint8)
+    pixels[100:200, 150:300] = (250, 240, 20)
+    pixels[300:420, 400:560] = (20, 30, 200)
+    return pixels
+
+
+def get_quadrants():
+    """Returns a 60x40 RGB image whose quadrants are red, green, blue and white, so any rotation or flip shows."""
+
+    pixels = np.zeros((60, 40, 3), dtype=np.uint8)
+    pixels[:30, :20] = (255, 0, 0)
+    pixels[:30, 20:] = (0, 255, 0)
+    pixels[30:, :20] = (0, 0, 255)
+    pixels[30:, 20:] = (255, 255, 255)
+    return pixels
+
+
+def write_exif_thumbnail_jpeg(file_path, pixels, thumbnail_size):
+    """Writes a JPEG with an EXIF block holding a thumbnail of it of the given (width, height)."""
+
+    thumbnail_file = io.BytesIO()
+    Image.fromarray(pixels).resize(thumbnail_size, Image.Resampling.LANCZOS).save(thumbnail_file, 'JPEG', quality=95)
+    thumbnail = thumbnail_file.getvalue()
+    tiff = b'II*\x00' + struct.pack('<I', 8)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x0112, 3, 1, 1) + struct.pack('<I', 26)  # IFD0: orientation
+    tiff += struct.pack('<H', 2) + struct.pack('<HHII', 0x0201, 4, 1, 56) + \
+        struct.pack('<HHII', 0x0202, 4, 1, len(thumbnail)) + struct.pack('<I', 0)  # IFD1: the thumbnail
+    Image.fromarray(pixels).save(file_path, quality=95, exif=b'Exif\x00\x00' + tiff + thumbnail)
+
+
+def decode_in_full(file_path, tile_height, tile_width):
+    """Returns the tile of a whole image decoded at full resolution and resized."""
+
+    with Image.open(file_path) as image:
+        image.load()
+        return np.asarray(image.convert('RGB').resize((tile_width, tile_height), Image.Resampling.BILINEAR,
+                                                      reducing_gap=TileLoader.RESIZE_REDUCING_GAP))
+
+
+def test_process_backend_matches_thread_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(TileLoader, 'READ_BACK_CHUNK_BYTES', 1000)  # reads the tiles back over several chunks
+    file_paths = write_library(str(tmp_path), 12) + [str(tmp_path / 'missing.png')]
+    thread_tiles, thread_loaded = Loader(10, 7, backend='threads', workers=2).load(file_paths)
+    process_tiles, process_loaded = Loader(10, 7, backend='processes', workers=2).load(file_paths)
+
+    assert np.array_equal(process_loaded, thread_loaded)
+    assert process_loaded.tolist() == [True] * 12 + [False]
+    assert np.array_equal(process_tiles[:12], thread_tiles[:12])
+    assert np.array_equal(process_tiles[0], load_tile(file_paths[0], 10, 7))
+
+
+@pytest.mark.parametrize('orientation', STORED_TRANSPOSES)
+def test_exif_rotated_jpeg_loads_upright(tmp_path, orientation):
+    upright = get_quadrants()
+    file_path = str(tmp_path / f'rotated_{orientation}.jpg')
+    exif = Image.Exif()
+    exif[TileLoader.EXIF_ORIENTATION] = orientation
+    Image.fromarray(upright).transpose(STORED_TRANSPOSES[orientation]).save(file_path, quality=95, subsampling=0,
+                                                                            exif=exif.tobytes())
+
+    tile = load_tile(file_path, 12, 8).astype(int)
+    assert tile.shape == (12, 8, 3)
+    for rows, columns in ((slice(0, 5), slice(0, 3)), (slice(0, 5), slice(5, 8)), (slice(7, 12), slice(0, 3)),
+                          (slice(7, 12), slice(5, 8))):  # each quadrant away from the edges blurred by resizing
+        assert np.abs(tile[rows, columns] - upright[::5, ::5][rows, columns]).max() <= 12
+
+
+def test_modes_convert_to_rgb():
+    rgb = np.random.default_rng(0).integers(0, 256, (6, 5, 3), dtype=np.uint8)
+    gray = rgb[:, :, 0]
+    alpha = rgb[:, :, 1]
+
+    palette_image = Image.fromarray(rgb).quantize(256)
+    assert np.array_equal(np.asarray(convert_to_rgb(palette_image)), np.asarray(palette_image.convert('RGB')))
+    palette_image.info['transparency'] = int(np.asarray(palette_image)[0, 0])
+    assert np.array_equal(np.asarray(convert_to_rgb(palette_image))[0, 0], (255, 255, 255))  # composited onto white
+
+    gray_alpha = np.asarray(convert_to_rgb(Image.fromarray(np.stack((gray, alpha), axis=-1), 'LA'))).astype(int)
+    expected = (gray.astype(int) * alpha + 255 * (255 - alpha.astype(int))) / 255
+    assert np.abs(gray_alpha - expected[:, :, None]).max() <= 1
+
+    cmyk = convert_to_rgb(Image.fromarray(rgb).convert('CMYK'))
+    assert cmyk.mode == 'RGB' and np.array_equal(np.asarray(cmyk), rgb)
+
+    sixteen_bit = convert_to_rgb(Image.fromarray(gray.astype(np.uint16) * 257))
+    assert np.array_equal(np.asarray(sixteen_bit), np.repeat(gray[:, :, None], 3, axis=2))
+
+
+def test_draft_decoded_jpeg_matches_full_decode(tmp_path, photo):
+    file_path = str(tmp_path / 'photo.jpg')
+    Image.fromarray(photo).save(file_path, quality=95)
+    with Image.open(file_path) as image:
+        assert TileLoader._decode_reduced(image, (40, 30)).size == (75, 57)  # decoded at an eighth of the size
+
+    tile = load_tile(file_path, 30, 40).astype(int)
+    assert np.abs(tile - decode_in_full(file_path, 30, 40)).mean() < 2
+
+
+def test_exif_thumbnail_matches_full_decode(tmp_path, photo):
+    file_path = str(tmp_path / 'photo.jpg')
+    write_exif_thumbnail_jpeg(file_path, photo, (160, 120))
+    with Image.open(file_path) as image:
+        assert TileLoader._decode_reduced(image, (40, 30)).size == (160, 120)  # the thumbnail is used
+        assert TileLoader._decode_reduced(image, (200, 150)).size != (160, 120)  # but not if it is too small
+
+    tile = load_tile(file_path, 30, 40).astype(int)
+    assert np.abs(tile - decode_in_full(file_path, 30, 40)).mean() < 3
+
+
+def write_crop_test_image(file_path, feature_start, crop_mode, landscape=True):
+    """Writes a 300x100 image (100x300 if not landscape) that is gray with faint noise, like a photo of a plain wall,
+    except for a feature spanning a third of its length from feature_start along its long side: blocks of random
+    colours for the entropy crop, or a bright spot for the saliency crop.
+    """
+
+    rng = np.random.default_rng(0)
+    pixels = (128 + rng.integers(-3, 4, (100, 300, 3))).astype(np.uint8)
+    if crop_mode == 'entropy':
+        pixels[:, feature_start:feature_start + 100] = rng.integers(0, 256, (10, 10, 3)).repeat(10, 0).repeat(10, 1)
+    else:
+        pixels[40:60, feature_start + 40:feature_start + 60] = 255
+    Image.fromarray(pixels if landscape else np.ascontiguousarray(pixels.transpose(1, 0, 2))).save(file_path)
+
+
+@pytest.mark.parametrize('crop_mode', ['entropy', 'saliency'])
+@pytest.mark.parametrize('feature_start, expected_position', [(0, 0), (100, 0.5), (200, 1)])
+@pytest.mark.parametrize('landscape', [True, False])
+def test_crop_modes_find_feature(tmp_path, crop_mode, feature_start, expected_position, landscape):
+    file_path = str(tmp_path / 'image.png')
+    write_crop_test_image(file_path, feature_start, crop_mode, landscape)
+    crop_positions = {}
+    tiles, loaded = Loader(10, 10, backend='threads', crop_mode=crop_mode).load([file_path],
+                                                                                 crop_positions=crop_positions)
+
+    assert loaded.all()
+    assert abs(crop_positions[file_path] - expected_position) <= 0.1
+    assert tiles[0].std() > 20 if crop_mode == 'entropy' else tiles[0].max() > 180  # the feature is in the tile
+
+
+def test_center_and_stretch_crops():
+    thirds = np.zeros((100, 300, 3), dtype=np.uint8)
+    thirds[:, :100] = (255, 0, 0)
+    thirds[:, 100:200] = (0, 255, 0)
+    thirds[:, 200:] = (0, 0, 255)
+    file_path = io.BytesIO()
+    Image.fromarray(thirds).save(file_path, 'PNG')
+
+    center_tile = load_tile(file_path, 10, 10, 'center')  # the edge columns are blended with the thirds either side
+    assert np.array_equal(center_tile[:, 1:-1], np.broadcast_to(np.array([0, 255, 0], dtype=np.uint8), (10, 8, 3)))
+
+    file_path.seek(0)
+    stretch_tile = load_tile(file_path, 10, 30, 'stretch')
+    assert np.array_equal(stretch_tile[:, :9], np.broadcast_to(np.array([255, 0, 0], dtype=np.uint8), (10, 9, 3)))
+    assert np.array_equal(stretch_tile[:, -9:], np.broadcast_to(np.array([0, 0, 255], dtype=np.uint8), (10, 9, 3)))
+
+
+def test_known_crop_position_is_used(tmp_path):
+    file_path = str(tmp_path / 'image.png')
+    write_crop_test_image(file_path, 200, 'entropy')
+    left_tile = load_tile(file_path, 10, 10, 'entropy', crop_position=0)
+    assert np.abs(left_tile.astype(int) - 128).max() <= 3  # the plain crop given, not the one searched for
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from TileMatcher import TileMatcher
+
+
+@pytest.fixture
+def tiles():
+    return np.random.default_rng(0).integers(0, 256, (50, 4, 3, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def cells():
+    return np.random.default_rng(1).uniform(0, 255, (30, 4, 3, 3))
+
+
+def get_squared_distances(cells, tiles):
+    rows = np.reshape(cells, (len(cells), 1, -1)).astype(np.float64)
+    return ((rows - np.reshape(tiles, (1, len(tiles), -1))) ** 2).sum(axis=2)
+
+
+@pytest.mark.parametrize('max_block_elements', [2 ** 22, 100])  # 100 splits the tiles and cells into many blocks
+def test_nearest_k_equals_brute_force(tiles, cells, max_block_elements):
+    expected_distances = get_squared_distances(cells, tiles)
+    expected_indexes = np.argsort(expected_distances, axis=1)[:, :5]
+
+    indexes, distances = TileMatcher(tiles, max_block_elements).nearest_k(cells, 5)
+    assert np.array_equal(indexes, expected_indexes)
+    assert np.allclose(distances, np.take_along_axis(expected_distances, expected_indexes, axis=1))
+
+    indexes, distances = TileMatcher(tiles, max_block_elements).nearest(cells)
+    assert np.array_equal(indexes, expected_indexes[:, 0])
+
+
+def test_nearest_searches_only_candidates(tiles, cells):
+    candidate_indexes = np.arange(3, 50, 4)
+    expected_distances = get_squared_distances(cells, tiles[candidate_indexes])
+
+    indexes, distances = TileMatcher(tiles, 100).nearest_k(cells, 3, candidate_indexes)
+    assert np.array_equal(indexes, candidate_indexes[np.argsort(expected_distances, axis=1)[:, :3]])
+    assert np.allclose(distances, np.sort(expected_distances, axis=1)[:, :3])
+
+
+def test_rerank_k_sorts_each_cells_candidates(tiles, cells):
+    candidate_indexes = np.random.default_rng(2).permuted(np.tile(np.arange(50), (len(cells), 1)), axis=1)[:, :8]
+    expected_distances = np.take_along_axis(get_squared_distances(cells, tiles), candidate_indexes, axis=1)
+    order = np.argsort(expected_distances, axis=1)
+
+    indexes, distances = TileMatcher(tiles, 100).rerank_k(cells, candidate_indexes, 3)
+    assert np.array_equal(indexes, np.take_along_axis(candidate_indexes, order, axis=1)[:, :3])
+    assert np.allclose(distances, np.take_along_axis(expected_distances, order, axis=1)[:, :3])
+
+    indexes, distances = TileMatcher(tiles, 100).rerank(cells, candidate_indexes)
+    assert np.array_equal(indexes, np.take_along_axis(candidate_indexes, order, axis=1)[:, 0])
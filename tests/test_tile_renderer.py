@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import TileLoader
+from PhotomosaicGenerator import PhotomosaicGenerator
+
+
+def generate(target, library, **kwargs):
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, **kwargs)
+    photomosaic_generator.set_target_image(target)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.pre_process_images(20, 15)
+    photomosaic_generator.generate_photomosaic()
+    output_image = photomosaic_generator.get_output_image()
+    photomosaic_generator.close()
+    return output_image
+
+
+@pytest.mark.parametrize('tile_loader_backend', ['threads', 'processes'])
+def test_rendered_output_shrinks_to_matched_output(target, library, tile_loader_backend):
+    matched = generate(target, library).astype(int)  # 8x8 tiles
+    rendered = generate(target, library, render_scale=2, tile_loader_backend=tile_loader_backend,
+                        tile_loader_workers=2)
+    assert rendered.shape == (2 * matched.shape[0], 2 * matched.shape[1], 3)
+
+    shrunk = rendered.reshape(matched.shape[0], 2, matched.shape[1], 2, 3).mean(axis=(1, 3))
+    assert np.abs(shrunk - matched).mean() < 3  # the same tiles, loaded at 16x16 instead of 8x8
+
+
+def test_rendering_starts_loading_workers_once(target, library, monkeypatch):
+    started_pools = []
+    thread_pool = TileLoader.pool.ThreadPool
+    monkeypatch.setattr(TileLoader.pool, 'ThreadPool', lambda *args: started_pools.append(args) or thread_pool(*args))
+    monkeypatch.setattr(PhotomosaicGenerator, 'RENDER_BAND_BYTES', 1)  # renders each row of cells separately
+
+    photomosaic_generator = PhotomosaicGenerator(use_tile_cache=False, render_scale=2, tile_loader_backend='threads')
+    photomosaic_generator.set_target_image(target)
+    photomosaic_generator.set_input_directory_path(library)
+    photomosaic_generator.pre_process_images(20, 15)
+    started_pools.clear()
+    photomosaic_generator.generate_photomosaic()
+    photomosaic_generator.close()
+    assert len(started_pools) == 1